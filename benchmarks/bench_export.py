@@ -0,0 +1,61 @@
+"""
+Export benchmark, time and peak RSS of exporting a json database to html and
+markdown. Every export runs in its own process so the peak RSS is its own
+
+    python benchmarks/bench_export.py --count 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.corpus import write_database  # noqa: E402
+from benchmarks.process import run_measured  # noqa: E402
+
+
+def export(format: str, db_file: str, output: str):
+    from mark.db import export_bookmarks_to_html, export_bookmarks_to_markdown
+
+    if format == "html":
+        export_bookmarks_to_html(db_file, output, force=True)
+    else:
+        export_bookmarks_to_markdown(db_file, output, force=True, heading=3)
+
+
+def measure(format: str, db_file: str, output: str):
+    """elapsed seconds and peak RSS in MiB of one export process"""
+    _, elapsed, rss = run_measured(
+        [sys.executable, __file__, "--run", format, db_file, output], cwd=ROOT
+    )
+    return elapsed, rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--run", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        export(*args.run)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "bookmarks.json")
+        write_database(db_file, args.count)
+        size = os.path.getsize(db_file) / (1 << 20)
+        print(f"{args.count} bookmarks, {size:.0f} MiB database")
+        for format in ("html", "md"):
+            output = os.path.join(tmp, f"exported.{format}")
+            elapsed, rss = measure(format, db_file, output)
+            rate = args.count / elapsed
+            print(
+                f"{format:>4}: {elapsed:.2f}s ({rate:.0f} entries/sec),"
+                f" peak RSS {rss:.0f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
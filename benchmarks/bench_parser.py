@@ -0,0 +1,47 @@
+"""
+Netscape import throughput benchmark. `--mark` times the parser of another
+checkout, so a change can be compared with the tree it started from
+
+    python benchmarks/bench_parser.py --count 500000
+    python benchmarks/bench_parser.py --count 500000 --mark ../mark-baseline
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import write_netscape_file  # noqa: E402
+
+FLAGS = {"clean_title": False, "remove_if_empty": False}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=500_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--mark", help="checkout whose parser is timed")
+    args = parser.parse_args()
+
+    if args.mark:
+        sys.path.insert(0, os.path.abspath(args.mark))
+    # the entry point every version of the parser has
+    from mark.parser import parse_netscape_bookmark_file
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bookmarks.html")
+        write_netscape_file(path, args.count)
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            bookmarks = parse_netscape_bookmark_file(path, (None, None), "add", FLAGS)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    count = sum(len(rows) for rows in bookmarks.values())
+    print(f"parsed {count} bookmarks in {best:.2f}s ({count / best:.0f} entries/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Page title extraction benchmark, BeautifulSoup over the whole page against
+the streaming `TitleExtractor` over chunks, on the fixture pages padded with
+`--body-size` KiB of body markup. Needs bs4 and lxml, the bench extras
+
+    pip install -e ".[bench]"
+
+    python benchmarks/bench_title.py --body-size 2048
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mark.titles import CHUNK_SIZE, extract_title  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PARAGRAPH = b"<div class='c1'><p>lorem <a href='/x'>ipsum</a> dolor sit</p></div>\n"
+
+
+def load_pages(body_size: int):
+    pages = {}
+    padding = PARAGRAPH * (body_size * 1024 // len(PARAGRAPH))
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "*.html"))):
+        with open(path, "rb") as handle:
+            page = handle.read()
+        pages[os.path.basename(path)] = page.replace(b"</body>", padding + b"</body>")
+    return pages
+
+
+def soup_title(page: bytes):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(page, "lxml")
+    return soup.title.string if soup.title else None
+
+
+def streamed_title(page: bytes):
+    chunks = (page[i:i + CHUNK_SIZE] for i in range(0, len(page), CHUNK_SIZE))
+    return extract_title(chunks)
+
+
+def best_of(func, page: bytes, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(page)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--body-size", type=int, default=1024, help="KiB")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, page in load_pages(args.body_size).items():
+        soup = best_of(soup_title, page, args.repeat)
+        streamed = best_of(streamed_title, page, args.repeat)
+        print(f"{name} ({len(page) // 1024} KiB)")
+        print(f"  bs4+lxml  {soup * 1000:8.2f} ms  {soup_title(page)!r}")
+        print(f"  streamed  {streamed * 1000:8.2f} ms  {streamed_title(page)!r}")
+
+
+if __name__ == "__main__":
+    main()
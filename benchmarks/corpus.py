@@ -0,0 +1,88 @@
+"""
+Deterministic synthetic bookmark corpora used by the benchmarks
+"""
+import random
+from typing import Iterator, Tuple
+
+HEADER = (
+    "<!DOCTYPE NETSCAPE-Bookmark-file-1>\n"
+    '<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">\n'
+    "<TITLE>Bookmarks</TITLE>\n"
+    "<H1>Bookmarks</H1>\n"
+    "<DL><p>\n"
+)
+WORDS = (
+    "python rust linux kernel async html parser bookmark menu rofi release notes"
+    " guide tutorial docs api reference blog news video talk paper wiki issue"
+).split()
+
+
+# (min, max) words of a title and segments of an url path
+TITLE_WORDS = (2, 10)
+PATH_SEGMENTS = (1, 5)
+
+
+def iter_bookmarks(
+    count: int,
+    fanout: int = 50,
+    seed: int = 0,
+    title_words: Tuple[int, int] = TITLE_WORDS,
+    path_segments: Tuple[int, int] = PATH_SEGMENTS,
+) -> Iterator[Tuple[str, str, str]]:
+    """
+    Yield `count` (folder, title, url) triples spread over folders of about
+    `fanout` bookmarks, the same seed always gives the same corpus. Title and
+    url path lengths are uniform over the `title_words` and `path_segments`
+    ranges
+    """
+    rng = random.Random(seed)
+    folder = None
+    for i in range(count):
+        if folder is None or rng.random() < 1 / fanout:
+            folder = "folder %d %s" % (i, rng.choice(WORDS))
+        title = " ".join(rng.choices(WORDS, k=rng.randint(*title_words)))
+        path = "/".join(rng.choices(WORDS, k=rng.randint(*path_segments)))
+        host = "%s%d.example.com" % (rng.choice(WORDS), i % 997)
+        url = "https://%s/%s?id=%d" % (host, path, i)
+        yield folder, title, url
+
+
+def write_netscape_file(path: str, count: int, **options):
+    """
+    Write a Netscape bookmark export holding `count` bookmarks, `options` are
+    passed to `iter_bookmarks`
+    """
+    with open(path, "w") as file:
+        file.write(HEADER)
+        current = None
+        for folder, title, url in iter_bookmarks(count, **options):
+            if folder != current:
+                if current is not None:
+                    file.write("</DL><p>\n")
+                file.write(
+                    '<DT><H3 ADD_DATE="1600000000" LAST_MODIFIED="1600000000">'
+                    "%s</H3>\n<DL><p>\n" % folder
+                )
+                current = folder
+            file.write(
+                '<DT><A HREF="%s" ADD_DATE="1600000000" ICON="">%s</A>\n'
+                % (url.replace("&", "&amp;"), title)
+            )
+        if current is not None:
+            file.write("</DL><p>\n")
+        file.write("</DL><p>\n")
+
+
+def write_database(path: str, count: int, **options):
+    """
+    Write a json database holding `count` bookmarks, laid out as tinydb does,
+    `options` are passed to `iter_bookmarks`
+    """
+    import orjson
+
+    tables = {}
+    for folder, title, url in iter_bookmarks(count, **options):
+        table = tables.setdefault(folder, {})
+        table[str(len(table) + 1)] = {"title": title, "url": url}
+    with open(path, "wb") as file:
+        file.write(orjson.dumps(tables))
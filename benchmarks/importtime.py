@@ -0,0 +1,172 @@
+"""
+Startup import cost of every `mark` subcommand, measured with `-X importtime`
+while the real command runs through the `mark` entry point on a small fixture
+
+    python benchmarks/importtime.py [--save FILE] [--baseline FILE]
+
+External programs are replaced by stand-ins on PATH: rofi exits at once as if
+the menu was cancelled and the clipboard holds a url, so `get` and `insert`
+import everything they would before showing a menu. The daemon is stopped once
+it is serving.
+
+With --baseline, subcommands slower than the baseline by more than --threshold
+percent are reported and the script exits with status 1.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.corpus import write_database, write_netscape_file  # noqa: E402
+
+ENTRY_POINT = "from mark.cli import cli; cli()"
+# arguments of every measured command, run in a fresh copy of the fixture
+COMMANDS = {
+    "get": ["get", "--client", "dmenu", "bookmarks.json"],
+    "insert": ["insert", "--client", "dmenu", "bookmarks.json"],
+    "import": ["import", "bookmarks.html", "-o", "imported.json"],
+    "export": ["export", "bookmarks.json", "-o", "exported.html"],
+    "daemon": ["daemon", "bookmarks.json"],
+    "migrate": ["migrate", "bookmarks.json", "bookmarks.sqlite"],
+    "search": ["search", "bookmarks.json", "-q", "python"],
+    "titles": ["titles", "bookmarks.json"],
+    "snapshot": ["snapshot", "bookmarks.json"],
+}
+STAND_INS = {
+    # a cancelled menu
+    "rofi": "exit 1",
+    "wl-paste": "printf https://example.com/copied",
+    "wl-copy": "cat > /dev/null",
+}
+FIXTURE_SIZE = 200
+
+
+def write_fixture(path: str):
+    import orjson
+
+    os.makedirs(os.path.join(path, "bin"))
+    for name, script in STAND_INS.items():
+        program = os.path.join(path, "bin", name)
+        with open(program, "w") as file:
+            file.write(f"#!/bin/sh\n{script}\n")
+        os.chmod(program, 0o755)
+    write_netscape_file(os.path.join(path, "bookmarks.html"), FIXTURE_SIZE)
+    db_file = os.path.join(path, "bookmarks.json")
+    write_database(db_file, FIXTURE_SIZE)
+    # one bookmark without a title, so `titles` goes as far as fetching. Its
+    # url is not http, so nothing is requested
+    with open(db_file, "rb") as file:
+        tables = orjson.loads(file.read())
+    tables["untitled"] = {"1": {"url": "file:///dev/null", "title": ""}}
+    with open(db_file, "wb") as file:
+        file.write(orjson.dumps(tables))
+
+
+def run_command(fixture: str, args) -> str:
+    """stderr of one run of `mark args` in a fresh copy of `fixture`"""
+    with tempfile.TemporaryDirectory() as tmp:
+        work = os.path.join(tmp, "work")
+        shutil.copytree(fixture, work)
+        python_path = [ROOT, os.getenv("PYTHONPATH")]
+        env = {
+            **os.environ,
+            "PATH": os.path.join(work, "bin") + os.pathsep + os.environ["PATH"],
+            "PYTHONPATH": os.pathsep.join(filter(None, python_path)),
+            "XDG_CACHE_HOME": os.path.join(work, "cache"),
+            "XDG_RUNTIME_DIR": work,
+            "WAYLAND_DISPLAY": "importtime",
+        }
+        command = [sys.executable, "-X", "importtime", "-c", ENTRY_POINT, *args]
+        proc = subprocess.Popen(
+            command,
+            cwd=work,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        if args[0] == "daemon":
+            stop_when_serving(proc, work)
+        _, stderr = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(f"mark {' '.join(args)} failed:\n{stderr[-2000:]}")
+        return stderr
+
+
+def stop_when_serving(proc: subprocess.Popen, runtime_dir: str, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not glob.glob(os.path.join(runtime_dir, "mark-*.sock")):
+        if proc.poll() is not None or time.monotonic() > deadline:
+            proc.kill()
+            return
+        time.sleep(0.01)
+    proc.send_signal(signal.SIGTERM)
+
+
+def measure(fixture: str, args, repeat: int):
+    """Best total import time in ms and the slowest modules of one run"""
+    best, slowest = None, None
+    for _ in range(repeat):
+        rows = []
+        for line in run_command(fixture, args).splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, _, name = line.split("|")
+            rows.append((int(self_us.split(":")[1]), name.strip()))
+        total = sum(us for us, _ in rows) / 1000
+        if best is None or total < best:
+            best = total
+            slowest = [name for _, name in sorted(rows, reverse=True)[:5]]
+    return best, slowest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--baseline", help="json file saved by a previous run")
+    parser.add_argument("--threshold", type=float, default=20.0)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        fixture = os.path.join(tmp, "fixture")
+        write_fixture(fixture)
+        for command, command_args in COMMANDS.items():
+            total, slowest = measure(fixture, command_args, args.repeat)
+            results[command] = total
+            print(f"{command:<8} {total:8.1f} ms   {', '.join(slowest)}")
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        limit = 1 + args.threshold / 100
+        regressions = [
+            command
+            for command, total in results.items()
+            if total > baseline.get(command, float("inf")) * limit
+        ]
+        for command in regressions:
+            print(
+                f"REGRESSION {command}: {baseline[command]:.1f} ms ->"
+                f" {results[command]:.1f} ms"
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Run a benchmark step in its own process, so its peak RSS is not that of an
+earlier step
+"""
+import os
+import subprocess
+import time
+from typing import List, Optional, Tuple
+
+
+def run_measured(
+    command: List[str], cwd: str = None, capture: bool = False
+) -> Tuple[Optional[bytes], float, float]:
+    """
+    run `command` and return its stdout when `capture` is set, the elapsed
+    seconds and the peak RSS of the process in MiB. Raises RuntimeError when
+    it fails
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        command, cwd=cwd, stdout=subprocess.PIPE if capture else None
+    )
+    output = proc.stdout.read() if capture else None
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError(f"{' '.join(command)} failed with status {status}")
+    # ru_maxrss is in KiB on linux
+    return output, elapsed, usage.ru_maxrss / 1024
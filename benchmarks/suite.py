@@ -0,0 +1,323 @@
+"""
+Benchmark suite over deterministic synthetic corpora, every benchmark runs in
+its own process
+
+    python benchmarks/suite.py run --sizes 10000 100000 --output after.json
+    python benchmarks/suite.py compare before.json after.json
+
+The best time of `--repeat` runs is kept. The memory of an operation is the
+peak of the allocations it makes on top of its setup, traced by tracemalloc
+in one more run that is not timed. The peak RSS of the whole process,
+setup included, is reported alongside. `compare` reports benchmarks slower
+or allocating more than the baseline by more than --threshold percent and
+exits with status 1 when there is any. Corpora are generated for every run,
+the same --seed, --fanout and length ranges always give the same bookmarks.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.corpus import (  # noqa: E402
+    PATH_SEGMENTS,
+    TITLE_WORDS,
+    write_database,
+    write_netscape_file,
+)
+from benchmarks.process import run_measured  # noqa: E402
+
+SIZES = (10_000, 100_000, 1_000_000)
+# lookups timed by the get_bookmark and bookmark_exists_in_table benchmarks
+LOOKUPS = 1000
+FLAGS = {"clean_title": False, "remove_if_empty": False}
+# MiB an operation has to allocate on top of the baseline to count as larger
+MIN_PEAK_DELTA = 1.0
+
+
+def largest_folder(db):
+    sizes = {folder: sum(1 for _ in rows) for folder, rows in db.iter_folder_rows()}
+    return max(sizes, key=sizes.get)
+
+
+def sample(rows, count=LOOKUPS):
+    step = max(len(rows) // count, 1)
+    return rows[::step][:count]
+
+
+# every benchmark is a setup run before each repetition, returning the
+# arguments of the timed operation
+
+
+def setup_open(files):
+    return (files["db"],)
+
+
+def run_list_folders(db_file):
+    from mark.db import open_database
+
+    # what `mark get` does before showing its first menu
+    open_database(db_file).list_folders()
+
+
+def setup_folder(files):
+    from mark.db import open_database
+
+    db = open_database(files["db"])
+    return db, largest_folder(db)
+
+
+def run_list_bookmarks(db, folder):
+    db.list_bookmarks(folder)
+
+
+def setup_lookups(files):
+    db, folder = setup_folder(files)
+    return db, folder, sample(list(db.list_raw_bookmarks(folder)))
+
+
+def run_get_bookmark(db, folder, rows):
+    for _, title in rows:
+        db.get_bookmark(folder, title)
+
+
+def run_bookmark_exists(db, folder, rows):
+    # the first lookup builds the url index of the folder
+    for url, _ in rows:
+        db.bookmark_exists_in_table(folder, url)
+
+
+def setup_parse(files):
+    return (files["html"],)
+
+
+def run_parse(html_file):
+    from mark.parser import parse_netscape_bookmark_file
+
+    parse_netscape_bookmark_file(html_file, (None, None), "add", FLAGS)
+
+
+def setup_save(files):
+    from mark.parser import parse_netscape_bookmark_file
+
+    target = os.path.join(files["tmp"], "saved.json")
+    if os.path.exists(target):
+        os.unlink(target)
+    bookmarks = parse_netscape_bookmark_file(files["html"], (None, None), "add", FLAGS)
+    return bookmarks, target
+
+
+def run_save(bookmarks, target):
+    from mark.db import save_bookmarks_to_db
+
+    save_bookmarks_to_db(bookmarks, target, no_duplicates=False)
+
+
+def setup_export(files):
+    return files["db"], os.path.join(files["tmp"], "exported")
+
+
+def run_export_html(db_file, output):
+    from mark.db import export_bookmarks_to_html
+
+    export_bookmarks_to_html(db_file, output + ".html", force=True)
+
+
+def run_export_markdown(db_file, output):
+    from mark.db import export_bookmarks_to_markdown
+
+    export_bookmarks_to_markdown(db_file, output + ".md", force=True, heading=3)
+
+
+BENCHMARKS = {
+    "list_folders": (setup_open, run_list_folders),
+    "list_bookmarks": (setup_folder, run_list_bookmarks),
+    "get_bookmark": (setup_lookups, run_get_bookmark),
+    "bookmark_exists_in_table": (setup_lookups, run_bookmark_exists),
+    "parse_netscape_bookmark_file": (setup_parse, run_parse),
+    "save_bookmarks_to_db": (setup_save, run_save),
+    "export_html": (setup_export, run_export_html),
+    "export_markdown": (setup_export, run_export_markdown),
+}
+
+
+def run_child(name: str, files: dict, repeat: int):
+    """runs in the benchmark process, prints the timings and memory as json"""
+    setup, operation = BENCHMARKS[name]
+    timings = []
+    for _ in range(repeat):
+        args = setup(files)
+        start = time.perf_counter()
+        operation(*args)
+        timings.append(time.perf_counter() - start)
+    # tracing slows the operation down, so it gets a run of its own
+    args = setup(files)
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    operation(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(json.dumps({"timings": timings, "peak": peak - baseline}))
+
+
+def measure(name: str, files: dict, repeat: int) -> dict:
+    output, _, rss = run_measured(
+        [sys.executable, __file__, "child", name, json.dumps(files), str(repeat)],
+        cwd=ROOT,
+        capture=True,
+    )
+    result = json.loads(output)
+    timings = result["timings"]
+    return {
+        "seconds": min(timings),
+        "mean": sum(timings) / len(timings),
+        "peak_mib": result["peak"] / (1 << 20),
+        "rss_mib": rss,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    names = args.only or list(BENCHMARKS)
+    corpus = {
+        "fanout": args.fanout,
+        "seed": args.seed,
+        "title_words": tuple(args.title_words),
+        "path_segments": tuple(args.path_segments),
+    }
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "corpus": corpus,
+        },
+        "results": {},
+    }
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            files = {
+                "tmp": tmp,
+                "db": os.path.join(tmp, "bookmarks.json"),
+                "html": os.path.join(tmp, "bookmarks.html"),
+            }
+            write_database(files["db"], size, **corpus)
+            write_netscape_file(files["html"], size, **corpus)
+            for name in names:
+                result = measure(name, files, args.repeat)
+                report["results"][f"{name}@{size}"] = result
+                print(
+                    f"{name:<30} {size:>9} {result['seconds']:9.3f}s"
+                    f" {result['peak_mib']:9.1f} MiB peak"
+                    f" {result['rss_mib']:7.0f} MiB rss",
+                    flush=True,
+                )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+def compare(args):
+    with open(args.before) as file:
+        before = json.load(file)["results"]
+    with open(args.after) as file:
+        after = json.load(file)["results"]
+    regressions = []
+    print(f"{'benchmark':<40} {'before':>9} {'after':>9} {'change':>8} {'peak':>8}")
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = (new["seconds"] / old["seconds"] - 1) * 100
+        # results written before the operation's memory was traced have none
+        old_peak, new_peak = old.get("peak_mib", 0), new.get("peak_mib", 0)
+        peak_change = (new_peak / old_peak - 1) * 100 if old_peak else 0.0
+        print(
+            f"{key:<40} {old['seconds']:8.3f}s {new['seconds']:8.3f}s"
+            f" {change:+7.1f}% {peak_change:+7.1f}%"
+        )
+        # sub millisecond differences of the fast benchmarks are noise, and
+        # so are allocations under a MiB
+        slower = new["seconds"] - old["seconds"] > args.min_delta
+        larger = new_peak - old_peak > MIN_PEAK_DELTA
+        if (slower and change > args.threshold) or (
+            larger and peak_change > args.threshold
+        ):
+            regressions.append(key)
+    for key in sorted(before.keys() ^ after.keys()):
+        print(f"{key:<40} only in {'before' if key in before else 'after'}")
+    for key in regressions:
+        print(f"REGRESSION {key}")
+    if regressions:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS))
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--fanout", type=int, default=50)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument(
+        "--title-words", type=int, nargs=2, default=TITLE_WORDS, metavar=("MIN", "MAX")
+    )
+    run_parser.add_argument(
+        "--path-segments",
+        type=int,
+        nargs=2,
+        default=PATH_SEGMENTS,
+        metavar=("MIN", "MAX"),
+    )
+    run_parser.add_argument("-o", "--output", help="write the results to this file")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=10.0)
+    compare_parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=0.005,
+        help="seconds a benchmark has to lose before it counts as a regression",
+    )
+
+    child_parser = commands.add_parser("child")
+    child_parser.add_argument("name")
+    child_parser.add_argument("files", type=json.loads)
+    child_parser.add_argument("repeat", type=int)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "compare":
+        compare(args)
+    else:
+        run_child(args.name, args.files, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
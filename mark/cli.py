@@ -1,23 +1,26 @@
-import asyncio
+import os
+import time
 
 import click
 from click.core import ParameterSource
 
-from mark.db import (
-    export_bookmarks_to_html,
-    export_bookmarks_to_markdown,
-    save_bookmarks_to_db,
-)
-from mark.parser import parse_netscape_bookmark_file
-from mark.server import Server
+# NOTE: subcommands import what they need themselves, so a hotkey bound
+# `mark get` does not pay for the parser, exporters or http libraries
 
 db_file_arg = click.argument(
     "db_file",
     required=True,
     type=click.Path(exists=True),
 )
-db_file_write_arg = click.argument(
-    "db_file",
+db_files_arg = click.argument(
+    "db_files",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True),
+)
+db_files_write_arg = click.argument(
+    "db_files",
+    nargs=-1,
     required=True,
     type=click.Path(),
 )
@@ -27,7 +30,10 @@ output_file_opt = click.option(
     type=click.Path(),
     default="output",
     show_default=True,
-    help="output file path",
+    help=(
+        "output file path, exports go to stdout with `-` and are compressed when"
+        " the path ends with .gz, .bz2, .xz or .zst"
+    ),
 )
 on_selection_opt = click.option(
     "--on-selection",
@@ -71,10 +77,19 @@ date_attr_opt = click.option(
     show_choices=True,
     help="kind of date used in filtering, either add_date or last_modified",
 )
-bookmark_file_arg = click.argument(
-    "file",
-    type=click.Path(exists=True),
-    # help="bookmark file you want to import from, either markdown or html",
+bookmark_files_arg = click.argument(
+    "files",
+    nargs=-1,
+    required=True,
+    # existence is checked once the globs are expanded
+    type=click.Path(allow_dash=True),
+)
+jobs_opt = click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=None,
+    help="processes parsing the files when importing several  [default: cpu count]",
 )
 folder_format_opt = click.option(
     "--folder-format",
@@ -103,7 +118,7 @@ clean_opt = click.option(
 infer_title = click.option(
     "--infer-title",
     is_flag=True,
-    help="flag to enable title inference during insertion",
+    help="flag to enable title inference during insertion or import",
 )
 no_duplicates = click.option(
     "--no-duplicates", is_flag=True, help="flag to prune duplicates during import"
@@ -118,6 +133,68 @@ remove_if_empty = click.option(
         "flag to remove empty folder if they don't contain any bookmarks during import"
     ),
 )
+stream = click.option(
+    "--stream",
+    is_flag=True,
+    help=(
+        "flag to parse and insert bookmarks in batches, memory stays bounded"
+        " with a sqlite output while json and yaml are held in memory"
+    ),
+)
+batch_size_opt = click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=10_000,
+    show_default=True,
+    help="number of bookmarks inserted at once in streaming import",
+)
+client_opt = click.option(
+    "--client",
+    default="script",
+    show_default=True,
+    show_choices=True,
+    type=click.Choice(["script", "dmenu"], case_sensitive=False),
+    help=(
+        "how rofi talks to mark, `script` runs a rofi script per selection while"
+        " `dmenu` drives rofi through pipes without spawning python"
+    ),
+)
+concurrency_opt = click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=32,
+    show_default=True,
+    help="maximum number of pages fetched at once during title inference",
+)
+per_host_opt = click.option(
+    "--per-host",
+    type=click.IntRange(min=0),
+    default=4,
+    show_default=True,
+    help="maximum number of pages fetched at once from the same host, 0 for no limit",
+)
+rate_opt = click.option(
+    "--rate",
+    type=click.FloatRange(min=0),
+    default=20.0,
+    show_default=True,
+    help="maximum number of requests per second, 0 for no limit",
+)
+timeout_opt = click.option(
+    "--timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=5.0,
+    show_default=True,
+    help="seconds before giving up on a page",
+)
+capture_opt = click.option(
+    "--capture",
+    "profile_capture",
+    type=click.Choice(["cpu", "memory"]),
+    multiple=True,
+    help="profile the command with cProfile (cpu) or tracemalloc (memory) and"
+    " print the top functions or allocation sites to stderr",
+)
 url_meta = click.option(
     "--url-meta",
     is_flag=True,
@@ -135,59 +212,89 @@ def is_default_option(param):
 
 
 @click.group()
-def cli():
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="time the hot paths and print a summary to stderr at exit, setting the"
+    " MARK_PROFILE environment variable does the same",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="write the profile as a Chrome trace file instead, implies --profile",
+)
+def cli(profile, profile_output):
     """
     Your Swiss Army knife for global bookmark management
     """
-    pass
+    from mark import profiling
+
+    if profile or profile_output:
+        profiling.enable(profile_output)
+    else:
+        profiling.enable_from_env()
 
 
 @cli.command("get")
-@db_file_arg
+@db_files_arg
 @on_selection_opt
 @folder_format_opt
 @entry_format_opt
 @url_meta
-def mark_get_bookmark(db_file, on_selection, folder_format, entry_format, url_meta):
+@client_opt
+def mark_get_bookmark(
+    db_files, on_selection, folder_format, entry_format, url_meta, client
+):
     """
-    Retrieve a bookmark
+    Retrieve a bookmark, several files or directories are merged
     """
-    # TODO: handle multiple files
+    import asyncio
+
+    from mark.server import Server
+
     asyncio.run(
         Server.execute_async_server(
-            db_file=db_file,
+            db_files=db_files,
             mode="read",
             on_selection=on_selection,
             folder_format=folder_format,
             entry_format=entry_format,
             url_meta=url_meta,
+            client=client,
         )
     )
 
 
 @cli.command("insert")
-@db_file_write_arg
+@db_files_write_arg
 @folder_format_opt
 @infer_title
 @no_duplicates
-def mark_insert_bookmark(db_file, folder_format, infer_title, no_duplicates):
+@client_opt
+def mark_insert_bookmark(db_files, folder_format, infer_title, no_duplicates, client):
     """
-    Insert a bookmark
+    Insert a bookmark, several files or directories are merged
     """
-    # TODO: handle multiple files
+    import asyncio
+
+    from mark.server import Server
+
     asyncio.run(
         Server.execute_async_server(
-            db_file,
+            db_files,
             mode="write",
             folder_format=folder_format,
             infer_title=infer_title,
             no_duplicates=no_duplicates,
+            client=client,
         )
     )
 
 
 @cli.command("import")
-@bookmark_file_arg
+@bookmark_files_arg
 @format_opt
 @output_file_opt
 @clean_opt
@@ -196,8 +303,17 @@ def mark_insert_bookmark(db_file, folder_format, infer_title, no_duplicates):
 @end_date_opt
 @date_attr_opt
 @remove_if_empty
+@stream
+@batch_size_opt
+@infer_title
+@concurrency_opt
+@per_host_opt
+@rate_opt
+@timeout_opt
+@capture_opt
+@jobs_opt
 def mark_import_bookmarks(
-    file,
+    files,
     format,
     output,
     clean_title,
@@ -206,28 +322,138 @@ def mark_import_bookmarks(
     end_date,
     date_attr,
     remove_if_empty,
+    stream,
+    batch_size,
+    infer_title,
+    concurrency,
+    per_host,
+    rate,
+    timeout,
+    profile_capture,
+    jobs,
 ):
     """
-    Import bookmarks from other browsers
+    Import bookmarks from other browsers, several files are parsed in parallel
     """
+    from mark.db import save_bookmark_stream_to_db, save_bookmarks_to_db
+    from mark.parser import iter_netscape_bookmark_file, parse_netscape_bookmark_file
+    from mark.profiling import capture, span
+    from mark.streams import STDIO
+
     if not is_default_option("end_date") and not is_default_option("start_date"):
         assert start_date < end_date, "end-date should be after start-date"
 
-    if format == "html":
-        flags = {
-            "clean_title": clean_title,
-            "remove_if_empty": remove_if_empty,
-        }
-        bookmarks = parse_netscape_bookmark_file(
-            file, (start_date, end_date), date_attr, flags
-        )
-    else:
+    if format != "html":
         raise NotImplementedError("Not yet implemented for markdown")
 
     if is_default_option("output"):
         output = "imported_bookmarks.json"
 
-    save_bookmarks_to_db(bookmarks, output, no_duplicates)
+    flags = {
+        "clean_title": clean_title,
+        "remove_if_empty": remove_if_empty,
+    }
+    files = expand_globs(files)
+    if len(files) > 1 and STDIO in files:
+        raise click.BadParameter("- can only be imported alone", param_hint="FILES")
+    if len(files) > 1 and stream:
+        raise click.BadParameter("--stream only applies to a single file")
+    date_range = (start_date, end_date)
+    start = time.perf_counter()
+    with capture(profile_capture):
+        if len(files) > 1:
+            count = import_files(
+                files, date_range, date_attr, flags, jobs, output, no_duplicates
+            )
+        elif stream:
+            records = iter_netscape_bookmark_file(
+                files[0], date_range, date_attr, flags
+            )
+            with span("import.stream"):
+                count = save_bookmark_stream_to_db(
+                    records, output, no_duplicates, batch_size
+                )
+        else:
+            with span("import.parse"):
+                bookmarks = parse_netscape_bookmark_file(
+                    files[0], date_range, date_attr, flags
+                )
+            with span("import.save"):
+                count = save_bookmarks_to_db(bookmarks, output, no_duplicates)
+    elapsed = time.perf_counter() - start
+    speed = count / elapsed if elapsed else 0
+    click.echo(
+        f"imported {count} bookmarks in {elapsed:.2f}s ({speed:.0f} entries/sec)"
+    )
+    if infer_title:
+        from mark.db import open_database
+
+        fill_titles(open_database(output), concurrency, per_host, rate, timeout)
+
+
+def expand_globs(patterns):
+    """files matched by `patterns`, in order and without repetitions"""
+    import glob
+
+    from mark.streams import STDIO
+
+    files = []
+    for pattern in patterns:
+        if pattern != STDIO and glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise click.BadParameter(f"no file matches {pattern}")
+            files.extend(matches)
+        elif pattern == STDIO or os.path.isfile(pattern):
+            files.append(pattern)
+        else:
+            raise click.BadParameter(f"file {pattern} does not exist")
+    return list(dict.fromkeys(files))
+
+
+def import_files(files, date_range, date_attr, flags, jobs, output, no_duplicates):
+    """
+    parse `files` in parallel, merge them without the urls repeated across
+    files and insert the result in one write, returns the inserted count
+    """
+    from mark.db import save_bookmarks_to_db
+    from mark.parser import iter_parsed_files, merge_bookmarks
+    from mark.profiling import span
+
+    parsed = {}
+    with span("import.parse", files=len(files)):
+        for path, bookmarks, count, elapsed in iter_parsed_files(
+            files, date_range, date_attr, flags, jobs or os.cpu_count() or 1
+        ):
+            parsed[path] = bookmarks
+            speed = count / elapsed if elapsed else 0
+            click.echo(
+                f"[{len(parsed)}/{len(files)}] parsed {count} bookmarks from {path}"
+                f" in {elapsed:.2f}s ({speed:.0f} entries/sec)"
+            )
+    # merged in the order of the files, not the order they were parsed in
+    merged, dropped = merge_bookmarks(parsed[path] for path in files)
+    if dropped:
+        click.echo(f"skipped {dropped} bookmarks already imported from another file")
+    with span("import.save"):
+        return save_bookmarks_to_db(merged, output, no_duplicates)
+
+
+def fill_titles(db, concurrency, per_host, rate, timeout):
+    from mark.titles import backfill_titles
+    from mark.urlcache import open_url_cache
+
+    start = time.perf_counter()
+    count, total = backfill_titles(
+        db,
+        concurrency=concurrency,
+        per_host=per_host,
+        rate=rate,
+        timeout=timeout,
+        cache=open_url_cache(),
+    )
+    elapsed = time.perf_counter() - start
+    click.echo(f"inferred {count} of {total} missing titles in {elapsed:.2f}s")
 
 
 @cli.command("export")
@@ -236,21 +462,154 @@ def mark_import_bookmarks(
 @output_file_opt
 @heading_opt
 @force
-def mark_export_bookmarks(db_file, format, output, heading, force):
+@capture_opt
+def mark_export_bookmarks(
+    db_file, format, output, heading, force, profile_capture
+):
     """
     Export bookmarks to html or markdown
     """
+    from mark.db import export_bookmarks_to_html, export_bookmarks_to_markdown
+    from mark.profiling import capture, span
+    from mark.streams import STDIO, compression_suffix, strip_compression_suffix
 
     if is_default_option("output"):
         output = f"exported_bookmarks.{format}"
-    else:
-        if not output.endswith(format):
-            output = f"{output}.{format}"
+    elif output != STDIO:
+        # keep the compression suffix last, out.gz -> out.html.gz
+        base = strip_compression_suffix(output)
+        if not base.endswith(format):
+            output = f"{base}.{format}{compression_suffix(output) or ''}"
+
+    with capture(profile_capture), span("export", format=format):
+        if format == "md":
+            export_bookmarks_to_markdown(db_file, output, force, heading=heading)
+        elif format == "html":
+            export_bookmarks_to_html(db_file, output, force)
+
+
+@cli.command("daemon")
+@db_file_arg
+@click.option(
+    "--poll-interval",
+    type=click.FloatRange(min=0.05),
+    default=0.5,
+    show_default=True,
+    help="seconds between checks of the database file for changes",
+)
+def mark_run_daemon(db_file, poll_interval):
+    """
+    Keep the database in memory for get and insert
+    """
+    import asyncio
+
+    from mark.daemon import Daemon
+
+    daemon = Daemon(db_file, poll_interval=poll_interval)
+    click.echo(f"serving {db_file} on {daemon.path}")
+    try:
+        asyncio.run(daemon.serve())
+    except asyncio.CancelledError:
+        pass
+
+
+@cli.command("migrate")
+@db_file_arg
+@click.argument("sqlite_file", required=True, type=click.Path())
+def mark_migrate_database(db_file, sqlite_file):
+    """
+    Convert a json or yaml database to sqlite
+    """
+    from mark.sqlite_db import is_sqlite_file, migrate_database
+
+    if not is_sqlite_file(sqlite_file):
+        raise click.BadParameter(
+            "sqlite file should end with .sqlite, .sqlite3 or .db"
+            " and not be an existing json or yaml database",
+            param_hint="SQLITE_FILE",
+        )
+    count = migrate_database(db_file, sqlite_file)
+    click.echo(f"migrated {count} bookmarks to {sqlite_file}")
+
+
+@cli.command("search")
+@db_file_arg
+@on_selection_opt
+@click.option(
+    "-q",
+    "--query",
+    default=None,
+    help="print the results of the query instead of opening rofi",
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=50,
+    show_default=True,
+    help="maximum number of results",
+)
+def mark_search_bookmarks(db_file, on_selection, query, limit):
+    """
+    Search bookmarks across all folders
+    """
+    from mark.db import open_database
+    from mark.search import open_search_index
+
+    index = open_search_index(open_database(db_file), db_file)
+    if query is not None:
+        for _, folder, title, url in index.search(query, limit):
+            click.echo(f"{title}\t{url}\t{folder}")
+        return
+
+    import asyncio
+
+    from mark.search import run_search_menu
+
+    asyncio.run(run_search_menu(index, on_selection, limit))
+
+
+@cli.command("titles")
+@db_file_arg
+@concurrency_opt
+@per_host_opt
+@rate_opt
+@timeout_opt
+def mark_infer_titles(db_file, concurrency, per_host, rate, timeout):
+    """
+    Fetch the titles of bookmarks saved without one
+    """
+    from mark.db import open_database
+
+    fill_titles(open_database(db_file), concurrency, per_host, rate, timeout)
+
+
+@cli.command("snapshot")
+@db_file_arg
+@click.option(
+    "--remove",
+    is_flag=True,
+    default=False,
+    help="delete the snapshot, get reads the database again",
+)
+def mark_snapshot_database(db_file, remove):
+    """
+    Write a binary snapshot of the database for faster get
+    """
+    from mark.snapshot import snapshot_path, write_snapshot
+    from mark.sqlite_db import is_sqlite_file
+
+    if is_sqlite_file(db_file):
+        raise click.BadParameter(
+            "sqlite databases are already indexed on disk", param_hint="DB_FILE"
+        )
+    if remove:
+        if os.path.exists(snapshot_path(db_file)):
+            os.unlink(snapshot_path(db_file))
+        return
+    from mark.db import open_database
 
-    if format == "md":
-        export_bookmarks_to_markdown(db_file, output, force, heading=heading_opt)
-    elif format == "html":
-        export_bookmarks_to_html(db_file, output, force)
+    path = write_snapshot(open_database(db_file))
+    click.echo(f"snapshot written to {path}")
 
 
 if __name__ == "__main__":
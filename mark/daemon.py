@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import os
+import signal
+import socket
+import tempfile
+from string import Template
+from typing import Dict, Optional, Tuple
+
+from mark.protocol import encode_frame, frame, read_frame, recv_frame, recv_raw_frame
+from mark.render import FOLDERS, RenderCache
+
+DEFAULT_TEMPLATE = Template("$title")
+
+
+def socket_path(db_file: str) -> str:
+    """Unix socket the daemon serving `db_file` listens on"""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    digest = hashlib.sha1(os.path.abspath(db_file).encode("utf-8")).hexdigest()
+    return os.path.join(runtime_dir, f"mark-{digest[:12]}.sock")
+
+
+class Daemon:
+    """
+    Long running process holding the database and the rendered folder/entry
+    mappings in memory, served to `mark get` and `mark insert` over a unix
+    socket. The database file is polled and only the folders whose rows
+    changed are re-rendered.
+    """
+
+    def __init__(self, db_file: str, poll_interval: float = 0.5):
+        from mark.db import open_database
+
+        self.db_file = db_file
+        self.path = socket_path(db_file)
+        self.poll_interval = poll_interval
+        self.db = open_database(db_file)
+        self.cache = RenderCache()
+        self.tables = dict(self.db.read_tables())
+        # sqlite commits land in the write-ahead log, the database knows
+        # which files its writes touch
+        self.signature = self.db.signature()
+
+    def reload(self):
+        """Render again only the folders changed on disk"""
+        tables = dict(self.db.read_tables())
+        for folder in set(tables) | set(self.tables):
+            if tables.get(folder) != self.tables.get(folder):
+                self.cache.invalidate(folder)
+        self.tables = tables
+
+    def poll(self):
+        """reload when the database was written since the last poll"""
+        signature = self.db.signature()
+        if signature != self.signature:
+            self.signature = signature
+            self.reload()
+
+    def __folders_menu(self, template: str):
+        return self.cache.menu(
+            FOLDERS, template, False, lambda: self.db.list_folders(Template(template))
+        )
+
+    def __bookmarks_menu(self, tablename: str, template: str, meta: bool):
+        return self.cache.menu(
+            tablename,
+            template,
+            meta,
+            lambda: self.db.list_bookmarks(tablename, Template(template), meta=meta),
+        )
+
+    def list_folders(self, template: str):
+        return self.__folders_menu(template).mapping
+
+    def list_bookmarks(self, tablename: str, template: str, meta: bool):
+        return self.__bookmarks_menu(tablename, template, meta).mapping
+
+    def render_bookmarks(
+        self, tablename: str, template: str, meta: bool, mode: str, options: Dict
+    ):
+        """entry mapping and the ready to send rofi payload of a folder"""
+        menu = self.__bookmarks_menu(tablename, template, meta)
+        return menu.mapping, menu.payload(mode, options)
+
+    def insert_bookmark(self, table: str, url: str, title: str):
+        self.db.insert_bookmark(table, url, title)
+        self.cache.invalidate(table)
+
+    def list_raw_folders(self):
+        # tinydb lists its tables as a set, which has no json form
+        return list(self.db.list_raw_folders())
+
+    def call(self, method: str, args):
+        if method in (
+            "list_folders",
+            "list_bookmarks",
+            "render_bookmarks",
+            "insert_bookmark",
+            "list_raw_folders",
+        ):
+            return getattr(self, method)(*args)
+        if method in (
+            "is_folder",
+            "get_bookmark",
+            "bookmark_exists_in_table",
+        ):
+            return getattr(self.db, method)(*args)
+        raise ValueError(f"unknown method {method}")
+
+    async def handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            while True:
+                request = await read_frame(reader)
+                payload = None
+                try:
+                    result = self.call(request["method"], request["args"])
+                    if request["method"] == "render_bookmarks":
+                        # the payload follows as a raw frame
+                        result, payload = result
+                    response = {"result": result}
+                except Exception as err:
+                    response = {"error": f"{type(err).__name__}: {err}"}
+                writer.write(encode_frame(response))
+                if payload is not None:
+                    writer.write(frame(payload))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            self.poll()
+
+    async def serve(self):
+        running = connect_daemon(self.db_file)
+        if running is not None:
+            running.close()
+            raise RuntimeError(f"a daemon is already serving {self.db_file}")
+        if os.path.exists(self.path):
+            # left behind by a daemon that did not exit cleanly
+            os.unlink(self.path)
+        # warm up the initial menu
+        self.list_folders("$title/")
+        server = await asyncio.start_unix_server(self.handle_client, path=self.path)
+        # stop cleanly so the socket file is removed
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, asyncio.current_task().cancel)
+        try:
+            async with server:
+                await asyncio.gather(server.serve_forever(), self.watch())
+        finally:
+            os.unlink(self.path)
+
+
+class DaemonClient:
+    """
+    DataBase stand-in forwarding every call to a running `mark daemon`
+    """
+
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+
+    def __call(self, method: str, *args):
+        self.sock.sendall(encode_frame({"method": method, "args": args}))
+        response = recv_frame(self.sock)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def insert_bookmark(self, table: str, url: str, title: str):
+        self.__call("insert_bookmark", table, url, title)
+
+    def is_folder(self, table: str) -> bool:
+        return self.__call("is_folder", table)
+
+    def get_bookmark(self, tablename: str, title: str) -> Tuple[str, str]:
+        return tuple(self.__call("get_bookmark", tablename, title))
+
+    def bookmark_exists_in_table(self, tablename, url):
+        return self.__call("bookmark_exists_in_table", tablename, url)
+
+    def list_bookmarks(
+        self,
+        tablename: str,
+        template: Template = DEFAULT_TEMPLATE,
+        meta: bool = False,
+    ) -> Dict:
+        mapping = self.__call("list_bookmarks", tablename, template.template, meta)
+        return {key: tuple(value) for key, value in mapping.items()}
+
+    def render_bookmarks(
+        self,
+        tablename: str,
+        template: Template,
+        meta: bool,
+        mode: str,
+        options: Dict,
+    ) -> Tuple[Dict, bytes]:
+        """
+        entry mapping and rofi payload rendered and cached by the daemon, the
+        mapping values are lists
+        """
+        mapping = self.__call(
+            "render_bookmarks", tablename, template.template, meta, mode, options
+        )
+        return mapping, recv_raw_frame(self.sock)
+
+    def iter_bookmarks(
+        self,
+        tablename: str,
+        template: Template = DEFAULT_TEMPLATE,
+        meta: bool = False,
+    ):
+        yield from self.list_bookmarks(tablename, template, meta).items()
+
+    def list_raw_folders(self):
+        return self.__call("list_raw_folders")
+
+    def list_folders(self, template: Template = DEFAULT_TEMPLATE) -> Dict:
+        return self.__call("list_folders", template.template)
+
+    def close(self):
+        self.sock.close()
+
+
+def connect_daemon(db_file: str) -> Optional[DaemonClient]:
+    """Client of the daemon serving `db_file`, None if no daemon is running"""
+    path = socket_path(db_file)
+    if not os.path.exists(path):
+        return None
+    try:
+        return DaemonClient(path)
+    except OSError:
+        return None
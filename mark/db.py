@@ -1,46 +1,180 @@
 import html
+import itertools
+import random
 import time
+from collections import defaultdict
+from contextlib import contextmanager
 from string import Template
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 
 import orjson
 from tinydb import Query, TinyDB
 
-from mark.storage import FasterJSONStorage, YAMLStorage
-from mark.utils import are_urls_equal, get_proper_write_mode
+from mark.profiling import counters, traced
+from mark.storage import (
+    ConflictError,
+    FasterJSONStorage,
+    LogStorage,
+    ReadCacheMiddleware,
+    TransactionMiddleware,
+    YAMLStorage,
+)
+from mark.streams import open_text
+from mark.utils import get_proper_write_mode, normalize_url
+
+# optimistic attempts of a write before it takes the file lock
+WRITE_RETRIES = 4
 
 
 class DataBase:
     def __init__(self, filename: str, storage="json"):
+        self.filename = filename
         if storage == "yaml":
-            self.db = TinyDB(filename, indent=4, storage=YAMLStorage)
+            self.db = TinyDB(
+                filename,
+                indent=4,
+                storage=TransactionMiddleware(ReadCacheMiddleware(YAMLStorage)),
+            )
+        elif storage == "log":
+            self.db = TinyDB(filename, storage=TransactionMiddleware(LogStorage))
         else:
             self.db = TinyDB(
-                filename, option=orjson.OPT_INDENT_2, storage=FasterJSONStorage
+                filename,
+                option=orjson.OPT_INDENT_2,
+                storage=TransactionMiddleware(ReadCacheMiddleware(FasterJSONStorage)),
             )
+        # folder -> set of normalized urls, built lazily and kept up to date on
+        # inserts so duplicate checks are a single hash lookup. It is dropped
+        # when another process wrote the file since it was built
+        self._url_index = {}
+        self._url_index_base = None
+        counters(f"read cache {filename}", self.cache_stats)
+
+    def __folder_url_keys(self, table: str) -> set:
+        signature = self.db.storage.signature()
+        if signature != self._url_index_base:
+            self._url_index.clear()
+            self._url_index_base = signature
+        keys = self._url_index.get(table)
+        if keys is None:
+            keys = {normalize_url(url) for url, _ in self.list_raw_bookmarks(table)}
+            self._url_index[table] = keys
+        return keys
+
+    def cache_stats(self) -> Dict:
+        """hit/miss counters of the read cache, log storage caches by itself"""
+        storage = self.db.storage
+        return {
+            "hits": getattr(storage, "hits", 0),
+            "misses": getattr(storage, "misses", 0),
+        }
+
+    @contextmanager
+    def bulk(self, exclusive: bool = False):
+        """
+        Buffer every table mutation made inside the block in memory and write
+        them to the file at once on exit, nothing is written if it raises.
+        Other processes writing meanwhile make it raise `ConflictError` on
+        exit, unless `exclusive` is set and the file lock is held throughout
+        """
+        storage = self.db.storage
+        if not storage.active:
+            # tinydb tables cache the next document id, which is stale once
+            # another process inserted rows
+            self.db._tables.clear()
+        storage.begin(exclusive)
+        try:
+            yield self
+            read_base = storage.base
+            storage.commit()
+        except BaseException:
+            storage.rollback()
+            self.db.clear_cache()
+            self._url_index.clear()
+            raise
+        # the url index holds our own changes, it matches the written file
+        if self._url_index_base == read_base:
+            self._url_index_base = storage.base
+
+    def signature(self):
+        """stat based signature of the file, changes on every write"""
+        return self.db.storage.signature()
+
+    @traced()
+    def write(self, operation: Callable, *args):
+        """
+        Run `operation(*args)` as one transaction and return its result. When
+        another process wrote the database since it was read, the transaction
+        is dropped and the operation runs again on the fresh data. The last
+        attempt holds the file lock throughout, so writers cannot starve
+        """
+        for attempt in range(WRITE_RETRIES):
+            try:
+                with self.bulk():
+                    return operation(*args)
+            except ConflictError:
+                # spread the retries of the colliding writers
+                time.sleep(random.uniform(0, 0.002 * 2**attempt))
+        with self.bulk(exclusive=True):
+            return operation(*args)
 
     def insert_bookmark(self, table: str, url: str, title: str):
+        self.write(self.__insert_bookmark, table, url, title)
+
+    def __insert_bookmark(self, table: str, url: str, title: str):
         handle = self.db.table(table)
         # set the default title to url if the user didnot typed a title
         if title is None or not title.strip():
             title = url
         handle.insert({"title": title.strip(), "url": url})
+        if table in self._url_index:
+            self._url_index[table].add(normalize_url(url))
 
     def insert_multiple(self, table: str, bookmark: List):
+        self.write(self.__insert_multiple, table, bookmark)
+
+    def __insert_multiple(self, table: str, bookmark: List):
         handle = self.db.table(table)
         handle.insert_multiple(bookmark)
+        if table in self._url_index:
+            keys = self._url_index[table]
+            keys.update(normalize_url(row["url"]) for row in bookmark)
+
+    def set_titles(self, tablename: str, titles: Dict[str, str]) -> int:
+        """
+        title the bookmarks of `tablename` whose url is in `titles` and which
+        have no title of their own, returns the number of bookmarks changed
+        """
+        return self.write(self.__set_titles, tablename, titles)
+
+    def __set_titles(self, tablename: str, titles: Dict[str, str]) -> int:
+        handle = self.db.table(tablename)
+        doc_ids = [
+            doc.doc_id
+            for doc in handle.all()
+            if doc.get("url") in titles and doc.get("title") in ("", None, doc["url"])
+        ]
+
+        def set_title(doc):
+            doc["title"] = titles[doc["url"]]
+
+        if doc_ids:
+            handle.update(set_title, doc_ids=doc_ids)
+        return len(doc_ids)
 
+    @traced()
     def is_folder(self, table: str) -> bool:
         return table in self.db.tables()
 
+    @traced()
     def get_bookmark(self, tablename: str, title: str) -> Tuple[str, str]:
         # TODO: handle title bein in path
         handle = self.db.table(tablename)
         return title, handle.get(Query().title == title)["url"]
 
+    @traced()
     def bookmark_exists_in_table(self, tablename, url):
-        handle = self.db.table(tablename)
-        return handle.contains(Query().url.test(are_urls_equal, url))
+        return normalize_url(url) in self.__folder_url_keys(tablename)
 
     def list_raw_bookmarks(self, tablename: str) -> List:
         handle = self.db.table(tablename)
@@ -51,134 +185,227 @@ class DataBase:
                 title = url
             yield (url, title)
 
-    def list_bookmarks(
+    def iter_bookmarks(
         self,
         tablename: str,
         template: Template = Template("$title"),
         meta: bool = False,
-    ) -> Dict:
-        mapping = dict()
+    ) -> Iterator[Tuple[str, Tuple]]:
+        """rendered entries of `list_bookmarks` produced one at a time"""
         all_rows = self.list_raw_bookmarks(tablename)
         for url, title in all_rows:
             _title = template.safe_substitute(title=html.escape(title))
             if meta:
-                mapping[_title] = (title, url)
+                yield _title, (title, url)
             else:
-                mapping[_title] = (title,)
+                yield _title, (title,)
 
-        return mapping
+    @traced()
+    def list_bookmarks(
+        self,
+        tablename: str,
+        template: Template = Template("$title"),
+        meta: bool = False,
+    ) -> Dict:
+        return dict(self.iter_bookmarks(tablename, template, meta))
 
     def list_raw_folders(self):
         return self.db.tables()
 
+    def read_tables(self) -> Dict:
+        """raw folder -> {doc_id: row} data as held by the storage"""
+        return self.db.storage.read() or {}
+
+    def iter_folder_rows(self) -> Iterator[Tuple[str, Iterator[Tuple[str, str]]]]:
+        """
+        (folder, (url, title) rows) of every folder read straight from the
+        storage, without building tinydb documents or copying tables
+        """
+        for folder, rows in self.read_tables().items():
+            yield folder, (
+                (row.get("url"), row.get("title") or row.get("url"))
+                for row in rows.values()
+            )
+
+    @traced()
     def list_folders(self, template: Template = Template("$title")) -> List:
         return {
             template.safe_substitute(title=html.escape(table)): table
-            for table in self.db.tables()
+            for table in self.list_raw_folders()
         }
 
     def get_table_handle(self, tablename: str):
+        # the handle may be used to write, so the url index is no longer trusted
+        self._url_index.pop(tablename, None)
         return self.db.table(tablename)
 
 
+@traced()
+def open_database(filename: str) -> DataBase:
+    """
+    Open the database engine matching the file extension, sqlite files use
+    `SQLiteDataBase`, yaml files the yaml storage and anything else json
+    """
+    from mark.sqlite_db import SQLiteDataBase, is_sqlite_file
+
+    if is_sqlite_file(filename):
+        return SQLiteDataBase(filename)
+    if filename.lower().endswith((".yaml", ".yml")):
+        return DataBase(filename, storage="yaml")
+    return DataBase(filename)
+
+
 def prune_duplicates(db, bookmarks):
     """
-    if the url is already there under table then ignore this bookmark
+    if the url is already there under table, or earlier in the same imported
+    table, then ignore this bookmark
     """
     for table in bookmarks:
         # skip un-necessary calls if the table is not in the db
-        if not db.is_folder(table):
-            continue
+        in_db = db.is_folder(table)
+        seen = set()
         folder = []
-        n = len(bookmarks[table])
-        for i in range(n):
-            bookmark = bookmarks[table][i]
-            if not db.bookmark_exists_in_table(table, bookmark["url"]):
-                folder.append(bookmark)
+        for bookmark in bookmarks[table]:
+            key = normalize_url(bookmark["url"])
+            if key in seen:
+                continue
+            seen.add(key)
+            if in_db and db.bookmark_exists_in_table(table, bookmark["url"]):
+                continue
+            folder.append(bookmark)
         # update folder list
         bookmarks[table] = folder
     return bookmarks
 
 
-def save_bookmarks_to_db(bookmarks, db_file, no_duplicates):
-    db = DataBase(db_file)
-    if no_duplicates:
-        bookmarks = prune_duplicates(db, bookmarks)
-    # do the insertion
-    for table in bookmarks:
-        db.insert_multiple(table, bookmarks[table])
-
-
-def export_bookmarks_to_markdown(
-    db_file: str, filepath: str, force: bool, heading: int
-):
+def insert_bookmarks(db, bookmarks, no_duplicates) -> int:
+    """
+    insert a folder -> bookmarks mapping, returns the number of inserted rows
+    """
 
-    assert 1 <= heading <= 6
-    mode = "w" if force else "a+"
-    file = open(filepath, mode)
-    heading_level = "#" * heading
+    def insert():
+        count = 0
+        pruned = prune_duplicates(db, bookmarks) if no_duplicates else bookmarks
+        for table in pruned:
+            rows = pruned[table]
+            # empty folders only need to be created once
+            if not rows and db.is_folder(table):
+                continue
+            db.insert_multiple(table, rows)
+            count += len(rows)
+        return count
 
-    def write_folder(folder_name, rows):
-        folder_header = f"\n\n\n{heading_level} {folder_name}\n\n\n"
-        file.write(folder_header)
-        for url, title in rows:
-            line = f"[{title}]({url})\n\n"
-            file.write(line)
+    # one read and one write of the database for the whole import
+    return db.write(insert)
 
-    db = DataBase(db_file)
-    folders = db.list_raw_folders()
-    for folder in folders:
-        all_rows = db.list_raw_bookmarks(folder)
-        write_folder(folder, all_rows)
 
-    # force the data to os buffer
-    file.flush()
-    file.close()
+def save_bookmarks_to_db(bookmarks, db_file, no_duplicates) -> int:
+    db = open_database(db_file)
+    return insert_bookmarks(db, bookmarks, no_duplicates)
 
 
-def export_bookmarks_to_html(db_file: str, filepath: str, force: bool):
-    header = """
-    <!DOCTYPE NETSCAPE-Bookmark-file-1>
-    <!--This is an automatically generated file.
-    It will be read and overwritten.
-    Do Not Edit! -->
-    <Title>Bookmarks</Title>
-    <H1>Bookmarks</H1>
+def save_bookmark_stream_to_db(
+    records: Iterable, db_file: str, no_duplicates: bool, batch_size: int = 10_000
+) -> int:
+    """
+    insert (folder, bookmark) records in batches of `batch_size`, returns the
+    number of inserted rows. The whole import is one transaction, so json and
+    yaml databases are written once, they are held in memory anyway. Only
+    sqlite databases keep the memory bounded to a batch
+    """
+    db = open_database(db_file)
+    records = iter(records)
+    count = 0
+    # holding the lock throughout, a long import cannot lose a conflict at
+    # the very end
+    with db.bulk(exclusive=True):
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            bookmarks = defaultdict(list)
+            for folder, bookmark in batch:
+                rows = bookmarks[folder]
+                if bookmark is not None:
+                    rows.append(bookmark)
+            count += insert_bookmarks(db, bookmarks, no_duplicates)
+    return count
+
+
+# netscape export pieces, the date is filled once per export
+HTML_HEADER = (
+    "<!DOCTYPE NETSCAPE-Bookmark-file-1>\n"
+    "<!--This is an automatically generated file.\n"
+    "It will be read and overwritten.\n"
+    "Do Not Edit! -->\n"
+    "<Title>Bookmarks</Title>\n"
+    "<H1>Bookmarks</H1>\n"
+    "\n"
+    "<DL>\n"
+)
+HTML_FOLDER = '<DT><H3 ADD_DATE="{date}" LAST_MODIFIED="{date}">%s</H3>\n\t<DL><p>\n'
+HTML_BOOKMARK = (
+    '\t<DT><A HREF="%s" ADD_DATE="{date}" LAST_VISIT="{date}"'
+    ' LAST_MODIFIED="{date}" ICON_URI="" ICON="">%s</A>\n'
+)
+HTML_FOLDER_FOOTER = "\t</DL><p>\n"
+# number of pieces joined into a single write
+WRITE_BATCH = 4096
+
+
+def write_chunks(file, pieces: Iterable[str]):
+    """write the exported pieces in large chunks instead of one by one"""
+    pieces = iter(pieces)
+    while True:
+        batch = list(itertools.islice(pieces, WRITE_BATCH))
+        if not batch:
+            break
+        file.write("".join(batch))
+
+
+def iter_markdown_export(db: DataBase, heading: int) -> Iterator[str]:
+    heading_level = "#" * heading
+    entry = "[{1}]({0})\n\n".format
+    for folder, rows in db.iter_folder_rows():
+        yield f"\n\n\n{heading_level} {folder}\n\n\n"
+        yield from itertools.starmap(entry, rows)
 
-    <DL>
 
+def iter_html_export(db: DataBase, header: bool = True) -> Iterator[str]:
     """
-    header = "\n".join([line.lstrip() for line in header.split("\n")])
-    db = DataBase(db_file)
-    mode = "w" if force else get_proper_write_mode(filepath)
-    file = open(filepath, mode)
-    if mode == "w":
-        file.write(header.strip())
-
-    date = time.time()
-    # common attrs used in all of the entries, better to pull it out of the loop
-    attrs = 'ADD_DATE="{date}" LAST_MODIFIED="{date}" '
-    # used in <A> tag
-    misc = ' ICON_URI="" ICON="" '
-    folder_header = Template(f"<DT><H3 {attrs}> $folder_name</H3>\n\t<DL><p>")
-    folder_footer = "\t</DL><p>\n"
-    bookmark_spec = Template(
-        f"""
-    <DT><A HREF="$url" ADD_DATE="{date}" LAST_VISIT="{date}"
-    LAST_MODIFIED="{date}" {misc}>$title</A>\n"""
-    )
-
-    def write_folder(folder_name, rows):
-        file.write(folder_header.substitute(folder_name=folder_name))
+    netscape bookmark file, folder names, titles and urls are escaped here
+    once as the database holds them raw
+    """
+    date = int(time.time())
+    folder_header = HTML_FOLDER.format(date=date)
+    bookmark = HTML_BOOKMARK.format(date=date)
+    escape = html.escape
+    if header:
+        yield HTML_HEADER
+    for folder, rows in db.iter_folder_rows():
+        yield folder_header % escape(folder)
         for url, title in rows:
-            file.write(bookmark_spec.substitute(url=url, title=title))
-        file.write(folder_footer)
-
-    folders = db.list_folders()
-    for folder in folders:
-        all_rows = db.list_raw_bookmarks(folder)
-        write_folder(folder, all_rows)
+            yield bookmark % (escape(url), escape(title))
+        yield HTML_FOLDER_FOOTER
     # end of file tag
-    file.write("</DL>")
-    file.flush()
-    file.close()
+    yield "</DL>\n"
+
+
+def export_bookmarks_to_markdown(
+    db_file: str, filepath: str, force: bool, heading: int
+):
+    """`filepath` may be `-` for stdout or end with a compression suffix"""
+    assert 1 <= heading <= 6
+    mode = "w" if force else "a"
+    db = open_database(db_file)
+    with open_text(filepath, mode) as file:
+        write_chunks(file, iter_markdown_export(db, heading))
+
+
+def export_bookmarks_to_html(db_file: str, filepath: str, force: bool):
+    """`filepath` may be `-` for stdout or end with a compression suffix"""
+    db = open_database(db_file)
+    # the header is only written at the start of the file
+    mode = "w" if force else get_proper_write_mode(filepath)[0]
+    with open_text(filepath, mode) as file:
+        write_chunks(file, iter_html_export(db, header=mode == "w"))
@@ -0,0 +1,243 @@
+"""
+Several database files presented as one: folders of the same name are merged
+and every bookmark keeps the name of the file it comes from, `$source` in the
+folder and entry formats.
+
+Each file is read through a snapshot kept in the cache directory, so files
+unchanged since the last run are memory mapped instead of parsed, and the
+changed ones are loaded and snapshotted concurrently.
+"""
+import hashlib
+import html
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from string import Template
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+from mark.db import DataBase, open_database
+from mark.profiling import traced
+from mark.utils import normalize_url
+
+DB_SUFFIXES = (".json", ".yaml", ".yml", ".sqlite", ".sqlite3", ".db")
+MAX_WORKERS = 8
+
+
+def expand_db_files(paths: Sequence[str]) -> List[str]:
+    """database files of `paths`, directories stand for the files they hold"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.lower().endswith(DB_SUFFIXES)
+            )
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+
+def source_cache_path(db_file: str) -> str:
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    digest = hashlib.sha1(os.path.abspath(db_file).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "mark", "sources", f"{digest[:16]}.snap")
+
+
+def source_names(filenames: Sequence[str]) -> List[str]:
+    """file names without their suffix, the whole path when that is ambiguous"""
+    stems = [os.path.splitext(os.path.basename(name))[0] for name in filenames]
+    return [
+        stem if stems.count(stem) == 1 else filename
+        for stem, filename in zip(stems, filenames)
+    ]
+
+
+def load_source(db_file: str) -> DataBase:
+    """
+    read-only view of `db_file`: its cached snapshot, rebuilt when the file
+    changed since, or the database itself when the cache cannot be written
+    """
+    from mark.snapshot import open_snapshot
+
+    return open_snapshot(db_file, source_cache_path(db_file), create=True)
+
+
+class FederatedDataBase(DataBase):
+    """
+    Read the union of several databases, a bookmark is inserted in the first
+    file holding its folder, or in the first file for new folders
+    """
+
+    def __init__(self, filenames: Sequence[str], workers: int = MAX_WORKERS):
+        if not filenames:
+            raise ValueError("no database files to open")
+        self.filenames = list(filenames)
+        self.filename = self.filenames[0]
+        self.sources = source_names(self.filenames)
+        self.dbs = self.__load(workers)
+        # index -> writable database of the file, opened on the first write
+        self.writers = {}
+        # folder -> indexes of the files holding it, in the order of the files
+        self.folders = {}
+        for index, db in enumerate(self.dbs):
+            for folder in db.list_raw_folders():
+                self.folders.setdefault(folder, []).append(index)
+        # folder -> merged (source, url, title) rows and their normalized urls,
+        # built lazily and dropped when any file changed since
+        self._rows = {}
+        self._urls = {}
+        self._view_base = None
+
+    @traced("FederatedDataBase.load")
+    def __load(self, workers: int) -> List[DataBase]:
+        with ThreadPoolExecutor(min(workers, len(self.filenames))) as pool:
+            return list(pool.map(load_source, self.filenames))
+
+    def __writer(self, index: int) -> DataBase:
+        writer = self.writers.get(index)
+        if writer is None:
+            writer = self.writers[index] = open_database(self.filenames[index])
+        return writer
+
+    def __owner(self, table: str) -> int:
+        return self.folders.get(table, [0])[0]
+
+    def __wrote(self, index: int, table: str):
+        # the source view no longer holds the file, read through the writer
+        self.dbs[index] = self.__writer(index)
+        indexes = self.folders.setdefault(table, [])
+        if index not in indexes:
+            indexes.append(index)
+            indexes.sort()
+        self._rows.pop(table, None)
+        self._urls.pop(table, None)
+
+    def __folder_rows(self, tablename: str) -> List[Tuple[str, str, str]]:
+        signature = self.signature()
+        if signature != self._view_base:
+            self._rows.clear()
+            self._urls.clear()
+            self._view_base = signature
+        rows = self._rows.get(tablename)
+        if rows is None:
+            rows = self._rows[tablename] = [
+                (self.sources[index], url, title)
+                for index in self.folders.get(tablename, ())
+                for url, title in self.dbs[index].list_raw_bookmarks(tablename)
+            ]
+        return rows
+
+    def signature(self):
+        """signatures of the files, in their order"""
+        return tuple(db.signature() for db in self.dbs)
+
+    def cache_stats(self) -> Dict:
+        return {"hits": 0, "misses": 0}
+
+    def iter_source_rows(self, tablename: str) -> Iterator[Tuple[str, str, str]]:
+        """(source, url, title) rows of a folder across every file"""
+        return iter(self.__folder_rows(tablename))
+
+    @contextmanager
+    def bulk(self, exclusive: bool = False):
+        """
+        Hold a transaction on every file, each is written on exit. The files
+        are always locked, in their order so federated writers cannot
+        deadlock, but a failure writing one file does not undo the files
+        written before it
+        """
+        with ExitStack() as stack:
+            for index in range(len(self.filenames)):
+                stack.enter_context(self.__writer(index).bulk(exclusive=True))
+            yield self
+
+    def write(self, operation: Callable, *args):
+        with self.bulk():
+            return operation(*args)
+
+    def insert_bookmark(self, table: str, url: str, title: str):
+        index = self.__owner(table)
+        self.__writer(index).insert_bookmark(table, url, title)
+        self.__wrote(index, table)
+
+    def insert_multiple(self, table: str, bookmark: List):
+        index = self.__owner(table)
+        self.__writer(index).insert_multiple(table, bookmark)
+        self.__wrote(index, table)
+
+    def set_titles(self, tablename: str, titles: Dict[str, str]) -> int:
+        count = 0
+        for index in list(self.folders.get(tablename, ())):
+            count += self.__writer(index).set_titles(tablename, titles)
+            self.__wrote(index, tablename)
+        return count
+
+    def is_folder(self, table: str) -> bool:
+        return table in self.folders
+
+    def get_bookmark(self, tablename: str, title: str) -> Tuple[str, str]:
+        for _, url, row_title in self.iter_source_rows(tablename):
+            if row_title == title:
+                return title, url
+        raise KeyError(title)
+
+    @traced()
+    def bookmark_exists_in_table(self, tablename, url):
+        rows = self.__folder_rows(tablename)
+        keys = self._urls.get(tablename)
+        if keys is None:
+            keys = self._urls[tablename] = {normalize_url(url) for _, url, _ in rows}
+        return normalize_url(url) in keys
+
+    def list_raw_bookmarks(self, tablename: str):
+        for _, url, title in self.iter_source_rows(tablename):
+            yield url, title
+
+    def iter_bookmarks(
+        self,
+        tablename: str,
+        template: Template = Template("$title"),
+        meta: bool = False,
+    ) -> Iterator[Tuple[str, Tuple]]:
+        for source, url, title in self.iter_source_rows(tablename):
+            _title = template.safe_substitute(
+                title=html.escape(title), source=html.escape(source)
+            )
+            yield _title, (title, url) if meta else (title,)
+
+    def list_raw_folders(self):
+        return list(self.folders)
+
+    def list_folders(self, template: Template = Template("$title")) -> Dict:
+        return {
+            template.safe_substitute(
+                title=html.escape(folder),
+                source=html.escape(", ".join(self.sources[i] for i in indexes)),
+            ): folder
+            for folder, indexes in self.folders.items()
+        }
+
+    def iter_folder_rows(self):
+        for folder in self.folders:
+            yield folder, self.list_raw_bookmarks(folder)
+
+    def read_tables(self) -> Dict:
+        """raw folder -> {doc_id: row} data, ids numbered across the files"""
+        return {
+            folder: {
+                str(doc_id): {"url": url, "title": title}
+                for doc_id, (_, url, title) in enumerate(
+                    self.iter_source_rows(folder), 1
+                )
+            }
+            for folder in self.folders
+        }
+
+    def get_table_handle(self, tablename: str):
+        """table of the file new bookmarks of `tablename` are inserted in"""
+        index = self.__owner(tablename)
+        handle = self.__writer(index).get_table_handle(tablename)
+        # the handle may be used to write, so the merged view is not trusted
+        self.__wrote(index, tablename)
+        return handle
@@ -1,98 +1,211 @@
 import functools
-from collections import defaultdict
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from html.parser import HTMLParser
-from typing import Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from mark.utils import clean_bookmark_title, filter_by_date
+from mark.streams import open_text
+from mark.utils import clean_bookmark_title, filter_by_date, normalize_url
+
+# size of the pieces the bookmark file is fed to the parser with
+CHUNK_SIZE = 1 << 16
+
+# parser states, what the text being read belongs to
+OUTSIDE, FOLDER, BOOKMARK = range(3)
 
 
 class BookmarkParser(HTMLParser):
     """Netscape bookmark file format parser to import bookmarks
     from other browsers
+
+    The parser can be fed incrementally, every finished bookmark is queued as a
+    (folder, bookmark) record that is collected with `pop_records`. A record
+    with `None` bookmark marks a folder that has to exist even if all of its
+    bookmarks were filtered out.
     """
 
     def __init__(self, date_attr: str, filters: Dict, flags: Dict):
         super().__init__()
-        self.ignorable_tags = [None, "p", "meta", "h1", "title"]
+        self.state = OUTSIDE
         self.folder_stack = []
-        self.tag_stack = []
-        self.bookmarks = defaultdict(list)
+        self.records = []
+        self.seen_folders = set()
+        # text pieces of the folder name or bookmark title being read, text may
+        # reach us in several pieces when split across fed chunks
+        self.text = []
+        # (folder, bookmark) of the <a> tag being parsed, None if filtered out
+        self.current = None
         self.date_attr = {"add": "add_date", "modify": "last_modified"}[date_attr]
-        self.filters = filters
-        self.flags = flags
+        self.date_filter = filters.get("date")
+        self.clean_title = flags["clean_title"]
+        self.remove_if_empty = flags["remove_if_empty"]
 
-    def __get_current_tag(self):
-        raw_tag = self.get_starttag_text()
-        if not raw_tag:
+    def __start_bookmark(self, attrs):
+        url = date = None
+        for name, value in attrs:
+            if name == "href":
+                url = value
+            elif name == self.date_attr:
+                date = value
+        folder = self.folder_stack[-1]
+        if folder not in self.seen_folders:
+            self.seen_folders.add(folder)
+            # keep the folder even if it ends up empty unless user chose so
+            if not self.remove_if_empty:
+                self.records.append((folder, None))
+        self.state = BOOKMARK
+        self.text = []
+        if self.date_filter is not None and not self.date_filter(int(date)):
+            self.current = None
             return
-        return raw_tag.strip("<>").split(" ")[0].lower()
+        self.current = (folder, {"url": url})
 
-    def handle_starttag(self, tag, attrs):
-        if tag in self.ignorable_tags:
+    def __finish_bookmark(self):
+        self.state = OUTSIDE
+        if self.current is None:
             return
-        self.tag_stack.append(tag)
-        if tag != "a":
-            return
-        attrs = dict(attrs)
-        url = attrs["href"]
-        folder = self.folder_stack[-1]
-        self.bookmarks[folder].append({})
-        if "date" in self.filters:
-            date = int(attrs[self.date_attr])
-            if not self.filters["date"](date):
-                return
-        self.bookmarks[folder][-1]["url"] = url
+        folder, bookmark = self.current
+        self.current = None
+        data = "".join(self.text)
+        if data.strip():
+            res = clean_bookmark_title(data) if self.clean_title else data
+            if not res.strip():
+                # default title to the url
+                res = bookmark["url"]
+            bookmark["title"] = res
+        self.records.append((folder, bookmark))
 
-    def handle_endtag(self, tag):
-        if self.__get_current_tag() in self.ignorable_tags:
-            return
+    def __finish_folder(self):
+        self.state = OUTSIDE
+        name = "".join(self.text)
+        if name.strip():
+            self.folder_stack.append(name)
+
+    def pop_records(self):
+        records, self.records = self.records, []
+        return records
 
-        if tag == "dl" and self.tag_stack[-1] == "dl":
-            self.tag_stack.pop()
+    def close(self):
+        super().close()
+        if self.state == BOOKMARK:
+            self.__finish_bookmark()
 
-        if tag == self.tag_stack[-1]:
-            self.tag_stack.pop()
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            # a missing </a> ends the previous bookmark
+            if self.state == BOOKMARK:
+                self.__finish_bookmark()
+            self.__start_bookmark(attrs)
+        elif tag == "h3":
+            self.state = FOLDER
+            self.text = []
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self.state == BOOKMARK:
+            self.__finish_bookmark()
+        elif tag == "h3" and self.state == FOLDER:
+            self.__finish_folder()
 
     def handle_data(self, data):
-        tag = self.__get_current_tag()
-        if tag in self.ignorable_tags:
-            return
-        if tag == "h3":  # folder
-            if not data.strip():
-                return
-            # remove previous folder if it has no entries and user chose so
-            if self.flags["remove_if_empty"] and self.folder_stack:
-                f = self.folder_stack[-1]
-                if f in self.bookmarks and not self.bookmarks[f]:
-                    self.bookmarks.pop(f)
-            self.folder_stack.append(data)
-        elif tag == "a":
-            folder = self.bookmarks[self.folder_stack[-1]]
-            if not folder:
-                return
-            # url is filtered out so skip title
-            if "url" not in folder[-1]:
-                folder.pop()  # delete this empty enrty
-                return
-            if not data.strip():
-                return
-            res = clean_bookmark_title(data) if self.flags["clean_title"] else data
-            if not res.strip():
-                # default title to the url
-                res = folder[-1]["url"]
-            folder[-1]["title"] = res
+        if self.state != OUTSIDE:
+            self.text.append(data)
 
 
-def parse_netscape_bookmark_file(filepath, date_range, date_attr, flags):
+def create_parser(date_range, date_attr, flags) -> BookmarkParser:
     start_date, end_date = date_range
-    date_filter = functools.partial(
-        filter_by_date, start_date=start_date, end_date=end_date
-    )
-    parser = BookmarkParser(
-        date_attr=date_attr, filters={"date": date_filter}, flags=flags
-    )
-    with open(filepath, "r") as file:
-        # TODO: split the reading process (not reading the whole file at once)
-        content = file.read()
-        parser.feed(content)
-    return parser.bookmarks
+    filters = {}
+    # no need to convert every timestamp when no date range is given
+    if start_date is not None or end_date is not None:
+        filters["date"] = functools.partial(
+            filter_by_date, start_date=start_date, end_date=end_date
+        )
+    return BookmarkParser(date_attr=date_attr, filters=filters, flags=flags)
+
+
+def iter_netscape_bookmark_file(
+    filepath, date_range, date_attr, flags, chunk_size: int = CHUNK_SIZE
+) -> Iterator[Tuple[str, Optional[Dict]]]:
+    """
+    Parse the bookmark file in chunks of `chunk_size` characters, yielding
+    (folder, bookmark) records as soon as they are complete
+    """
+    parser = create_parser(date_range, date_attr, flags)
+    with open_text(filepath) as file:
+        for chunk in iter(functools.partial(file.read, chunk_size), ""):
+            parser.feed(chunk)
+            yield from parser.pop_records()
+    parser.close()
+    yield from parser.pop_records()
+
+
+def parse_netscape_bookmark_file(filepath, date_range, date_attr, flags):
+    bookmarks = defaultdict(list)
+    records = iter_netscape_bookmark_file(filepath, date_range, date_attr, flags)
+    for folder, bookmark in records:
+        rows = bookmarks[folder]
+        if bookmark is not None:
+            rows.append(bookmark)
+    return bookmarks
+
+
+def parse_timed(filepath, date_range, date_attr, flags) -> Tuple[Dict, int, float]:
+    """
+    `parse_netscape_bookmark_file` run in a worker process, returns the
+    bookmarks, their number and the seconds spent parsing
+    """
+    start = time.perf_counter()
+    bookmarks = parse_netscape_bookmark_file(filepath, date_range, date_attr, flags)
+    count = sum(len(rows) for rows in bookmarks.values())
+    return dict(bookmarks), count, time.perf_counter() - start
+
+
+def iter_parsed_files(
+    filepaths: List[str], date_range, date_attr, flags, jobs: int
+) -> Iterator[Tuple[str, Dict, int, float]]:
+    """
+    Parse the files in a pool of `jobs` processes, html.parser holds the GIL,
+    yielding (path, bookmarks, count, seconds) as each file is done
+    """
+    if jobs == 1:
+        # a pool of one only adds the cost of sending the bookmarks back
+        for path in filepaths:
+            yield (path, *parse_timed(path, date_range, date_attr, flags))
+        return
+    with ProcessPoolExecutor(min(jobs, len(filepaths))) as pool:
+        futures = {
+            pool.submit(parse_timed, path, date_range, date_attr, flags): path
+            for path in filepaths
+        }
+        for future in as_completed(futures):
+            yield (futures[future], *future.result())
+
+
+def merge_bookmarks(parsed: Iterable[Dict]) -> Tuple[Dict, int]:
+    """
+    Merge folder -> bookmarks mappings in order, dropping the bookmarks whose
+    url is already in the same folder of an earlier mapping. Duplicates inside
+    one mapping are left to `--no-duplicates`. Returns the merged mapping and
+    the number of bookmarks dropped
+    """
+    parsed = list(parsed)
+    # folders found in a single mapping have nothing to compare their urls to
+    shared = Counter(folder for bookmarks in parsed for folder in bookmarks)
+    merged = defaultdict(list)
+    seen = defaultdict(set)
+    dropped = 0
+    for bookmarks in parsed:
+        for folder, rows in bookmarks.items():
+            if shared[folder] == 1:
+                merged[folder] = rows
+                continue
+            known, keys, target = seen[folder], set(), merged[folder]
+            for row in rows:
+                key = normalize_url(row["url"] or "")
+                if key in known:
+                    dropped += 1
+                    continue
+                keys.add(key)
+                target.append(row)
+            known |= keys
+    return merged, dropped
@@ -0,0 +1,228 @@
+"""
+Timed spans around the hot paths, enabled by `mark --profile` or the
+MARK_PROFILE environment variable and reported when the process exits.
+
+`summary` (or `1`) prints the time spent per span to stderr, any other value is
+the path of a Chrome trace file, open it in chrome://tracing or Perfetto.
+While profiling is off a traced function costs a single flag check.
+"""
+import atexit
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, Optional
+
+ENV_VAR = "MARK_PROFILE"
+SUMMARY = "summary"
+
+ENABLED = False
+# (name, start, duration, thread id, args), times in ns since the epoch
+SPANS = []
+# name -> callable returning {counter: value}, read once when reporting
+COUNTERS = {}
+_output = None
+NULL_SPAN = nullcontext()
+
+
+class Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, self.start, time.time_ns(), **self.args)
+
+
+def record(name: str, start: int, end: int, **args):
+    """add a span measured elsewhere, `start` and `end` in ns since the epoch"""
+    if not ENABLED:
+        return
+    SPANS.append((name, start, end - start, threading.get_ident(), args))
+
+
+def counters(name: str, read: Callable[[], Dict[str, int]]):
+    """report the counters returned by `read` at exit, a no-op when disabled"""
+    if ENABLED:
+        COUNTERS[name] = read
+
+
+def span(name: str, **args):
+    """context manager timing its block, `args` show up in the trace"""
+    if not ENABLED:
+        return NULL_SPAN
+    return Span(name, args)
+
+
+def traced(name: str = None):
+    """
+    time every call of the decorated function or coroutine function, the span
+    is named after the function unless `name` is given
+    """
+
+    def decorate(func):
+        label = name or func.__qualname__
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not ENABLED:
+                    return await func(*args, **kwargs)
+                with Span(label, {}):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with Span(label, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def process_start() -> Optional[int]:
+    """start time of this process in ns since the epoch, linux only"""
+    try:
+        with open("/proc/self/stat", "rb") as handle:
+            # the command name may hold spaces, fields are counted after it
+            fields = handle.read().rsplit(b")", 1)[1].split()
+        ticks = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        since_boot = time.clock_gettime(time.CLOCK_BOOTTIME) - ticks
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+    return time.time_ns() - int(since_boot * 1e9)
+
+
+def enable(output: str = None):
+    """
+    start recording spans, reported to `output` at exit: `summary` or a trace
+    file path. The time since the process started is recorded as `startup`
+    """
+    global ENABLED, _output
+    if ENABLED:
+        return
+    ENABLED = True
+    _output = SUMMARY if output in (None, "", "1", SUMMARY) else output
+    started = process_start()
+    if started is not None:
+        record("startup", started, time.time_ns())
+    atexit.register(report)
+
+
+def enable_from_env():
+    if os.environ.get(ENV_VAR):
+        enable(os.environ[ENV_VAR])
+
+
+def summarize(spans: Iterable) -> str:
+    """count, total and max time per span name, nested spans overlap"""
+    totals = defaultdict(lambda: [0, 0, 0])
+    for name, _, duration, _, _ in spans:
+        total = totals[name]
+        total[0] += 1
+        total[1] += duration
+        total[2] = max(total[2], duration)
+    lines = [f"{'span':<45} {'calls':>6} {'total ms':>10} {'max ms':>10}"]
+    for name, (count, total, longest) in sorted(
+        totals.items(), key=lambda item: item[1][1], reverse=True
+    ):
+        lines.append(
+            f"{name:<45} {count:>6} {total / 1e6:>10.2f} {longest / 1e6:>10.2f}"
+        )
+    return "\n".join(lines)
+
+
+def summarize_counters(values: Dict[str, Dict[str, int]]) -> str:
+    lines = []
+    for name, counts in values.items():
+        pairs = " ".join(f"{counter}={value}" for counter, value in counts.items())
+        lines.append(f"{name:<45} {pairs}")
+    return "\n".join(lines)
+
+
+def chrome_trace(spans: Iterable, values: Dict[str, Dict[str, int]] = None) -> bytes:
+    import orjson
+
+    pid = os.getpid()
+    events = [
+        {
+            "name": name,
+            "ph": "X",
+            "ts": start / 1e3,
+            "dur": duration / 1e3,
+            "pid": pid,
+            "tid": tid,
+            "args": args,
+        }
+        for name, start, duration, tid, args in spans
+    ]
+    now = time.time_ns() / 1e3
+    events.extend(
+        {"name": name, "ph": "C", "ts": now, "pid": pid, "args": counts}
+        for name, counts in (values or {}).items()
+    )
+    return orjson.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
+
+
+def report():
+    values = {name: read() for name, read in COUNTERS.items()}
+    if not SPANS and not values:
+        return
+    if _output == SUMMARY:
+        print(summarize(SPANS), file=sys.stderr)
+        if values:
+            print(summarize_counters(values), file=sys.stderr)
+        return
+    with open(_output, "wb") as handle:
+        handle.write(chrome_trace(SPANS, values))
+    print(f"trace of {len(SPANS)} spans written to {_output}", file=sys.stderr)
+
+
+@contextmanager
+def capture(kinds: Iterable[str], limit: int = 20):
+    """
+    run the block under cProfile (`cpu`) and/or tracemalloc (`memory`) and
+    print the top `limit` functions or allocation sites to stderr
+    """
+    kinds = set(kinds)
+    profiler = None
+    if "memory" in kinds:
+        import tracemalloc
+
+        tracemalloc.start()
+    if "cpu" in kinds:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            import pstats
+
+            profiler.disable()
+            stats = pstats.Stats(profiler, stream=sys.stderr)
+            stats.sort_stats("cumulative").print_stats(limit)
+        if "memory" in kinds:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"peak traced memory {peak / (1 << 20):.1f} MiB", file=sys.stderr)
+            for stat in snapshot.statistics("lineno")[:limit]:
+                print(stat, file=sys.stderr)
@@ -0,0 +1,52 @@
+"""
+Length-prefixed framing shared by the rofi script client and the daemon.
+
+Every message is a 4 bytes big endian payload length followed by the payload,
+so messages of any size survive partial reads and several messages can share
+a connection. Structured messages are orjson encoded.
+"""
+import asyncio
+import socket
+import struct
+
+import orjson
+
+HEADER = struct.Struct("!I")
+
+
+def frame(payload: bytes) -> bytes:
+    return HEADER.pack(len(payload)) + payload
+
+
+def encode_frame(obj) -> bytes:
+    return frame(orjson.dumps(obj))
+
+
+async def read_raw_frame(reader: asyncio.StreamReader) -> bytes:
+    """raises asyncio.IncompleteReadError when the peer closed the connection"""
+    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return await reader.readexactly(size)
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    return orjson.loads(await read_raw_frame(reader))
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("connection closed in the middle of a message")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_raw_frame(sock: socket.socket) -> bytes:
+    (size,) = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return recv_exactly(sock, size)
+
+
+def recv_frame(sock: socket.socket):
+    return orjson.loads(recv_raw_frame(sock))
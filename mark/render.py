@@ -0,0 +1,59 @@
+from collections import defaultdict
+from typing import Callable, Dict, Hashable
+
+from mark.rofi import Rofi
+
+# version slot of the folder list, bumped whenever any folder changes
+FOLDERS = None
+
+
+class Menu:
+    """
+    A rendered folder: the title mapping and the rofi payloads built from it,
+    one per client mode and menu options
+    """
+
+    def __init__(self, version: int, mapping: Dict, meta: bool):
+        self.version = version
+        self.mapping = mapping
+        self.meta = meta
+        self.payloads = {}
+
+    def payload(self, mode: str, options: Dict) -> bytes:
+        key = (mode, tuple(sorted(options.items())))
+        if key not in self.payloads:
+            if self.meta:
+                items = [(title, value[1]) for title, value in self.mapping.items()]
+            else:
+                items = list(self.mapping)
+            self.payloads[key] = Rofi(mode=mode).render_payload(
+                items, meta=self.meta, **options
+            )
+        return self.payloads[key]
+
+
+class RenderCache:
+    """
+    Rendered menus keyed by (folder, template, meta) and tagged with the
+    version of the folder they were rendered from. Invalidating a folder bumps
+    its version, so only its menus and the folder list are rendered again.
+    """
+
+    def __init__(self):
+        self.versions = defaultdict(int)
+        self.menus = {}
+
+    def invalidate(self, folder: str):
+        self.versions[folder] += 1
+        self.versions[FOLDERS] += 1
+
+    def menu(
+        self, folder: Hashable, template: str, meta: bool, render: Callable[[], Dict]
+    ) -> Menu:
+        """cached menu of `folder`, `render` builds its mapping when stale"""
+        key = (folder, template, meta)
+        version = self.versions[folder]
+        menu = self.menus.get(key)
+        if menu is None or menu.version != version:
+            menu = self.menus[key] = Menu(version, render(), meta)
+        return menu
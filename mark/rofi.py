@@ -4,6 +4,7 @@ import shutil
 from pathlib import Path
 from typing import List, Tuple
 
+from mark.profiling import traced
 from mark.utils import encode_message
 
 
@@ -26,6 +27,7 @@ class Rofi:
         format: str = "i",  # returns the index of the selected item
         hover_select: bool = False,
         paste_key: str = "Control+v",  # placeholder for now
+        page_size: int = 500,
     ):
         assert mode in ["dmenu", "script"]
         assert limit >= 1
@@ -42,6 +44,8 @@ class Rofi:
         self.format = format  # i means index
         self.hover_select = hover_select
         self.paste_key = paste_key
+        # entries sent at once, the rest follows while the menu is open
+        self.page_size = page_size
         self.proc = None
         self.server_should_exit = False
 
@@ -66,8 +70,43 @@ class Rofi:
         except OSError:
             pass
 
+    async def __feed_rows(self, items, meta: bool):
+        """
+        write dmenu rows page by page, rofi shows the menu as soon as the first
+        page arrives and reads the rest asynchronously
+        """
+        stdin = self.proc.stdin
+        page = []
+        try:
+            for item in items:
+                page.append(self.__format_row(item, meta))
+                if len(page) == self.page_size:
+                    stdin.write(encode_message("".join(page)))
+                    page = []
+                    await stdin.drain()
+            stdin.write(encode_message("".join(page)))
+            await stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # rofi exited before reading all the rows
+            return
+        stdin.close()
+
+    async def __feed_payload(self, payload: bytes):
+        try:
+            self.proc.stdin.write(payload)
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        self.proc.stdin.close()
+
+    @traced()
     async def __start_rofi_process(
-        self, args: List, sinput: List = None, timeout: int = 50
+        self,
+        args: List,
+        items=None,
+        meta: bool = False,
+        payload: bytes = None,
+        timeout: int = 50,
     ) -> Tuple:
         stdin = None
         if self.mode == "dmenu":
@@ -78,10 +117,14 @@ class Rofi:
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
         )
+        tasks = [self.proc.stdout.read(), self.proc.stderr.read()]
+        if self.mode == "dmenu" and payload is not None:
+            tasks.append(self.__feed_payload(payload))
+        elif self.mode == "dmenu":
+            tasks.append(self.__feed_rows(items or [], meta))
         try:
-            stdout, stderr = await asyncio.wait_for(
-                self.proc.communicate(input=sinput), timeout=timeout
-            )
+            stdout, *_ = await asyncio.wait_for(asyncio.gather(*tasks), timeout=timeout)
+            await self.proc.wait()
         except asyncio.exceptions.TimeoutError:
             try:
                 self.proc.kill()
@@ -109,7 +152,8 @@ class Rofi:
             % (self.fontname, self.fontsize),
         ]
 
-    def __get_common_args(self):
+    def __get_common_args(self, prompt: str = None):
+        prompt = prompt or self.prompt
         assert self.matching in {"fuzzy", "normal", "regex", "glob", "prefix"}
         # fmt: off
         args = [
@@ -135,14 +179,20 @@ class Rofi:
                 os.environ["ROFI_MESSAGE"] = self.message
         elif self.mode == "dmenu":
             args.extend(["-dmenu"])
-            if self.prompt:
-                args.extend(["-p", self.prompt])
+            if prompt:
+                args.extend(["-p", prompt])
         if self.case_insensitive:
             args.append("-i")
         if self.hover_select:
             args.append("-hover-select")
         return args
 
+    def __format_row(self, item, meta: bool) -> str:
+        if meta:
+            title, url = item
+            return f"{title}\x00meta\x1f{url}{self.sep}"
+        return f"{item}{self.sep}"
+
     def stringify(self, items: List, dummy: bool = True, meta: bool = False) -> str:
         if not meta:
             input_str = self.sep.join(items)
@@ -163,7 +213,14 @@ class Rofi:
     ):
         # process communication: send updated data to rofi
         if self.mode == "script":
-            os.environ["ROFI_INIT"] = self.stringify(items)
+            # large lists would hit the environment size limit, in that case
+            # the script fetches them from the server instead
+            if len(items) <= self.page_size:
+                os.environ["ROFI_INIT"] = self.stringify(items)
+                os.environ.pop("ROFI_INIT_REMOTE", None)
+            else:
+                os.environ.pop("ROFI_INIT", None)
+                os.environ["ROFI_INIT_REMOTE"] = "1"
         if pre_selected_idx is not None:
             # +1 to accommodate the dummy line
             args.extend(["selected-row", str(pre_selected_idx + 1)])
@@ -171,6 +228,17 @@ class Rofi:
             args.extend(["-filter", filter])
         return args
 
+    def __get_dmenu_args(self, options: dict) -> List:
+        # script mode row options passed as dmenu command line arguments
+        args = []
+        if options.get("message"):
+            args.extend(["-mesg", options["message"]])
+        if options.get("markup-rows") == "true":
+            args.append("-markup-rows")
+        if options.get("no-custom") == "true":
+            args.append("-no-custom")
+        return args
+
     def send_message(self, msg: str) -> bytes:
         assert self.mode == "script"
         line = f"\x00message\x1f{msg}\n"
@@ -192,20 +260,37 @@ class Rofi:
             rofi_data = "".join([rofi_data, line])
         return encode_message(rofi_data)
 
+    def render_payload(self, items: List, meta: bool = False, **kwargs) -> bytes:
+        """
+        bytes that show `items`: the script mode update or the dmenu rows,
+        dmenu options are command line arguments and not part of the payload
+        """
+        if self.mode == "script":
+            return self.update_data(items, meta=meta, **kwargs)
+        return encode_message("".join(self.__format_row(item, meta) for item in items))
+
     async def open_menu(
         self,
         items: List,
         pre_selected_idx: int = None,
         filter: str = "",
-    ):
+        meta: bool = False,
+        payload: bytes = None,
+        **kwargs,
+    ) -> Tuple:
+        """
+        kwargs are the menu options (message, prompt, markup-rows, no-custom),
+        only used in dmenu mode, script mode receives them from the server.
+        In dmenu mode a `payload` from `render_payload` is sent as is instead
+        of the items. Returns rofi's stdout and return code
+        """
         self.check_rofi_installation()
-        args = self.__get_common_args()
+        args = self.__get_common_args(prompt=kwargs.get("prompt"))
         args.extend(self.__format_rofi_menu())
         args = self.__prepare_data(args, items, pre_selected_idx, filter)
-        sinput = None
-        if self.mode == "dmenu" and items:
-            sinput = encode_message(self.stringify(items, dummy=False))
-        await self.__start_rofi_process(args, sinput)
+        if self.mode == "dmenu":
+            args.extend(self.__get_dmenu_args(kwargs))
+        return await self.__start_rofi_process(args, items, meta, payload)
 
 
 if __name__ == "__main__":
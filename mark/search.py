@@ -0,0 +1,204 @@
+import html
+import re
+import zlib
+from collections import Counter, defaultdict
+from typing import Iterable, List, Set, Tuple
+
+import orjson
+
+from mark.storage import atomic_write
+
+INDEX_SUFFIX = ".idx"
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def trigrams(token: str) -> List[str]:
+    # short tokens are indexed as a whole
+    if len(token) < 3:
+        return [token]
+    return [token[i:i + 3] for i in range(len(token) - 2)]
+
+
+class SearchIndex:
+    """
+    Trigram inverted index over the title, url and folder of every bookmark
+    of a database, persisted next to it as `<db>.idx`.
+
+    Bookmarks are mostly appended to folders, so the index keeps how many rows
+    of each folder it holds with a running checksum of them, and `sync` only
+    indexes the new tail rows. A folder that shrank, disappeared or had rows
+    changed in place, like titles filled by `mark titles`, has its documents
+    dropped and indexed again while the other folders are left alone. Dropped
+    documents stay in the postings as holes until they outnumber the live
+    ones, then the index is rebuilt.
+    """
+
+    VERSION = 3
+
+    def __init__(self, path: str):
+        self.path = path
+        self.signature = None
+        # doc id -> [folder, title, url], None once dropped
+        self.docs = []
+        self.dropped = 0
+        self.postings = defaultdict(list)
+        # folder -> [indexed rows, checksum of the indexed rows]
+        self.folder_counts = {}
+
+    @staticmethod
+    def checksum(rows: Iterable, value: int = 0) -> int:
+        """crc of the rows, extended from `value` the checksum of earlier rows"""
+        for row in rows:
+            value = zlib.crc32(orjson.dumps(row), value)
+        return value
+
+    @classmethod
+    def load(cls, db_file: str) -> "SearchIndex":
+        index = cls(db_file + INDEX_SUFFIX)
+        try:
+            with open(index.path, "rb") as handle:
+                data = orjson.loads(handle.read())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return index
+        if data.get("version") != cls.VERSION:
+            return index
+        index.signature = data["signature"]
+        index.docs = data["docs"]
+        index.dropped = data["dropped"]
+        index.postings = defaultdict(list, data["postings"])
+        index.folder_counts = data["folder_counts"]
+        return index
+
+    def save(self):
+        data = {
+            "version": self.VERSION,
+            "signature": self.signature,
+            "docs": self.docs,
+            "dropped": self.dropped,
+            "postings": self.postings,
+            "folder_counts": self.folder_counts,
+        }
+        atomic_write(self.path, orjson.dumps(data))
+
+    def clear(self):
+        self.docs = []
+        self.dropped = 0
+        self.postings = defaultdict(list)
+        self.folder_counts = {}
+
+    def add(self, folder: str, title: str, url: str):
+        doc_id = len(self.docs)
+        self.docs.append([folder, title, url])
+        terms = set()
+        for token in tokenize(" ".join(filter(None, (folder, title, url)))):
+            terms.update(trigrams(token))
+        for term in terms:
+            self.postings[term].append(doc_id)
+
+    def drop(self, folders: Set[str]):
+        """forget every document of `folders`"""
+        for doc_id, doc in enumerate(self.docs):
+            if doc is not None and doc[0] in folders:
+                self.docs[doc_id] = None
+                self.dropped += 1
+        for folder in folders:
+            self.folder_counts.pop(folder, None)
+        if self.dropped * 2 > len(self.docs):
+            self.clear()
+
+    def sync(self, db) -> bool:
+        """
+        bring the index up to date with the database, returns True if it
+        changed and has to be saved
+        """
+        # compared with the json stored signature
+        signature = orjson.loads(orjson.dumps(db.signature()))
+        if signature == self.signature:
+            return False
+        folders = {folder: list(rows) for folder, rows in db.iter_folder_rows()}
+        stale = set(self.folder_counts) - set(folders)
+        checksums = {}
+        for folder, rows in folders.items():
+            count, checksum = self.folder_counts.get(folder, (0, 0))
+            if len(rows) < count or self.checksum(rows[:count]) != checksum:
+                stale.add(folder)
+            else:
+                checksums[folder] = checksum
+        if stale:
+            self.drop(stale)
+        for folder, rows in folders.items():
+            count = self.folder_counts.get(folder, (0, 0))[0]
+            for url, title in rows[count:]:
+                self.add(folder, title, url)
+            checksum = self.checksum(rows[count:], checksums[folder] if count else 0)
+            self.folder_counts[folder] = [len(rows), checksum]
+        self.signature = signature
+        return True
+
+    def search(self, query: str, limit: int = 50) -> List[Tuple]:
+        """
+        (score, folder, title, url) of the best matches, a doc scores the
+        fraction of each query token's trigrams it contains, with a bonus when
+        the token is found in the title
+        """
+        scores = Counter()
+        tokens = tokenize(query)
+        for token in tokens:
+            grams = set(trigrams(token))
+            weight = 1 / len(grams)
+            for gram in grams:
+                for doc_id in self.postings.get(gram, ()):
+                    scores[doc_id] += weight
+        if self.dropped:
+            for doc_id in [doc_id for doc_id in scores if self.docs[doc_id] is None]:
+                del scores[doc_id]
+        results = []
+        # only the best candidates get the title check
+        for doc_id, score in scores.most_common(limit * 4):
+            folder, title, url = self.docs[doc_id]
+            lowered = title.lower()
+            score += sum(0.5 for token in tokens if token in lowered)
+            results.append((score, folder, title, url))
+        results.sort(key=lambda result: -result[0])
+        return results[:limit]
+
+
+def open_search_index(db, db_file: str) -> SearchIndex:
+    """load the persisted index of `db_file`, updating it if needed"""
+    index = SearchIndex.load(db_file)
+    if index.sync(db):
+        index.save()
+    return index
+
+
+async def run_search_menu(index: SearchIndex, on_selection: str, limit: int):
+    """
+    dmenu loop: typed text that matches no listed result is a new query, whose
+    ranked results replace the list
+    """
+    from mark.rofi import Rofi
+    from mark.utils import copy_selection, decode_message, open_selection
+
+    on_selection_funcs = {"copy": copy_selection, "open": open_selection}
+    rofi = Rofi(mode="dmenu", format="s")
+    mapping = {}
+    message = "<b>type a query and press enter</b>"
+    while True:
+        kwargs = {"prompt": "search", "message": message, "markup-rows": "true"}
+        stdout, returncode = await rofi.open_menu(list(mapping), **kwargs)
+        if returncode != 0:
+            return
+        value = decode_message(stdout).rstrip("\n")
+        if value in mapping:
+            title, url = mapping[value]
+            on_selection_funcs[on_selection](title, url)
+            return
+        mapping = {
+            "%s  <i>%s/</i>" % (html.escape(title), html.escape(folder)): (title, url)
+            for _, folder, title, url in index.search(value, limit)
+        }
+        message = "<b>%d results for</b> %s" % (len(mapping), html.escape(value))
@@ -1,13 +1,15 @@
 import asyncio
-import json
+import os
 import sys
 import socket
+import time
 from contextlib import closing
 from string import Template
+from typing import TYPE_CHECKING, Sequence
 
-from tinydb import TinyDB
-
-from mark.db import DataBase
+from mark.daemon import connect_daemon
+from mark.profiling import record, span, traced
+from mark.protocol import frame, read_frame
 from mark.rofi import Rofi
 from mark.utils import (
     copy_selection,
@@ -17,11 +19,14 @@ from mark.utils import (
     open_selection,
 )
 
+if TYPE_CHECKING:
+    from mark.db import DataBase
+
 
 class Server:
     def __init__(
         self,
-        db: TinyDB,
+        db: "DataBase",
         mode: str = "read",
         rofi_inst: Rofi = None,
         on_selection: str = None,
@@ -41,19 +46,48 @@ class Server:
         self.pack = {"current": "folder"}
         self.url_meta = url_meta
         self.no_duplicates = no_duplicates
+        # (items, meta, options) of the menu shown next in dmenu client mode
+        self.next_menu = None
 
     def update_state(self, **kwargs):
         if "mapping" in kwargs:
             self.mapping = kwargs.pop("mapping")
         self.pack = {**self.pack, **kwargs}
 
-    async def __close_connection(self, writer: asyncio.StreamWriter, force=False):
-        writer.write(encode_message("quit"))
+    @traced()
+    async def __send_menu(
+        self,
+        writer: asyncio.StreamWriter,
+        items,
+        meta: bool = False,
+        payload: bytes = None,
+        **kwargs,
+    ):
+        """
+        send the next menu to the rofi script, in dmenu client mode there is no
+        writer and the menu is opened by `run_dmenu` instead. A payload already
+        rendered by `Rofi.render_payload` is sent in place of the items
+        """
+        if writer is None:
+            self.next_menu = (items, meta, payload, kwargs)
+            return
+        if payload is None:
+            if items is not None:
+                items = list(items)
+            payload = self.rofi.update_data(items, meta=meta, **kwargs)
+        writer.write(frame(payload))
         await writer.drain()
+
+    async def __close_connection(self, writer: asyncio.StreamWriter, force=False):
+        self.next_menu = None
+        if writer is not None:
+            writer.write(frame(encode_message("quit")))
+            await writer.drain()
         self.rofi.kill_proc()
         if force:
             sys.exit(0)
 
+    @traced()
     async def __handle_root_selection(self, writer: asyncio.StreamWriter, stitle: str):
         on_selection_funcs = {
             "copy": copy_selection,
@@ -64,29 +98,51 @@ class Server:
             _, url = self.db.get_bookmark(self.pack["folder"], title)
         else:
             url = self.mapping[stitle][1]
-        on_selection_funcs[self.on_selection](title, url)
+        # the rofi script waits for its reply, answer before handing off
         await self.__close_connection(writer)
+        on_selection_funcs[self.on_selection](title, url)
+        # like an insertion, the selection ends the session
+        sys.exit(0)
 
+    @traced()
     async def __handle_folder_selection(
         self, writer: asyncio.StreamWriter, folder: str
     ):
         self.pack["folder"] = self.mapping[folder]
-        self.mapping = self.db.list_bookmarks(
+        # the mapping is filled while the entries are sent, so in dmenu mode the
+        # first page reaches rofi before the whole folder is rendered
+        self.mapping = {}
+        entries = self.db.iter_bookmarks(
             self.pack["folder"], self.entry_format, meta=self.url_meta
         )
         kwargs = {
             "message": "<b>%s/</b>" % self.pack["folder"],
             "markup-rows": "true",
         }
-        if self.url_meta:
-            items = [(title, value[1]) for title, value in self.mapping.items()]
-        else:
-            items = list(self.mapping.keys())
+        if self.rofi.mode == "dmenu":
+            kwargs["no-custom"] = "true"
 
-        data = self.rofi.update_data(items, meta=self.url_meta, **kwargs)
-        writer.write(data)
-        await writer.drain()
+        render = getattr(self.db, "render_bookmarks", None)
+        if render is not None:
+            # the daemon keeps the folder rendered, nothing to do per entry
+            self.mapping, payload = render(
+                self.pack["folder"],
+                self.entry_format,
+                self.url_meta,
+                self.rofi.mode,
+                kwargs,
+            )
+            await self.__send_menu(writer, None, payload=payload, **kwargs)
+            return
+
+        def items():
+            for title, value in entries:
+                self.mapping[title] = value
+                yield (title, value[1]) if self.url_meta else title
+
+        await self.__send_menu(writer, items(), meta=self.url_meta, **kwargs)
 
+    @traced()
     async def __handle_manual_bookmark_title(
         self, writer: asyncio.StreamWriter, url: str
     ):
@@ -94,13 +150,14 @@ class Server:
             "prompt": "title",
             "message": url,
         }
-        data = self.rofi.update_data(None, **kwargs)
-        writer.write(data)
-        await writer.drain()
+        await self.__send_menu(writer, None, **kwargs)
 
+    @traced()
     async def __handle_bookmark_insertion(
         self, writer: asyncio.StreamWriter, value: str
     ):
+        from mark.storage import ReadOnlyError
+
         if self.pack["current"] == "folder":
             # if folder is not in mapping then it is new
             self.pack["folder"] = self.mapping.get(value, value)
@@ -118,9 +175,12 @@ class Server:
         if self.pack["current"] == "title":
             self.pack["title"] = value
 
-        self.db.insert_bookmark(
-            self.pack["folder"], self.pack["url"], self.pack["title"]
-        )
+        try:
+            self.db.insert_bookmark(
+                self.pack["folder"], self.pack["url"], self.pack["title"]
+            )
+        except ReadOnlyError as err:
+            print(err)
         await self.__close_connection(writer, force=True)
 
     async def __handle_readwrite_mode(
@@ -130,26 +190,56 @@ class Server:
             if self.rofi.server_should_exit:
                 quit()
             try:
-                await asyncio.sleep(0)
-                response = await reader.read(4096)
                 # response format -> {"code": return_code, "value": selected_item}
-                if response is None:
-                    continue
-                response = json.loads(decode_message(response))
-                res_value = response["value"]
-                entry = self.mapping.get(res_value, res_value)
-                p = entry[0] if len(entry) == 2 else entry
-                if self.mode == "read" and not self.db.is_folder(p):
-                    await self.__handle_root_selection(writer, res_value)
-                elif self.mode == "read":
-                    await self.__handle_folder_selection(writer, res_value)
-                elif self.mode == "write":
-                    await self.__handle_bookmark_insertion(writer, res_value)
-            except json.JSONDecodeError:
+                response = await read_frame(reader)
+            except asyncio.IncompleteReadError:
+                # the rofi script exits after every selection
+                break
+            if "started" in response:
+                # from the start of the rofi script to its request reaching us
+                record("script.roundtrip", response["started"], time.time_ns())
+            if response.get("init"):
+                # initial folder list too large for the ROFI_INIT variable
+                items = self.rofi.stringify(list(self.mapping.keys()))
+                writer.write(frame(encode_message(items)))
+                await writer.drain()
                 continue
+            await self.__handle_selection(writer, response["value"])
         writer.close()
         await writer.wait_closed()
 
+    @traced()
+    async def __handle_selection(self, writer: asyncio.StreamWriter, res_value: str):
+        entry = self.mapping.get(res_value, res_value)
+        # folders map to their raw name, entries to a (title, url) sequence
+        is_entry = not isinstance(entry, str)
+        if self.mode == "read" and (is_entry or not self.db.is_folder(entry)):
+            await self.__handle_root_selection(writer, res_value)
+        elif self.mode == "read":
+            await self.__handle_folder_selection(writer, res_value)
+        elif self.mode == "write":
+            await self.__handle_bookmark_insertion(writer, res_value)
+
+    async def run_dmenu(self, items: list):
+        """
+        dmenu client mode: every menu is a rofi dmenu process fed and read
+        through pipes by this process, no script is spawned per selection
+        """
+        kwargs = {"message": self.rofi.message, "markup-rows": "true"}
+        if self.mode == "read":
+            kwargs["no-custom"] = "true"
+        self.next_menu = (items, False, None, kwargs)
+        while self.next_menu is not None:
+            items, meta, payload, kwargs = self.next_menu
+            self.next_menu = None
+            stdout, returncode = await self.rofi.open_menu(
+                items, meta=meta, payload=payload, **kwargs
+            )
+            # rofi was cancelled
+            if returncode != 0:
+                return
+            await self.__handle_selection(None, decode_message(stdout).rstrip("\n"))
+
     async def run_server(self, port):
         server = await asyncio.start_server(
             self.__handle_readwrite_mode, host="localhost", port=port
@@ -168,8 +258,33 @@ class Server:
             return soc.getsockname()[1]
 
     @staticmethod
+    def open_database(db_files: Sequence[str], mode: str):
+        """
+        database `get` and `insert` work with, several files or a directory
+        are merged into a `FederatedDataBase`
+        """
+        if len(db_files) > 1 or os.path.isdir(db_files[0]):
+            from mark.federated import FederatedDataBase, expand_db_files
+
+            return FederatedDataBase(expand_db_files(db_files))
+        db_file = db_files[0]
+        # a running `mark daemon` already holds the database in memory
+        db = connect_daemon(db_file)
+        if db is None and mode == "read":
+            # an up to date snapshot is read without parsing the database
+            from mark.snapshot import open_snapshot
+
+            db = open_snapshot(db_file)
+        if db is None:
+            from mark.db import open_database
+
+            db = open_database(db_file)
+        return db
+
+    @staticmethod
+    @traced("Server.execute_async_server")
     async def execute_async_server(
-        db_file: str,
+        db_files: Sequence[str],
         mode: str,
         on_selection: str = None,
         folder_format: str = "$title/",
@@ -177,13 +292,19 @@ class Server:
         infer_title: bool = False,
         no_duplicates: bool = False,
         url_meta: bool = False,
+        client: str = "script",
     ):
         entry_format_temp = Template(entry_format)
         folder_format_temp = Template(folder_format)
-        port = Server.get_free_port()
         message = "choose or create folder" if mode == "write" else "choose folder"
-        rofi = Rofi(message=f"<b>{message}</b>").setup_client(mode, port)
-        db = DataBase(db_file)
+        if client == "dmenu":
+            # return the selected string, custom input is returned as typed
+            rofi = Rofi(mode="dmenu", format="s", message=f"<b>{message}</b>")
+        else:
+            port = Server.get_free_port()
+            rofi = Rofi(message=f"<b>{message}</b>").setup_client(mode, port)
+        with span("Server.open_database", paths=list(db_files)):
+            db = Server.open_database(db_files, mode)
         async_server = Server(
             db,
             mode=mode,
@@ -198,6 +319,9 @@ class Server:
             async_server.update_state(url=url, title=title)
         # set initial list of items
         async_server.update_state(mapping=db.list_folders(template=folder_format_temp))
+        if client == "dmenu":
+            await async_server.run_dmenu(list(async_server.mapping.keys()))
+            return
         await asyncio.gather(
             async_server.rofi.open_menu(list(async_server.mapping.keys())),
             async_server.run_server(port=port),
@@ -0,0 +1,249 @@
+"""
+Compact binary snapshot of a database, written next to it as `<db>.snap` and
+memory mapped by read-only commands.
+
+Layout, integers are little endian:
+
+    header      magic, version, signature length, folder count, directory offset
+    signature   orjson encoded signature of the database the snapshot was made of
+    folders     per folder: (title length, url length) u32 pairs, then the
+                title and url bytes of every row
+    names       utf-8 folder names
+    directory   per folder: name offset, name length, rows offset, row count
+
+Opening a snapshot only parses the directory, the rows of a folder are decoded
+when the folder is listed.
+"""
+import mmap
+import os
+import sys
+from array import array
+from struct import Struct
+from struct import error as StructError
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import orjson
+
+from mark.db import DataBase, open_database
+from mark.profiling import traced
+from mark.storage import ReadOnlyError, atomic_write
+from mark.utils import normalize_url
+
+SNAPSHOT_SUFFIX = ".snap"
+MAGIC = b"MARKSNAP"
+VERSION = 1
+HEADER = Struct("<8sIIIQ")
+DIRECTORY_ENTRY = Struct("<QIQI")
+
+
+def snapshot_path(db_file: str) -> str:
+    return db_file + SNAPSHOT_SUFFIX
+
+
+def _lengths(values: List[int]) -> bytes:
+    lengths = array("I", values)
+    if sys.byteorder == "big":
+        lengths.byteswap()
+    return lengths.tobytes()
+
+
+def write_snapshot(db: DataBase, path: str = None) -> str:
+    """write the snapshot of `db`, returns its path"""
+    path = path or snapshot_path(db.filename)
+    # taken before reading, a write in between only makes the snapshot stale
+    signature = orjson.dumps(db.signature())
+    chunks = [b"", signature]
+    offset = HEADER.size + len(signature)
+    folders = []
+    for folder, rows in db.iter_folder_rows():
+        encoded = [
+            (title.encode("utf-8"), (url or "").encode("utf-8")) for url, title in rows
+        ]
+        lengths = _lengths([len(part) for row in encoded for part in row])
+        block = lengths + b"".join(part for row in encoded for part in row)
+        folders.append((folder.encode("utf-8"), offset, len(encoded)))
+        chunks.append(block)
+        offset += len(block)
+    directory = []
+    for name, rows_offset, count in folders:
+        chunks.append(name)
+        directory.append(DIRECTORY_ENTRY.pack(offset, len(name), rows_offset, count))
+        offset += len(name)
+    chunks.extend(directory)
+    chunks[0] = HEADER.pack(MAGIC, VERSION, len(signature), len(folders), offset)
+    atomic_write(path, b"".join(chunks))
+    return path
+
+
+class Snapshot:
+    """Memory mapped snapshot file, folder rows are decoded on demand"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as handle:
+            self.buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, signature_size, count, directory = HEADER.unpack_from(
+            self.buffer
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a mark snapshot")
+        self.signature = self.buffer[HEADER.size:HEADER.size + signature_size]
+        # folder -> (rows offset, row count)
+        self.folders = {}
+        entries = self.buffer[directory:directory + count * DIRECTORY_ENTRY.size]
+        for name_offset, name_size, rows_offset, rows in DIRECTORY_ENTRY.iter_unpack(
+            entries
+        ):
+            name = self.buffer[name_offset:name_offset + name_size].decode("utf-8")
+            self.folders[name] = (rows_offset, rows)
+
+    def rows(self, folder: str) -> Iterator[Tuple[str, str]]:
+        """(url, title) rows of `folder`"""
+        offset, count = self.folders[folder]
+        lengths = array("I")
+        lengths.frombytes(self.buffer[offset:offset + count * 2 * lengths.itemsize])
+        if sys.byteorder == "big":
+            lengths.byteswap()
+        position = offset + count * 2 * lengths.itemsize
+        buffer = self.buffer
+        for i in range(0, len(lengths), 2):
+            title_end = position + lengths[i]
+            url_end = title_end + lengths[i + 1]
+            title = buffer[position:title_end].decode("utf-8")
+            yield buffer[title_end:url_end].decode("utf-8"), title
+            position = url_end
+
+    def close(self):
+        self.buffer.close()
+
+
+class SnapshotDataBase(DataBase):
+    """
+    Read-only DataBase over a snapshot, writes raise `ReadOnlyError`. The rows
+    of a folder are decoded once, when it is first read, along with its title
+    and url lookups
+    """
+
+    def __init__(self, filename: str, snapshot: Snapshot):
+        self.filename = filename
+        self.snapshot = snapshot
+        # folder -> [(url, title)]
+        self._rows = {}
+        # folder -> {title: url}, the first row wins as in tinydb lookups
+        self._titles = {}
+        # folder -> set of normalized urls
+        self._urls = {}
+
+    def __read_only(self) -> ReadOnlyError:
+        return ReadOnlyError(f"{self.filename} is opened read-only from its snapshot")
+
+    def write(self, operation, *args):
+        raise self.__read_only()
+
+    def insert_bookmark(self, table: str, url: str, title: str):
+        raise self.__read_only()
+
+    def insert_multiple(self, table: str, bookmark: List):
+        raise self.__read_only()
+
+    def set_titles(self, tablename: str, titles: Dict[str, str]) -> int:
+        raise self.__read_only()
+
+    def get_table_handle(self, tablename: str):
+        raise self.__read_only()
+
+    def signature(self):
+        """signature of the database the snapshot was made of"""
+        return orjson.loads(self.snapshot.signature)
+
+    def cache_stats(self) -> Dict:
+        return {"hits": 0, "misses": 0}
+
+    def __rows(self, tablename: str) -> List[Tuple[str, str]]:
+        rows = self._rows.get(tablename)
+        if rows is None:
+            rows = self._rows[tablename] = [
+                (url, title or url) for url, title in self.snapshot.rows(tablename)
+            ]
+        return rows
+
+    def is_folder(self, table: str) -> bool:
+        return table in self.snapshot.folders
+
+    @traced()
+    def get_bookmark(self, tablename: str, title: str) -> Tuple[str, str]:
+        titles = self._titles.get(tablename)
+        if titles is None:
+            titles = self._titles[tablename] = {}
+            for url, row_title in self.__rows(tablename):
+                titles.setdefault(row_title, url)
+        return title, titles[title]
+
+    @traced()
+    def bookmark_exists_in_table(self, tablename, url):
+        if tablename not in self.snapshot.folders:
+            return False
+        urls = self._urls.get(tablename)
+        if urls is None:
+            urls = self._urls[tablename] = {
+                normalize_url(row_url) for row_url, _ in self.__rows(tablename)
+            }
+        return normalize_url(url) in urls
+
+    def list_raw_bookmarks(self, tablename: str):
+        return iter(self.__rows(tablename))
+
+    def list_raw_folders(self):
+        return list(self.snapshot.folders)
+
+    def iter_folder_rows(self):
+        for folder in self.snapshot.folders:
+            yield folder, self.snapshot.rows(folder)
+
+    def read_tables(self) -> Dict:
+        return {
+            folder: {
+                str(doc_id): {"url": url, "title": title}
+                for doc_id, (url, title) in enumerate(rows, start=1)
+            }
+            for folder, rows in self.iter_folder_rows()
+        }
+
+
+def load_snapshot(path: str) -> Optional[Snapshot]:
+    """the snapshot at `path`, None when it is missing or unreadable"""
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError, StructError):
+        return None
+
+
+def open_snapshot(
+    db_file: str, path: str = None, create: bool = False
+) -> Optional[DataBase]:
+    """
+    read-only database over the snapshot of `db_file` stored at `path`. A
+    snapshot older than the database is rebuilt from it, a missing one only
+    with `create`, otherwise None is returned. The database itself is
+    returned when the snapshot cannot be written
+    """
+    path = path or snapshot_path(db_file)
+    if not create and not os.path.exists(path):
+        return None
+    db = open_database(db_file)
+    # taking the signature does not parse the database
+    signature = orjson.dumps(db.signature())
+    snapshot = load_snapshot(path)
+    if snapshot is not None and snapshot.signature == signature:
+        return SnapshotDataBase(db_file, snapshot)
+    if snapshot is not None:
+        snapshot.close()
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        write_snapshot(db, path)
+    except OSError:
+        return db
+    snapshot = load_snapshot(path)
+    # the database was written again while the snapshot was made
+    if snapshot is None or snapshot.signature != orjson.dumps(db.signature()):
+        return db
+    return SnapshotDataBase(db_file, snapshot)
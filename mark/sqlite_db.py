@@ -0,0 +1,255 @@
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from mark.db import DataBase
+from mark.profiling import traced
+from mark.utils import normalize_url
+
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS bookmarks (
+    id INTEGER PRIMARY KEY,
+    folder TEXT NOT NULL,
+    title TEXT,
+    url TEXT NOT NULL,
+    normalized_url TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bookmarks_folder_title ON bookmarks (folder, title);
+CREATE INDEX IF NOT EXISTS bookmarks_folder_url
+    ON bookmarks (folder, normalized_url);
+CREATE TABLE IF NOT EXISTS meta (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
+"""
+# inserts show in the largest row ids, updates and deletes bump meta.version
+VERSION_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS {table}_{name} AFTER {event} ON {table}
+BEGIN
+    INSERT OR REPLACE INTO meta (id, version)
+    VALUES (0, COALESCE((SELECT version FROM meta WHERE id = 0), 0) + 1);
+END;
+"""
+SCHEMA += "".join(
+    VERSION_TRIGGER.format(table=table, event=event, name=event.lower())
+    for table in ("folders", "bookmarks")
+    for event in ("UPDATE", "DELETE")
+)
+
+
+class SQLiteDataBase(DataBase):
+    """
+    DataBase backed by the stdlib sqlite3 module, folders are rows of the
+    `folders` table and title/url lookups are served by indexes instead of
+    scanning the whole folder.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self._bulk_depth = 0
+
+    @contextmanager
+    def bulk(self, exclusive: bool = False):
+        """
+        Run every insert made inside the block in a single transaction,
+        `exclusive` takes the write lock up front instead of on the first write
+        """
+        if self._bulk_depth:
+            yield self
+            return
+        self._bulk_depth += 1
+        try:
+            with self.conn:
+                if exclusive:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                yield self
+        finally:
+            self._bulk_depth -= 1
+
+    def cache_stats(self) -> Dict:
+        """sqlite has its own page cache, there is no read cache to report"""
+        return {"hits": 0, "misses": 0}
+
+    def signature(self):
+        """
+        changes on every committed write of any process. The files cannot
+        tell, sqlite rewrites them when it checkpoints the write-ahead log
+        """
+        return self.conn.execute(
+            "SELECT (SELECT MAX(id) FROM bookmarks), (SELECT MAX(id) FROM folders),"
+            " (SELECT version FROM meta WHERE id = 0)"
+        ).fetchone()
+
+    @traced()
+    def write(self, operation, *args):
+        # sqlite serializes writers by itself
+        with self.bulk():
+            return operation(*args)
+
+    @contextmanager
+    def __transaction(self):
+        if self._bulk_depth:
+            yield
+            return
+        with self.conn:
+            yield
+
+    def __ensure_folder(self, table: str):
+        self.conn.execute("INSERT OR IGNORE INTO folders (name) VALUES (?)", (table,))
+
+    def insert_bookmark(self, table: str, url: str, title: str):
+        # set the default title to url if the user didnot typed a title
+        if title is None or not title.strip():
+            title = url
+        with self.__transaction():
+            self.__ensure_folder(table)
+            self.conn.execute(
+                "INSERT INTO bookmarks (folder, title, url, normalized_url)"
+                " VALUES (?, ?, ?, ?)",
+                (table, title.strip(), url, normalize_url(url)),
+            )
+
+    def insert_multiple(self, table: str, bookmark: List):
+        rows = [
+            (table, row.get("title"), row["url"], normalize_url(row["url"]))
+            for row in bookmark
+        ]
+        with self.__transaction():
+            self.__ensure_folder(table)
+            self.conn.executemany(
+                "INSERT INTO bookmarks (folder, title, url, normalized_url)"
+                " VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def set_titles(self, tablename: str, titles: Dict[str, str]) -> int:
+        with self.__transaction():
+            cursor = self.conn.executemany(
+                "UPDATE bookmarks SET title = ? WHERE folder = ? AND url = ?"
+                " AND (title IS NULL OR title = '' OR title = url)",
+                [(title, tablename, url) for url, title in titles.items()],
+            )
+        return cursor.rowcount
+
+    @traced()
+    def is_folder(self, table: str) -> bool:
+        cursor = self.conn.execute("SELECT 1 FROM folders WHERE name = ?", (table,))
+        return cursor.fetchone() is not None
+
+    @traced()
+    def get_bookmark(self, tablename: str, title: str) -> Tuple[str, str]:
+        cursor = self.conn.execute(
+            "SELECT url FROM bookmarks WHERE folder = ? AND title = ?"
+            " ORDER BY id LIMIT 1",
+            (tablename, title),
+        )
+        return title, cursor.fetchone()[0]
+
+    @traced()
+    def bookmark_exists_in_table(self, tablename, url):
+        cursor = self.conn.execute(
+            "SELECT 1 FROM bookmarks WHERE folder = ? AND normalized_url = ? LIMIT 1",
+            (tablename, normalize_url(url)),
+        )
+        return cursor.fetchone() is not None
+
+    def list_raw_bookmarks(self, tablename: str) -> List:
+        cursor = self.conn.execute(
+            "SELECT url, title FROM bookmarks WHERE folder = ? ORDER BY id",
+            (tablename,),
+        )
+        for url, title in cursor:
+            if not title:
+                title = url
+            yield (url, title)
+
+    def list_raw_folders(self):
+        cursor = self.conn.execute("SELECT name FROM folders ORDER BY id")
+        return [name for (name,) in cursor]
+
+    def iter_folder_rows(self):
+        for folder in self.list_raw_folders():
+            yield folder, self.list_raw_bookmarks(folder)
+
+    def read_tables(self) -> Dict:
+        """folder -> {row id: row} of every folder, the shape json storage reads"""
+        tables = {name: {} for name in self.list_raw_folders()}
+        cursor = self.conn.execute(
+            "SELECT folder, id, url, title FROM bookmarks ORDER BY id"
+        )
+        for folder, rowid, url, title in cursor:
+            tables.setdefault(folder, {})[str(rowid)] = {"url": url, "title": title}
+        return tables
+
+    def get_table_handle(self, tablename: str):
+        return SQLiteTable(self, tablename)
+
+
+class SQLiteTable:
+    """the part of the tinydb table interface mark uses, bound to one folder"""
+
+    def __init__(self, db: SQLiteDataBase, name: str):
+        self.db = db
+        self.name = name
+
+    def all(self) -> List[Dict]:
+        return [
+            {"url": url, "title": title}
+            for url, title in self.db.list_raw_bookmarks(self.name)
+        ]
+
+    def insert(self, document: Dict):
+        self.db.insert_multiple(self.name, [document])
+
+    def insert_multiple(self, documents: List[Dict]):
+        self.db.insert_multiple(self.name, list(documents))
+
+    def __len__(self) -> int:
+        cursor = self.db.conn.execute(
+            "SELECT COUNT(*) FROM bookmarks WHERE folder = ?", (self.name,)
+        )
+        return cursor.fetchone()[0]
+
+
+def is_sqlite_file(filename: str) -> bool:
+    """
+    Existing files are told apart by the sqlite header, so a json database
+    named `*.db` stays json. Files yet to be created go by their extension
+    """
+    try:
+        with open(filename, "rb") as file:
+            header = file.read(len(SQLITE_HEADER))
+    except OSError:
+        header = b""
+    if header:
+        return header == SQLITE_HEADER
+    return Path(filename).suffix.lower() in SQLITE_SUFFIXES
+
+
+def migrate_database(source: str, destination: str) -> int:
+    """
+    Copy every folder of a json/yaml database into a sqlite database,
+    returns the number of migrated bookmarks
+    """
+    storage = "yaml" if Path(source).suffix.lower() in (".yaml", ".yml") else "json"
+    src = DataBase(source, storage=storage)
+    dst = SQLiteDataBase(destination)
+    count = 0
+    with dst.bulk():
+        # in file order, tinydb lists table names as a set
+        for folder, table in src.read_tables().items():
+            rows = list(table.values())
+            dst.insert_multiple(folder, rows)
+            count += len(rows)
+    return count
@@ -1,19 +1,103 @@
-import io
 import os
+import tempfile
 import warnings
 
 import orjson
-import yaml
+from tinydb.middlewares import Middleware
 from tinydb.storages import Storage, touch
 
+from mark.profiling import traced
+
+try:
+    import fcntl
+except ImportError:  # windows, locks are not available
+    fcntl = None
+
+LOCK_SUFFIX = ".lock"
+
+
+class ConflictError(Exception):
+    """The database was written by another process since it was read"""
+
+
+class ReadOnlyError(Exception):
+    """The database was opened read-only, e.g. through its snapshot"""
+
+
+def file_signature(path: str):
+    """changes whenever the file is written or replaced, None if missing"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def atomic_write(path: str, content: bytes):
+    """
+    Write `content` to a temporary file next to `path` and rename it over
+    `path`, readers see either the old or the new file, never a partial one
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(content)
+            handle.flush()
+            os.fsync(handle.fileno())
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class FileLock:
+    """
+    Advisory exclusive lock on `<path>.lock`, held by writers only while they
+    check for conflicts and write. Readers never take it.
+
+    The empty lock file is left behind on purpose: a writer unlinking it on
+    release would let a waiter lock the removed inode while a newcomer locks
+    a fresh file, and both would write at once
+    """
+
+    def __init__(self, path: str):
+        self.path = path + LOCK_SUFFIX
+        self._handle = None
+
+    def __enter__(self):
+        self._handle = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+        self._handle.close()
+        self._handle = None
+
 
 class YAMLStorage(Storage):
     """Custom YAML storage layout for tinydb"""
 
-    def __init__(self, filename):
+    def __init__(self, filename, **kwargs):
         self.filename = filename
+        self.path = filename
 
+    @traced()
     def read(self):
+        import yaml
+
+        if not os.path.exists(self.filename):
+            return None
         with open(self.filename, "r") as handle:
             try:
                 data = yaml.safe_load(handle.read())
@@ -21,9 +105,14 @@ class YAMLStorage(Storage):
             except yaml.YAMLError:
                 return None
 
+    @traced()
     def write(self, data):
-        with open(self.filename, "w+") as handle:
-            yaml.dump(dict(data), handle)
+        import yaml
+
+        atomic_write(self.filename, yaml.dump(dict(data)).encode("utf-8"))
+
+    def signature(self):
+        return file_signature(self.path)
 
     def close(self):
         pass
@@ -33,6 +122,10 @@ class FasterJSONStorage(Storage):
     """
     Faster JSON storage based on orjson parser.
 
+    The file is opened anew on every read and replaced by an atomic rename on
+    every write, so a reader always gets one complete version of the file even
+    while another process writes it.
+
     NOTE: The code of this class is the modified version of the
     JSONStorage provided by tinydb as orjson is not a drop replacement for builtin
     json module.
@@ -43,6 +136,7 @@ class FasterJSONStorage(Storage):
     ):
 
         super().__init__()
+        self.path = path
         self._mode = access_mode
         self.kwargs = kwargs
         if access_mode not in ("r", "rb", "r+", "rb+"):
@@ -58,48 +152,341 @@ class FasterJSONStorage(Storage):
         ):  # any of the writing modes
             touch(path, create_dirs=create_dirs)
 
-        # Open the file for reading/writing
-        self._handle = open(path, mode=self._mode, encoding=encoding)
-
     def close(self) -> None:
-        self._handle.close()
+        pass
 
-    def read(self):
-        # Get the file size by moving the cursor to the file end and reading
-        # its location
-        self._handle.seek(0, os.SEEK_END)
-        size = self._handle.tell()
+    def signature(self):
+        return file_signature(self.path)
 
-        if not size:
+    @traced()
+    def read(self):
+        try:
+            with open(self.path, "rb") as handle:
+                content = handle.read()
+        except FileNotFoundError:
+            return None
+        if not content:
             # File is empty, so we return ``None`` so TinyDB can properly
             # initialize the database
             return None
-        else:
-            # Return the cursor to the beginning of the file
-            self._handle.seek(0)
+        # Load the JSON contents of the file
+        return orjson.loads(content)
+
+    @traced()
+    def write(self, data):
+        if not any(character in self._mode for character in ("+", "w", "a")):
+            raise IOError(
+                'Cannot write to the database. Access mode is "{0}"'.format(self._mode)
+            )
+        # Serialize the database state using the user-provided arguments
+        atomic_write(self.path, orjson.dumps(data, **self.kwargs))
+
+
+class TransactionMiddleware(Middleware):
+    """
+    Buffer writes in memory between `begin` and `commit`, so a batch of table
+    mutations costs a single read and a single write of the underlying storage.
+    Outside of a transaction reads and writes are passed through.
+
+    Writes are optimistic: the signature of the storage is kept when its data
+    is read, and the write happens under the file lock only if the signature
+    is unchanged, otherwise `ConflictError` is raised and nothing is written.
+    An exclusive transaction holds the lock from `begin` to `commit` instead,
+    so it cannot conflict.
+    """
+
+    def __init__(self, storage_cls):
+        super().__init__(storage_cls)
+        self._depth = 0
+        self._loaded = False
+        self._dirty = False
+        self._data = None
+        # signature of the storage the current data was read from
+        self.base = None
+        self._lock = None
+
+    @property
+    def active(self) -> bool:
+        return self._depth > 0
+
+    def begin(self, exclusive: bool = False):
+        if exclusive and not self._depth:
+            self._lock = FileLock(self.storage.path).__enter__()
+        self._depth += 1
+
+    def commit(self):
+        self._depth -= 1
+        if self._depth:
+            return
+        try:
+            if self._dirty:
+                self.__write(self._data)
+        except BaseException:
+            self.__invalidate()
+            raise
+        finally:
+            self.__reset()
+
+    def rollback(self):
+        self._depth = 0
+        self.__reset()
+        self.__invalidate()
+
+    def __reset(self):
+        self._loaded = False
+        self._dirty = False
+        self._data = None
+        if self._lock is not None:
+            self._lock.__exit__(None, None, None)
+            self._lock = None
+
+    def __invalidate(self):
+        # cached data may hold the changes tinydb made in place
+        invalidate = getattr(self.storage, "invalidate", None)
+        if invalidate is not None:
+            invalidate()
 
-            # Load the JSON contents of the file
-            return orjson.loads(self._handle.read())
+    def __read(self):
+        # a write landing between the two calls only causes a spurious conflict
+        self.base = self.storage.signature()
+        return self.storage.read()
+
+    def __write(self, data):
+        if self._lock is not None:
+            self.__write_locked(data)
+            return
+        with FileLock(self.storage.path):
+            self.__write_locked(data)
+
+    def __write_locked(self, data):
+        if self.storage.signature() != self.base:
+            self.__invalidate()
+            raise ConflictError(f"{self.storage.path} changed since it was read")
+        self.storage.write(data)
+        self.base = self.storage.signature()
+
+    def read(self):
+        if not self._depth:
+            return self.__read()
+        if not self._loaded:
+            self._data = self.__read()
+            self._loaded = True
+        return self._data
 
     def write(self, data):
-        # Move the cursor to the beginning of the file just in case
-        self._handle.seek(0)
+        if not self._depth:
+            self.__write(data)
+            return
+        self._data = data
+        self._loaded = True
+        self._dirty = True
+
+    def close(self):
+        self.storage.close()
 
-        # Serialize the database state using the user-provided arguments
-        serialized = orjson.dumps(data, **self.kwargs)
 
-        # Write the serialized data to the file
+class ReadCacheMiddleware(Middleware):
+    """
+    Keep the parsed database in memory and serve reads from it while the file
+    is unchanged on disk. The cache is keyed by the inode, size and mtime of
+    the file, so writes made by other processes are picked up on the next read.
+    """
+
+    def __init__(self, storage_cls):
+        super().__init__(storage_cls)
+        self.hits = 0
+        self.misses = 0
+        self._data = None
+        self._signature = None
+
+    def read(self):
+        signature = self.storage.signature()
+        if signature is not None and signature == self._signature:
+            self.hits += 1
+            return self._data
+        self.misses += 1
+        self._data = self.storage.read()
+        self._signature = signature
+        return self._data
+
+    def write(self, data):
         try:
-            self._handle.write(serialized)
-        except io.UnsupportedOperation:
-            raise IOError(
-                'Cannot write to the database. Access mode is "{0}"'.format(self._mode)
-            )
+            self.storage.write(data)
+        except BaseException:
+            # tinydb mutates the data it read in place before writing it
+            self._signature = None
+            raise
+        self._data = data
+        self._signature = self.storage.signature()
+
+    def invalidate(self):
+        self._signature = None
+
+    def close(self):
+        self.storage.close()
+
+
+class _LazyTables(dict):
+    """
+    Top level tables dict handed out to tinydb by `LogStorage.read`.
+
+    Table dicts are only copied when tinydb actually asks for them, so reading
+    the table names or touching a single folder does not copy the whole
+    database, while the state held by the storage is never mutated in place.
+    """
+
+    def __getitem__(self, name):
+        table = super().__getitem__(name)
+        if not isinstance(table, _TableCopy):
+            table = _TableCopy((key, dict(doc)) for key, doc in table.items())
+            super().__setitem__(name, table)
+        return table
+
 
-        # Ensure the file has been written
-        self._handle.flush()
-        os.fsync(self._handle.fileno())
+class _TableCopy(dict):
+    """Marker type for tables already copied by `_LazyTables`"""
+
+
+class LogStorage(Storage):
+    """
+    Append-only storage: a JSON snapshot plus a write-ahead log of changes.
+
+    Every write only appends the insert/update/delete records that differ from
+    the last known state to `<path>.wal` and fsyncs it, instead of rewriting the
+    whole database. Once the log holds `compact_every` records it is folded
+    into the snapshot (same layout as `FasterJSONStorage`) and truncated.
+
+    Replaying a record twice yields the same state, so a crash between writing
+    the snapshot and truncating the log is harmless. The records of a write
+    share one log line, so readers see either all or none of them, and only
+    writers holding the file lock append to the log or truncate a torn tail.
+    """
+
+    LOG_SUFFIX = ".wal"
+
+    def __init__(
+        self, path: str, create_dirs=False, compact_every: int = 10_000, **kwargs
+    ):
+        super().__init__()
+        self.path = path
+        self.log_path = path + self.LOG_SUFFIX
+        self.compact_every = compact_every
+        self.kwargs = kwargs
+        touch(path, create_dirs=create_dirs)
+        touch(self.log_path, create_dirs=create_dirs)
+        self._log = open(self.log_path, mode="rb+")
+        self._load()
+
+    def close(self) -> None:
+        self._log.close()
+
+    def _load(self):
+        with open(self.path, "rb") as handle:
+            content = handle.read()
+            self._snapshot_id = os.fstat(handle.fileno()).st_ino
+        self._tables = orjson.loads(content) if content else {}
+        self._offset = 0
+        self._records = 0
+        self._replay()
+
+    def _replay(self):
+        self._log.seek(self._offset)
+        content = self._log.read()
+        # only consume complete lines, the tail may be written concurrently
+        end = content.rfind(b"\n") + 1
+        for line in content[:end].splitlines():
+            records = orjson.loads(line)
+            for record in records:
+                self._apply(record)
+            self._records += len(records)
+        self._offset += end
+
+    def _apply(self, record):
+        op, name = record["op"], record["table"]
+        if op == "drop":
+            self._tables.pop(name, None)
+            return
+        table = self._tables.setdefault(name, {})
+        if op in ("insert", "update"):
+            table[record["id"]] = record["doc"]
+        elif op == "delete":
+            table.pop(record["id"], None)
+
+    def _is_stale(self):
+        # the snapshot is replaced on compaction, pick up other processes' work
+        try:
+            snapshot_id = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return True
+        return snapshot_id != self._snapshot_id
+
+    def signature(self):
+        return file_signature(self.path), file_signature(self.log_path)
+
+    @traced()
+    def read(self):
+        log_size = os.fstat(self._log.fileno()).st_size
+        if self._is_stale() or log_size < self._offset:
+            self._load()
+        elif log_size > self._offset:
+            self._replay()
+        if not self._tables:
+            return None
+        return _LazyTables(self._tables)
+
+    def _diff(self, data):
+        records = []
+        for name in self._tables:
+            if name not in data:
+                records.append({"op": "drop", "table": name})
+        for name, table in dict.items(data):
+            old = self._tables.get(name)
+            if table is old:
+                continue
+            if old is None:
+                old = {}
+                records.append({"op": "create", "table": name})
+            for key, doc in table.items():
+                if key not in old:
+                    records.append(
+                        {"op": "insert", "table": name, "id": key, "doc": doc}
+                    )
+                elif old[key] != doc:
+                    records.append(
+                        {"op": "update", "table": name, "id": key, "doc": doc}
+                    )
+            for key in old:
+                if key not in table:
+                    records.append({"op": "delete", "table": name, "id": key})
+        return records
+
+    @traced()
+    def write(self, data):
+        records = self._diff(data)
+        for record in records:
+            self._apply(record)
+        if not records:
+            return
+        payload = orjson.dumps(records) + b"\n"
+        # drops a torn line left behind by a crash in the middle of an append,
+        # readers leave it alone as the tail may still be being written
+        self._log.seek(self._offset)
+        self._log.truncate()
+        self._log.write(payload)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._offset += len(payload)
+        self._records += len(records)
+        if self._records >= self.compact_every:
+            self.compact()
 
-        # Remove data that is behind the new cursor in case the file has
-        # gotten shorter
-        self._handle.truncate()
+    def compact(self):
+        """Fold the log into a fresh snapshot and truncate it"""
+        atomic_write(self.path, orjson.dumps(self._tables, **self.kwargs))
+        self._snapshot_id = os.stat(self.path).st_ino
+        self._log.seek(0)
+        self._log.truncate()
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._offset = 0
+        self._records = 0
@@ -0,0 +1,118 @@
+"""
+Text files for import and export that may be compressed or standard streams.
+
+`-` is stdin or stdout, and paths ending with a compression suffix are read
+and written through the matching streaming codec, so backups never need an
+uncompressed copy on disk. Input is also recognized by the magic number of
+its codec, so a renamed file or a compressed pipe is read all the same.
+zstandard is optional and only imported for `.zst` files.
+"""
+import io
+import sys
+from contextlib import contextmanager
+from typing import Iterator, Optional, TextIO
+
+STDIO = "-"
+COMPRESSION_SUFFIXES = (".gz", ".bz2", ".xz", ".zst")
+MAGIC_NUMBERS = (
+    (b"\x1f\x8b", ".gz"),
+    (b"BZh", ".bz2"),
+    (b"\xfd7zXZ\x00", ".xz"),
+    (b"\x28\xb5\x2f\xfd", ".zst"),
+)
+MAGIC_SIZE = max(len(magic) for magic, _ in MAGIC_NUMBERS)
+
+
+def compression_suffix(path: str) -> Optional[str]:
+    for suffix in COMPRESSION_SUFFIXES:
+        if path.lower().endswith(suffix):
+            return suffix
+    return None
+
+
+def strip_compression_suffix(path: str) -> str:
+    suffix = compression_suffix(path)
+    return path[: -len(suffix)] if suffix else path
+
+
+def sniff_compression(head: bytes) -> Optional[str]:
+    """suffix of the codec whose magic number starts `head`"""
+    for magic, suffix in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return suffix
+    return None
+
+
+def _open_compressed(path, suffix: str, mode: str):
+    if suffix == ".gz":
+        import gzip
+
+        return gzip.open(path, mode, encoding="utf-8")
+    if suffix == ".bz2":
+        import bz2
+
+        return bz2.open(path, mode, encoding="utf-8")
+    if suffix == ".xz":
+        import lzma
+
+        return lzma.open(path, mode, encoding="utf-8")
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(
+            "zstandard is needed for .zst files, install it with"
+            " `pip install zstandard`"
+        )
+    return zstandard.open(path, mode, encoding="utf-8")
+
+
+@contextmanager
+def open_text(path: str, mode: str = "r") -> Iterator[TextIO]:
+    """
+    open `path` as utf-8 text for reading ("r") or writing ("w", "a"),
+    standard streams are left open on exit
+    """
+    assert mode in ("r", "w", "a")
+    if path == STDIO:
+        with _open_stdio(mode) as file:
+            yield file
+        return
+    if mode != "r":
+        suffix = compression_suffix(path)
+        if suffix is None:
+            file = open(path, mode, encoding="utf-8", buffering=1 << 20)
+        else:
+            file = _open_compressed(path, suffix, mode + "t")
+        with file:
+            yield file
+        return
+    with open(path, "rb", buffering=1 << 20) as raw:
+        suffix = sniff_compression(raw.peek(MAGIC_SIZE)) or compression_suffix(path)
+        if suffix is None:
+            file = io.TextIOWrapper(raw, encoding="utf-8")
+        else:
+            file = _open_compressed(raw, suffix, "rt")
+        with file:
+            yield file
+
+
+@contextmanager
+def _open_stdio(mode: str) -> Iterator[TextIO]:
+    if mode != "r":
+        buffer, suffix = sys.stdout.buffer, None
+    else:
+        buffer = sys.stdin.buffer
+        if not hasattr(buffer, "peek"):
+            buffer = io.BufferedReader(buffer)
+        suffix = sniff_compression(buffer.peek(MAGIC_SIZE))
+    if suffix is not None:
+        # left open, zstandard would close stdin along with it
+        yield _open_compressed(buffer, suffix, "rt")
+        return
+    wrapper = io.TextIOWrapper(buffer, encoding="utf-8")
+    try:
+        yield wrapper
+    finally:
+        if mode != "r":
+            wrapper.flush()
+        wrapper.detach()
@@ -0,0 +1,300 @@
+"""
+Concurrent title inference for bookmarks without a title of their own.
+
+Every request goes through one aiohttp session, so connections are pooled and
+the connector bounds both the open connections and the connections per host.
+A token bucket spreads the requests over time and each response is only read
+until `TitleExtractor` found the title.
+"""
+import asyncio
+import codecs
+import re
+import time
+from collections import defaultdict
+from html.parser import HTMLParser
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+from mark.urlcache import PageInfo, URLCache
+
+CHUNK_SIZE = 1 << 13
+# give up on pages whose title is not in the first bytes
+MAX_HEAD_SIZE = 1 << 18
+# browsers look for a meta charset in the first 1024 bytes
+SNIFF_SIZE = 1024
+META_CHARSET_RE = re.compile(
+    rb"""<meta[^>]+charset\s*=\s*["']?\s*([\w.:-]+)""", re.IGNORECASE
+)
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+FALLBACK_META = {"og:title", "twitter:title"}
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; mark)",
+    "Accept": "text/html,application/xhtml+xml",
+}
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all the requests, allows `rate` requests per second
+    with bursts of up to `burst` requests
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        assert rate > 0
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def needs_title(url: str, title: str) -> bool:
+    """bookmarks without a title are listed with their url as title"""
+    return bool(url) and (not title or title == url)
+
+
+def is_web_url(url: str) -> bool:
+    """only http pages are fetched, other schemes have no title to infer"""
+    return urlparse(url).scheme in ("http", "https")
+
+
+def known_encoding(encoding: Optional[str]) -> Optional[str]:
+    if not encoding:
+        return None
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return None
+
+
+class TitleExtractor(HTMLParser):
+    """
+    Incremental page title parser fed with the response chunks, `feed_bytes`
+    returns True once the rest of the page is not needed: after `</title>`,
+    or at the end of `<head>` when the title is empty and `og:title` may
+    still come. The charset is the one of the headers, else the meta tag
+    found in the first bytes, else utf-8
+    """
+
+    def __init__(self, encoding: str = None):
+        super().__init__(convert_charrefs=True)
+        self.encoding = known_encoding(encoding)
+        self.decoder = None
+        self.pending = b""
+        self.done = False
+        self.in_title = False
+        self.title_parts = []
+        self.fallback = None
+
+    def __start_decoding(self, head: bytes):
+        encoding = self.encoding
+        for bom, name in BOMS:
+            if head.startswith(bom):
+                encoding = name
+                break
+        if encoding is None:
+            match = META_CHARSET_RE.search(head[:SNIFF_SIZE])
+            if match is not None:
+                encoding = known_encoding(match.group(1).decode("ascii"))
+        self.encoding = encoding or "utf-8"
+        self.decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+
+    def feed_bytes(self, chunk: bytes) -> bool:
+        if self.done:
+            return True
+        if self.decoder is None:
+            self.pending += chunk
+            # wait for enough bytes to look for the meta charset
+            if self.encoding is None and len(self.pending) < SNIFF_SIZE:
+                return False
+            chunk, self.pending = self.pending, b""
+            self.__start_decoding(chunk)
+        self.feed(self.decoder.decode(chunk))
+        return self.done
+
+    def result(self) -> Optional[str]:
+        """title found so far, `og:title` when the page has no title"""
+        if not self.done:
+            if self.decoder is None:
+                self.__start_decoding(self.pending)
+                self.feed(self.decoder.decode(self.pending))
+            self.feed(self.decoder.decode(b"", final=True))
+            self.close()
+        # titles span lines on many pages
+        title = " ".join("".join(self.title_parts).split())
+        return title or self.fallback
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == "title":
+            self.in_title = True
+        elif tag == "meta" and self.fallback is None:
+            attrs = dict(attrs)
+            key = attrs.get("property") or attrs.get("name")
+            if key in FALLBACK_META and attrs.get("content"):
+                self.fallback = " ".join(attrs["content"].split())
+        elif tag == "body":
+            # the head ended without its closing tag
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self.in_title:
+            self.in_title = False
+            if "".join(self.title_parts).strip():
+                self.done = True
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data):
+        if self.in_title and not self.done:
+            self.title_parts.append(data)
+
+
+def extract_title(chunks: Iterable[bytes], encoding: str = None) -> Optional[str]:
+    """title of the page read from `chunks`, stops reading once it is found"""
+    extractor = TitleExtractor(encoding)
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if extractor.feed_bytes(chunk) or size >= MAX_HEAD_SIZE:
+            break
+    return extractor.result()
+
+
+def fetch_page_sync(url: str, timeout: float = 2.0) -> PageInfo:
+    """blocking `fetch_page` for single lookups"""
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+    if not is_web_url(url):
+        return PageInfo(None, None, 0, time.time())
+    try:
+        with urlopen(Request(url, headers=HEADERS), timeout=timeout) as response:
+            # only the head of the page is downloaded
+            chunks = iter(lambda: response.read1(CHUNK_SIZE), b"")
+            title = extract_title(chunks, response.headers.get_content_charset())
+            return PageInfo(title, response.geturl(), response.status, time.time())
+    except HTTPError as err:
+        return PageInfo(None, err.geturl(), err.code, time.time())
+    except Exception:
+        return PageInfo(None, None, 0, time.time())
+
+
+async def fetch_page(
+    session, url: str, limiter: RateLimiter = None, timeout: float = 5.0
+) -> PageInfo:
+    """
+    title, final url and status of the page at `url`, the title is None when
+    the page cannot be fetched or has none and the status 0 when the request
+    failed or the url is not http
+    """
+    import aiohttp
+
+    if not is_web_url(url):
+        return PageInfo(None, None, 0, time.time())
+    if limiter is not None:
+        await limiter.acquire()
+    size = 0
+    try:
+        client_timeout = aiohttp.ClientTimeout(total=timeout)
+        async with session.get(url, timeout=client_timeout) as response:
+            final_url, status = str(response.url), response.status
+            if status >= 400:
+                return PageInfo(None, final_url, status, time.time())
+            extractor = TitleExtractor(response.charset)
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                size += len(chunk)
+                if extractor.feed_bytes(chunk) or size >= MAX_HEAD_SIZE:
+                    # leaving the block drops the rest of the body
+                    break
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return PageInfo(None, None, 0, time.time())
+    return PageInfo(extractor.result(), final_url, status, time.time())
+
+
+async def infer_titles(
+    urls: Iterable[str],
+    concurrency: int = 32,
+    per_host: int = 4,
+    rate: float = 20.0,
+    timeout: float = 5.0,
+    cache: URLCache = None,
+) -> Dict[str, Optional[str]]:
+    """
+    url -> title of every url, fetched by `concurrency` workers sharing one
+    session. `rate` is the number of requests per second, 0 disables it.
+    Urls fresh in `cache` are not fetched and the fetched ones are added to it
+    """
+    urls = list(dict.fromkeys(urls))
+    cached = cache.get_many(urls) if cache is not None else {}
+    titles = {url: info.title for url, info in cached.items()}
+    fetched = {}
+    # every worker pulls the next url from the same iterator
+    pending = iter([url for url in urls if url not in cached])
+
+    async def worker(session):
+        for url in pending:
+            fetched[url] = await fetch_page(session, url, limiter, timeout)
+            titles[url] = fetched[url].title
+
+    if len(cached) < len(urls):
+        import aiohttp
+
+        # evenly spaced, a burst the size of the pool would hit --rate at once
+        limiter = RateLimiter(rate) if rate else None
+        connector = aiohttp.TCPConnector(
+            limit=concurrency, limit_per_host=per_host, ttl_dns_cache=300
+        )
+        async with aiohttp.ClientSession(
+            connector=connector, headers=HEADERS
+        ) as session:
+            await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    if cache is not None and fetched:
+        cache.put_many(fetched)
+    return titles
+
+
+def backfill_titles(db, **options) -> Tuple[int, int]:
+    """
+    fetch the titles of every bookmark of `db` that has none and save them in
+    one write, `options` are passed to `infer_titles`. Returns the number of
+    bookmarks titled and the number of bookmarks that needed a title
+    """
+    untitled = defaultdict(set)
+    for folder in db.list_raw_folders():
+        for url, title in db.list_raw_bookmarks(folder):
+            if needs_title(url, title):
+                untitled[folder].add(url)
+    total = sum(len(urls) for urls in untitled.values())
+    if not total:
+        return 0, 0
+    urls = set().union(*untitled.values())
+    titles = asyncio.run(infer_titles(urls, **options))
+
+    def save():
+        count = 0
+        for folder, urls in untitled.items():
+            found = {url: titles[url] for url in urls if titles.get(url)}
+            if found:
+                count += db.set_titles(folder, found)
+        return count
+
+    return db.write(save), total
@@ -0,0 +1,145 @@
+"""
+On-disk cache of fetched page metadata, shared by every database and by the
+interactive and bulk title inference.
+
+Entries are keyed by the canonical form of the url, without fragment, and keep
+the title, the url after redirects, the http status (0 when the request failed)
+and the fetch time. Failed fetches are cached too, for a shorter time, and the
+least recently used entries are evicted past `max_entries`.
+"""
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, NamedTuple, Optional
+from urllib.parse import urldefrag
+
+from mark.utils import normalize_url
+
+TTL = 30 * 24 * 3600
+NEGATIVE_TTL = 24 * 3600
+MAX_ENTRIES = 100_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    title TEXT,
+    final_url TEXT,
+    status INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_used_at ON pages (used_at);
+"""
+
+
+class PageInfo(NamedTuple):
+    title: Optional[str]
+    final_url: Optional[str]
+    status: int
+    fetched_at: float
+
+    @property
+    def failed(self) -> bool:
+        return self.title is None
+
+
+def cache_key(url: str) -> str:
+    return normalize_url(urldefrag(url.strip())[0])
+
+
+def default_cache_path() -> str:
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_dir, "mark", "urls.sqlite")
+
+
+class URLCache:
+    def __init__(
+        self,
+        path: str = None,
+        ttl: float = TTL,
+        negative_ttl: float = NEGATIVE_TTL,
+        max_entries: int = MAX_ENTRIES,
+    ):
+        self.path = path or default_cache_path()
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # several mark processes may share the cache
+        self.conn = sqlite3.connect(self.path, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def __fresh(self, info: PageInfo, now: float) -> bool:
+        ttl = self.negative_ttl if info.failed else self.ttl
+        return now - info.fetched_at < ttl
+
+    def get_many(self, urls: Iterable[str]) -> Dict[str, PageInfo]:
+        """url -> cached info of the urls with a fresh entry"""
+        now = time.time()
+        keys = {}
+        for url in urls:
+            keys.setdefault(cache_key(url), []).append(url)
+        found = {}
+        key_list = list(keys)
+        # stay below sqlite's limit of bound parameters
+        for start in range(0, len(key_list), 500):
+            batch = key_list[start:start + 500]
+            cursor = self.conn.execute(
+                "SELECT key, title, final_url, status, fetched_at FROM pages"
+                " WHERE key IN (%s)" % ",".join("?" * len(batch)),
+                batch,
+            )
+            for key, *row in cursor:
+                info = PageInfo(*row)
+                if self.__fresh(info, now):
+                    found.update((url, info) for url in keys[key])
+        if found:
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE pages SET used_at = ? WHERE key = ?",
+                    [(now, cache_key(url)) for url in found],
+                )
+        return found
+
+    def get(self, url: str) -> Optional[PageInfo]:
+        return self.get_many([url]).get(url)
+
+    def put_many(self, infos: Dict[str, PageInfo]):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO pages"
+                " (key, title, final_url, status, fetched_at, used_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(cache_key(url), *info, now) for url, info in infos.items()],
+            )
+        self.evict()
+
+    def put(self, url: str, title: str, final_url: str, status: int) -> PageInfo:
+        info = PageInfo(title, final_url, status, time.time())
+        self.put_many({url: info})
+        return info
+
+    def evict(self):
+        """drop the least recently used entries past `max_entries`"""
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()
+        if count <= self.max_entries:
+            return
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM pages WHERE key IN"
+                " (SELECT key FROM pages ORDER BY used_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def open_url_cache(**kwargs) -> Optional[URLCache]:
+    """the default cache, None when it cannot be opened (read-only home, ...)"""
+    try:
+        return URLCache(**kwargs)
+    except (OSError, sqlite3.Error):
+        return None
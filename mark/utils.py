@@ -1,13 +1,8 @@
 import datetime
 import os
-import sys
 import platform
 import subprocess
-from urllib.parse import parse_qsl, unquote_plus, urlparse
-from urllib.request import urlopen
-
-import pyperclip
-from bs4 import BeautifulSoup
+from urllib.parse import parse_qsl, unquote_plus, urlencode, urlparse
 
 
 def copy_selection(title: str, url: str):
@@ -41,7 +36,7 @@ def open_selection(title: str, url: str):
         )
     except OSError:
         raise RuntimeError("Cannot open default browser")
-    sys.exit(0)
+
 
 async def fetch_html(session, url):
     async with session.get(url, timeout=2) as response:
@@ -49,28 +44,29 @@ async def fetch_html(session, url):
 
 
 async def parse_page_title(html):
-    soup = BeautifulSoup(html, "html.parser")
-    return soup.title.string
+    from mark.titles import extract_title
+
+    return extract_title([html.encode("utf-8")], "utf-8")
 
 
 async def async_infer_url_title(url):
-    import aiohttp
+    from mark.titles import infer_titles
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            html = await fetch_html(session, url)
-            title = await parse_page_title(html)
-            return title
-        except TimeoutError:
-            return None
+    titles = await infer_titles([url], concurrency=1, rate=0)
+    return titles[url]
 
 
 def sync_infer_url_title(url):
-    try:
-        soup = BeautifulSoup(urlopen(url, timeout=2), "lxml")
-        return soup.title.string
-    except Exception:
-        return None
+    from mark.titles import fetch_page_sync
+    from mark.urlcache import open_url_cache
+
+    cache = open_url_cache()
+    info = cache.get(url) if cache is not None else None
+    if info is None:
+        info = fetch_page_sync(url)
+        if cache is not None:
+            cache.put_many({url: info})
+    return info.title
 
 
 def clean_bookmark_title(title):
@@ -94,6 +90,8 @@ def decode_message(msg):
 
 
 def get_url_and_title(infer_title):
+    import pyperclip
+
     url, title = pyperclip.paste(), None
     if not infer_title:
         return url, title
@@ -104,15 +102,24 @@ def get_url_and_title(infer_title):
     return url, title
 
 
+def normalize_url(url):
+    """
+    Canonical form of a url, two urls are considered equal if their canonical
+    forms are equal (query parameters order, path quoting, the case of the
+    scheme and host and the slash of an empty path are ignored)
+    """
+    parts = urlparse(url)
+    query = urlencode(sorted(set(parse_qsl(parts.query))))
+    userinfo, at, host = parts.netloc.rpartition("@")
+    netloc = userinfo + at + host.lower()
+    path = unquote_plus(parts.path) or ("/" if netloc else "")
+    return "\x1f".join(
+        [parts.scheme, netloc, path, parts.params, query, parts.fragment]
+    )
+
+
 def are_urls_equal(url1, url2):
-    def get_url_parts(url):
-        parts = urlparse(url)
-        query = frozenset(parse_qsl(parts.query))
-        path = unquote_plus(parts.path)
-        parts = parts._replace(query=query, path=path)
-        return parts
-
-    return get_url_parts(url1) == get_url_parts(url2)
+    return normalize_url(url1) == normalize_url(url2)
 
 
 def get_proper_write_mode(filepath):
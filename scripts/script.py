@@ -9,8 +9,12 @@
 import json
 import os
 import sys
+import time
 
-from script_util import client, concat
+# sent along the requests, mark --profile times the script round trip with it
+started = time.time_ns()
+
+from script_util import client, concat, recv_frame, send_frame  # noqa: E402
 
 data = ""
 # set initial options as they cannot be passed to rofi in script mode
@@ -21,18 +25,26 @@ for option in ["prompt", "message"]:
         data = concat(data, line)
         del os.environ[env_var]
 
-# initially list the items from ROFI_INIT env variable
+# initially list the items from ROFI_INIT env variable, or from the server when
+# the list is too large for the environment (ROFI_INIT_REMOTE)
 # after the first selection, selected item is written to ROFI_DATA env variable
-if os.getenv("ROFI_INIT") is not None and os.getenv("ROFI_DATA") is None:
+remote_init = os.getenv("ROFI_INIT_REMOTE") is not None
+has_init = os.getenv("ROFI_INIT") is not None or remote_init
+if has_init and os.getenv("ROFI_DATA") is None:
+    if remote_init:
+        request = {"code": 0, "value": None, "init": True, "started": started}
+        send_frame(client, json.dumps(request).encode("utf-8"))
+        init = recv_frame(client).decode("utf-8")
+    else:
+        init = os.environ["ROFI_INIT"]
     no_custom = ""
     # don't allow custom inputs in read mode, only choose from listed items
     if os.environ["ROFI_MODE"] == "read":
         no_custom = "\0no-custom\x1ftrue\n"
     markup = "\x00markup-rows\x1ftrue"
     icons = "\x00icon\x1ffolder"
-    line = "\x00data\x1f%s\n" % "\n".join([f"{item}{icons}" for item in os.environ["ROFI_INIT"].split("\n")])
+    line = "\x00data\x1f%s\n" % "\n".join([f"{item}{icons}" for item in init.split("\n")])
     data = concat(data, line, no_custom, markup)
-    del os.environ["ROFI_INIT"]
     # send initial list to rofi
     print(data)
 
@@ -46,11 +58,12 @@ if len(sys.argv) > 1:
             "code": int(os.environ["ROFI_RETV"]),
             # selected item
             "value": sys.argv[1],
+            "started": started,
         }
     )
-    client.send(msg.encode("utf-8"))
-    bufsize = 65_535  # maximum buffer size of 64kB
-    received = client.recv(bufsize).decode("utf-8")
+    send_frame(client, msg.encode("utf-8"))
+    # framed reply, folders of any size arrive whole
+    received = recv_frame(client).decode("utf-8")
     if received == "quit":
         client.close()
     else:
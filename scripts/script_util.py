@@ -1,11 +1,41 @@
 import socket
 import os
+import struct
+
+# 4 bytes big endian payload length, see mark/protocol.py
+HEADER = struct.Struct("!I")
+# reply telling the script the menu is done
+QUIT = b"quit"
 
 
 def concat(*args) -> str:
     return "".join(args)
 
 
+def send_frame(sock, payload: bytes):
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def recv_exactly(sock, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("connection closed in the middle of a message")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_frame(sock) -> bytes:
+    first = sock.recv(1)
+    if not first:
+        # closed without a reply, the server is done with the menu
+        return QUIT
+    (size,) = HEADER.unpack(first + recv_exactly(sock, HEADER.size - 1))
+    return recv_exactly(sock, size)
+
+
 client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 PORT = int(os.environ["ROFI_PORT"])
 client.connect(("localhost", PORT))
@@ -0,0 +1,36 @@
+import multiprocessing
+
+import pytest
+
+from mark.db import open_database
+
+PROCESSES = 4
+INSERTS = 30
+
+
+def insert_many(db_file, worker):
+    db = open_database(db_file)
+    for i in range(INSERTS):
+        # half of the writers share a folder, the others race on the file
+        folder = "shared" if worker % 2 else f"worker {worker}"
+        db.insert_bookmark(folder, f"https://example.com/{worker}/{i}", None)
+
+
+@pytest.mark.parametrize("suffix", [".json", ".yaml", ".sqlite"])
+def test_concurrent_inserts_keep_every_row(tmp_path, suffix):
+    db_file = str(tmp_path / f"bookmarks{suffix}")
+    processes = [
+        multiprocessing.Process(target=insert_many, args=(db_file, worker))
+        for worker in range(PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    urls = [
+        url for _, rows in open_database(db_file).iter_folder_rows() for url, _ in rows
+    ]
+    assert len(urls) == PROCESSES * INSERTS
+    assert len(set(urls)) == PROCESSES * INSERTS
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+import pytest
+
+from mark.daemon import Daemon, connect_daemon
+from mark.db import open_database
+
+
+@pytest.mark.parametrize("suffix", [".json", ".sqlite"])
+def test_daemon_sees_external_writes(tmp_path, suffix):
+    db_file = str(tmp_path / f"bookmarks{suffix}")
+    open_database(db_file).insert_bookmark("dev", "https://a.com", "a")
+    daemon = Daemon(db_file)
+    assert list(daemon.list_bookmarks("dev", "$title", False)) == ["a"]
+    assert list(daemon.list_folders("$title/")) == ["dev/"]
+
+    # another process writing the file
+    writer = open_database(db_file)
+    writer.insert_bookmark("dev", "https://b.com", "b")
+    writer.insert_bookmark("news", "https://c.com", "c")
+    daemon.poll()
+
+    assert list(daemon.list_bookmarks("dev", "$title", False)) == ["a", "b"]
+    assert set(daemon.list_folders("$title/")) == {"dev/", "news/"}
+    assert daemon.call("get_bookmark", ("news", "c")) == ("c", "https://c.com")
+
+
+@pytest.fixture
+def daemon_client(tmp_path, monkeypatch):
+    """client of a daemon served from a background thread"""
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    db_file = str(tmp_path / "bookmarks.json")
+    db = open_database(db_file)
+    db.insert_bookmark("dev", "https://a.com", "a")
+    db.insert_bookmark("news", "https://b.com", "b")
+    daemon = Daemon(db_file)
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(
+        asyncio.start_unix_server(daemon.handle_client, path=daemon.path)
+    )
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    client = connect_daemon(db_file)
+    yield client
+    client.close()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.close()
+
+
+def test_client_calls_round_trip(daemon_client):
+    assert sorted(daemon_client.list_raw_folders()) == ["dev", "news"]
+    assert daemon_client.is_folder("dev")
+    assert daemon_client.get_bookmark("news", "b") == ("b", "https://b.com")
+    assert daemon_client.bookmark_exists_in_table("dev", "https://a.com")
+    assert daemon_client.list_folders() == {"dev": "dev", "news": "news"}
+    assert daemon_client.list_bookmarks("dev") == {"a": ("a",)}
+
+    daemon_client.insert_bookmark("dev", "https://c.com", "c")
+    assert list(daemon_client.list_bookmarks("dev")) == ["a", "c"]
@@ -0,0 +1,71 @@
+import pytest
+
+from mark.db import insert_bookmarks, open_database
+from mark.federated import FederatedDataBase
+
+
+@pytest.fixture
+def db_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    work, home = str(tmp_path / "work.json"), str(tmp_path / "home.sqlite")
+    open_database(work).insert_bookmark("dev", "https://a.com", "a")
+    db = open_database(home)
+    db.insert_bookmark("dev", "https://b.com", "b")
+    db.insert_bookmark("news", "https://c.com", "c")
+    return work, home
+
+
+def test_folders_are_merged(db_files):
+    db = FederatedDataBase(db_files)
+    assert list(db.iter_source_rows("dev")) == [
+        ("work", "https://a.com", "a"),
+        ("home", "https://b.com", "b"),
+    ]
+    assert db.get_bookmark("news", "c") == ("c", "https://c.com")
+    assert db.bookmark_exists_in_table("dev", "https://b.com")
+    assert not db.bookmark_exists_in_table("news", "https://a.com")
+    assert {
+        folder: [row["url"] for row in rows.values()]
+        for folder, rows in db.read_tables().items()
+    } == {"dev": ["https://a.com", "https://b.com"], "news": ["https://c.com"]}
+
+
+def test_writes_go_to_the_owning_file(db_files):
+    work, home = db_files
+    db = FederatedDataBase(db_files)
+    assert not db.bookmark_exists_in_table("news", "https://d.com")
+
+    db.insert_bookmark("news", "https://d.com", "d")
+    db.insert_bookmark("music", "https://e.com", "e")
+    # the merged view is refreshed after our own writes
+    assert db.bookmark_exists_in_table("news", "https://d.com")
+    assert db.get_bookmark("music", "e") == ("e", "https://e.com")
+
+    assert open_database(home).get_bookmark("news", "d") == ("d", "https://d.com")
+    assert open_database(work).get_bookmark("music", "e") == ("e", "https://e.com")
+
+
+def test_import_spans_every_file(db_files):
+    work, home = db_files
+    db = FederatedDataBase(db_files)
+    bookmarks = {
+        "dev": [{"url": "https://b.com", "title": "b"}],
+        "news": [{"url": "https://f.com", "title": "f"}],
+    }
+    assert insert_bookmarks(db, bookmarks, no_duplicates=True) == 1
+    assert [url for url, _ in open_database(home).list_raw_bookmarks("news")] == [
+        "https://c.com",
+        "https://f.com",
+    ]
+    assert len(list(open_database(work).list_raw_bookmarks("dev"))) == 1
+
+
+def test_merged_view_follows_the_files(db_files):
+    work, _ = db_files
+    db = FederatedDataBase(db_files)
+    db.dbs[0] = open_database(work)
+    assert not db.bookmark_exists_in_table("dev", "https://g.com")
+
+    # another process writing one of the files
+    open_database(work).insert_bookmark("dev", "https://g.com", "g")
+    assert db.bookmark_exists_in_table("dev", "https://g.com")
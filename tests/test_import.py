@@ -0,0 +1,170 @@
+import pytest
+from click.testing import CliRunner
+
+from mark.cli import cli
+from mark.db import open_database, save_bookmark_stream_to_db, save_bookmarks_to_db
+from mark.parser import (
+    iter_netscape_bookmark_file,
+    merge_bookmarks,
+    parse_netscape_bookmark_file,
+)
+
+FLAGS = {"clean_title": False, "remove_if_empty": False}
+NO_DATES = (None, None)
+
+
+def bookmark(url, title):
+    return f'<DT><A HREF="{url}" ADD_DATE="1600000000">{title}</A>\n'
+
+
+def folder(name, *bookmarks):
+    header = f'<DT><H3 ADD_DATE="1600000000">{name}</H3>\n<DL><p>\n'
+    return "".join([header, *bookmarks, "</DL><p>\n"])
+
+
+@pytest.fixture
+def html_file(tmp_path):
+    path = tmp_path / "bookmarks.html"
+    dev = [bookmark(f"https://dev.example/{i}", f"dev {i}") for i in range(7)]
+    # duplicates of bookmarks of an earlier batch
+    dev.append(bookmark("https://dev.example/1", "dev again"))
+    dev.append(bookmark("https://dev.example/2", "dev two"))
+    path.write_text(
+        "".join(
+            [
+                "<!DOCTYPE NETSCAPE-Bookmark-file-1>\n<DL><p>\n",
+                folder("dev", *dev),
+                folder("empty"),
+                folder("news", bookmark("https://news.example", "news")),
+                "</DL><p>\n",
+            ]
+        )
+    )
+    return str(path)
+
+
+def dump(db_file):
+    db = open_database(db_file)
+    return {folder: list(rows) for folder, rows in db.iter_folder_rows()}
+
+
+@pytest.mark.parametrize("suffix", [".json", ".sqlite"])
+@pytest.mark.parametrize("no_duplicates", [False, True])
+def test_streamed_import_matches_import(tmp_path, html_file, suffix, no_duplicates):
+    whole = str(tmp_path / f"whole{suffix}")
+    streamed = str(tmp_path / f"streamed{suffix}")
+
+    bookmarks = parse_netscape_bookmark_file(html_file, NO_DATES, "add", FLAGS)
+    count = save_bookmarks_to_db(bookmarks, whole, no_duplicates)
+    records = iter_netscape_bookmark_file(html_file, NO_DATES, "add", FLAGS)
+    streamed_count = save_bookmark_stream_to_db(
+        records, streamed, no_duplicates, batch_size=3
+    )
+
+    assert streamed_count == count
+    assert dump(streamed) == dump(whole)
+    assert len(dump(whole)["dev"]) == (7 if no_duplicates else 9)
+
+
+def rows(*urls):
+    return [{"url": url, "title": url} for url in urls]
+
+
+def urls(bookmarks):
+    return {folder: [row["url"] for row in rows] for folder, rows in bookmarks.items()}
+
+
+def test_merge_across_folders():
+    a, b, c, m, n, o = (f"https://{name}.com" for name in "abcmno")
+    merged, dropped = merge_bookmarks(
+        [
+            {"dev": rows(a, b), "news": rows(n)},
+            {"dev": rows(b, c), "music": rows(m)},
+            {"news": rows(n, o), "dev": rows(a)},
+        ]
+    )
+    assert dropped == 3
+    assert urls(merged) == {"dev": [a, b, c], "news": [n, o], "music": [m]}
+
+
+def test_merge_keeps_urls_of_other_folders():
+    # the same url under two folders is two bookmarks
+    merged, dropped = merge_bookmarks(
+        [{"dev": rows("https://a.com")}, {"news": rows("https://a.com")}]
+    )
+    assert dropped == 0
+    assert set(merged) == {"dev", "news"}
+
+
+def test_merge_compares_normalized_urls():
+    merged, dropped = merge_bookmarks(
+        [
+            {"dev": rows("https://Example.com", "https://a.com/x?q=1&r=2")},
+            {
+                "dev": rows(
+                    "https://example.com/",
+                    "HTTPS://EXAMPLE.COM",
+                    "https://a.com/x?r=2&q=1",
+                    # paths are case sensitive and their trailing slash counts
+                    "https://example.com/Docs",
+                    "https://example.com/docs",
+                    "https://example.com/docs/",
+                )
+            },
+        ]
+    )
+    assert dropped == 3
+    assert urls(merged)["dev"] == [
+        "https://Example.com",
+        "https://a.com/x?q=1&r=2",
+        "https://example.com/Docs",
+        "https://example.com/docs",
+        "https://example.com/docs/",
+    ]
+
+
+def write_export(path, *folders):
+    path.write_text(
+        "".join(
+            ["<!DOCTYPE NETSCAPE-Bookmark-file-1>\n<DL><p>\n", *folders, "</DL><p>\n"]
+        )
+    )
+    return str(path)
+
+
+@pytest.mark.parametrize("no_duplicates", [False, True])
+def test_import_several_files(tmp_path, no_duplicates):
+    first = write_export(
+        tmp_path / "first.html",
+        folder("dev", bookmark("https://Example.com", "example")),
+        folder("news", bookmark("https://news.com/a", "a")),
+    )
+    second = write_export(
+        tmp_path / "second.html",
+        folder(
+            "dev",
+            bookmark("https://example.com/", "example again"),
+            bookmark("https://rust-lang.org", "rust"),
+            # duplicated inside the same file, only --no-duplicates drops it
+            bookmark("https://RUST-lang.org/", "rust again"),
+        ),
+        folder("music", bookmark("https://music.com", "music")),
+    )
+    output = str(tmp_path / "team.json")
+    args = ["import", first, second, "-o", output, "--jobs", "2"]
+    if no_duplicates:
+        args.append("--no-duplicates")
+    result = CliRunner().invoke(cli, args, catch_exceptions=False)
+    assert result.exit_code == 0, result.output
+    assert "skipped 1 bookmarks already imported from another file" in result.output
+
+    dev = ["https://Example.com", "https://rust-lang.org"]
+    if not no_duplicates:
+        dev.append("https://RUST-lang.org/")
+    imported = dump(output)
+    imported = {folder: [url for url, _ in rows] for folder, rows in imported.items()}
+    assert imported == {
+        "dev": dev,
+        "news": ["https://news.com/a"],
+        "music": ["https://music.com"],
+    }
@@ -0,0 +1,27 @@
+from mark import profiling
+
+
+def test_nothing_is_recorded_while_disabled(monkeypatch):
+    monkeypatch.setattr(profiling, "SPANS", [])
+    monkeypatch.setattr(profiling, "ENABLED", False)
+
+    profiling.record("script.roundtrip", 0, 10)
+    with profiling.span("block"):
+        pass
+    profiling.traced()(lambda: None)()
+
+    assert profiling.SPANS == []
+
+
+def test_spans_are_recorded_while_enabled(monkeypatch):
+    monkeypatch.setattr(profiling, "SPANS", [])
+    monkeypatch.setattr(profiling, "ENABLED", True)
+
+    profiling.record("script.roundtrip", 0, 10)
+    with profiling.span("block", size=1):
+        pass
+
+    assert [(name, args) for name, _, _, _, args in profiling.SPANS] == [
+        ("script.roundtrip", {}),
+        ("block", {"size": 1}),
+    ]
@@ -0,0 +1,78 @@
+import pytest
+
+from mark.db import open_database
+from mark.search import SearchIndex, open_search_index
+
+
+def titles(index, query):
+    return [title for _, _, title, _ in index.search(query)]
+
+
+@pytest.fixture(params=[".json", ".sqlite"])
+def db_file(tmp_path, request):
+    path = str(tmp_path / f"bookmarks{request.param}")
+    db = open_database(path)
+    with db.bulk():
+        for i in range(4):
+            db.insert_bookmark("python", f"https://docs.python.org/{i}", f"python {i}")
+        db.insert_bookmark("rust", "https://doc.rust-lang.org", "rust book")
+    return path
+
+
+def test_index_is_persisted_and_reused(db_file):
+    index = open_search_index(open_database(db_file), db_file)
+    assert titles(index, "book") == ["rust book"]
+
+    reloaded = SearchIndex.load(db_file)
+    assert reloaded.docs == index.docs
+    assert not reloaded.sync(open_database(db_file))
+
+
+def test_appended_rows_are_indexed_alone(db_file):
+    index = open_search_index(open_database(db_file), db_file)
+    docs = list(index.docs)
+
+    open_database(db_file).insert_bookmark("rust", "https://tokio.rs", "tokio")
+    index = open_search_index(open_database(db_file), db_file)
+
+    assert index.docs[: len(docs)] == docs
+    assert titles(index, "tokio") == ["tokio"]
+
+
+def test_changed_folder_is_indexed_again_alone(db_file):
+    db = open_database(db_file)
+    db.insert_bookmark("rust", "https://crates.io", None)
+    index = open_search_index(db, db_file)
+    python_docs = [doc for doc in index.docs if doc[0] == "python"]
+
+    # fills the title in place, like `mark titles`
+    db.set_titles("rust", {"https://crates.io": "crates registry"})
+    index = open_search_index(open_database(db_file), db_file)
+
+    assert [doc for doc in index.docs if doc and doc[0] == "python"] == python_docs
+    assert index.dropped == 2
+    assert titles(index, "registry") == ["crates registry"]
+    assert titles(index, "book") == ["rust book"]
+
+
+def test_removed_folder_is_dropped(tmp_path):
+    db_file = str(tmp_path / "bookmarks.json")
+    db = open_database(db_file)
+    for i in range(4):
+        db.insert_bookmark("python", f"https://docs.python.org/{i}", f"python {i}")
+    db.insert_bookmark("rust", "https://doc.rust-lang.org", "rust book")
+    index = open_search_index(db, db_file)
+    assert titles(index, "rust")
+
+    db.db.drop_table("rust")
+    index = open_search_index(open_database(db_file), db_file)
+    assert titles(index, "rust") == []
+    assert index.dropped == 1
+    assert len(titles(index, "python")) == 4
+
+    # once most documents are holes the index is rebuilt
+    db.db.drop_table("python")
+    db.insert_bookmark("go", "https://go.dev", "go")
+    index = open_search_index(open_database(db_file), db_file)
+    assert index.dropped == 0
+    assert index.docs == [["go", "go", "https://go.dev"]]
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from mark.protocol import encode_frame, read_raw_frame
+from mark.server import Server
+from mark.utils import encode_message
+
+
+class FakeRofi:
+    """stands for the rofi process the script mode server talks to"""
+
+    mode = "script"
+    server_should_exit = False
+
+    def __init__(self):
+        self.killed = False
+
+    def kill_proc(self):
+        self.killed = True
+
+
+@pytest.mark.parametrize("on_selection", ["open", "copy"])
+def test_script_mode_returns_after_a_selection(monkeypatch, on_selection):
+    selected = []
+    monkeypatch.setattr(
+        f"mark.server.{on_selection}_selection",
+        lambda title, url: selected.append((title, url)),
+    )
+    rofi = FakeRofi()
+    server = Server(None, rofi_inst=rofi, on_selection=on_selection, url_meta=True)
+    server.update_state(mapping={"a": ("a", "https://a.com")}, folder="dev")
+    port = Server.get_free_port()
+
+    async def script():
+        # the rofi script: one selection, then it waits for the reply
+        for _ in range(100):
+            try:
+                reader, writer = await asyncio.open_connection("localhost", port)
+                break
+            except OSError:
+                await asyncio.sleep(0.01)
+        writer.write(encode_frame({"code": 0, "value": "a"}))
+        await writer.drain()
+        reply = await read_raw_frame(reader)
+        writer.close()
+        return reply
+
+    async def session():
+        client = asyncio.ensure_future(script())
+        try:
+            await asyncio.wait_for(server.run_server(port), timeout=5)
+        finally:
+            assert await client == encode_message("quit")
+
+    with pytest.raises(SystemExit) as exit_info:
+        asyncio.run(session())
+    assert exit_info.value.code == 0
+    assert selected == [("a", "https://a.com")]
+    assert rofi.killed
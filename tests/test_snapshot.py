@@ -0,0 +1,68 @@
+import os
+
+import orjson
+import pytest
+
+from mark.db import DataBase
+from mark.snapshot import SnapshotDataBase, open_snapshot, snapshot_path, write_snapshot
+from mark.storage import ReadOnlyError
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / "bookmarks.json")
+    db = DataBase(path)
+    with db.bulk():
+        db.insert_bookmark("dev", "https://a.com/", "a")
+        db.insert_bookmark("dev", "https://b.com", "b")
+        db.insert_bookmark("dev", "https://c.com", "a")
+        db.insert_bookmark("news", "https://d.com", "d")
+    return path
+
+
+def test_snapshot_reads_like_the_database(db_file):
+    db = DataBase(db_file)
+    write_snapshot(db)
+    snapshot = open_snapshot(db_file)
+    assert isinstance(snapshot, SnapshotDataBase)
+
+    assert sorted(snapshot.list_raw_folders()) == sorted(db.list_raw_folders())
+    assert snapshot.list_bookmarks("dev") == db.list_bookmarks("dev")
+    # the first row of a title wins, as in tinydb
+    assert snapshot.get_bookmark("dev", "a") == ("a", "https://a.com/")
+    assert snapshot.bookmark_exists_in_table("dev", "https://a.com/")
+    assert not snapshot.bookmark_exists_in_table("news", "https://a.com")
+    assert not snapshot.bookmark_exists_in_table("missing", "https://a.com")
+    assert {
+        folder: list(rows.values()) for folder, rows in snapshot.read_tables().items()
+    } == {folder: list(rows.values()) for folder, rows in db.read_tables().items()}
+    assert orjson.dumps(snapshot.signature()) == orjson.dumps(db.signature())
+
+
+def test_snapshot_is_read_only(db_file):
+    write_snapshot(DataBase(db_file))
+    snapshot = open_snapshot(db_file)
+
+    with pytest.raises(ReadOnlyError):
+        snapshot.insert_bookmark("dev", "https://e.com", "e")
+    with pytest.raises(ReadOnlyError):
+        snapshot.write(lambda: None)
+
+
+def test_stale_snapshot_is_rebuilt_when_opened(db_file):
+    write_snapshot(DataBase(db_file))
+    written = os.stat(snapshot_path(db_file)).st_mtime_ns
+
+    DataBase(db_file).insert_bookmark("news", "https://e.com", "e")
+    # writes leave the snapshot alone
+    assert os.stat(snapshot_path(db_file)).st_mtime_ns == written
+
+    snapshot = open_snapshot(db_file)
+    assert isinstance(snapshot, SnapshotDataBase)
+    assert snapshot.get_bookmark("news", "e") == ("e", "https://e.com")
+
+
+def test_snapshot_is_opt_in(db_file, tmp_path):
+    assert open_snapshot(db_file) is None
+    path = str(tmp_path / "cache" / "source.snap")
+    assert isinstance(open_snapshot(db_file, path, create=True), SnapshotDataBase)
@@ -0,0 +1,57 @@
+from mark.db import DataBase, open_database
+from mark.sqlite_db import SQLiteDataBase, is_sqlite_file
+
+
+def test_json_database_named_db_opens_as_json(tmp_path):
+    path = str(tmp_path / "bookmarks.db")
+    DataBase(path).insert_bookmark("dev", "https://example.com", "example")
+
+    assert not is_sqlite_file(path)
+    db = open_database(path)
+    assert not isinstance(db, SQLiteDataBase)
+    assert db.get_bookmark("dev", "example") == ("example", "https://example.com")
+
+
+def test_new_db_file_is_sqlite(tmp_path):
+    path = str(tmp_path / "bookmarks.db")
+    assert is_sqlite_file(path)
+
+    open_database(path).insert_bookmark("dev", "https://example.com", "example")
+    assert is_sqlite_file(path)
+    assert isinstance(open_database(path), SQLiteDataBase)
+
+
+def test_sqlite_file_with_other_suffix_is_sqlite(tmp_path):
+    path = str(tmp_path / "bookmarks.json")
+    SQLiteDataBase(path).insert_bookmark("dev", "https://example.com", "example")
+
+    assert is_sqlite_file(path)
+
+
+def test_read_tables_matches_json_shape(tmp_path):
+    db = SQLiteDataBase(str(tmp_path / "bookmarks.sqlite"))
+    with db.bulk(exclusive=True):
+        db.insert_bookmark("dev", "https://a.com", "a")
+        db.insert_bookmark("news", "https://b.com", "b")
+        db.insert_bookmark("dev", "https://c.com", "c")
+
+    tables = db.read_tables()
+    assert list(tables) == ["dev", "news"]
+    assert [row["url"] for row in tables["dev"].values()] == [
+        "https://a.com",
+        "https://c.com",
+    ]
+    assert db.cache_stats() == {"hits": 0, "misses": 0}
+
+
+def test_table_handle(tmp_path):
+    db = SQLiteDataBase(str(tmp_path / "bookmarks.sqlite"))
+    handle = db.get_table_handle("dev")
+    handle.insert({"url": "https://a.com", "title": "a"})
+    handle.insert_multiple([{"url": "https://b.com", "title": "b"}])
+
+    assert len(handle) == 2
+    assert handle.all() == [
+        {"url": "https://a.com", "title": "a"},
+        {"url": "https://b.com", "title": "b"},
+    ]
@@ -0,0 +1,99 @@
+import os
+
+import orjson
+import pytest
+
+from mark.db import DataBase
+from mark.storage import LogStorage
+
+
+def tables(storage):
+    data = storage.read() or {}
+    return {name: dict(data[name]) for name in data}
+
+
+def test_log_storage_replays_the_log(tmp_path):
+    path = str(tmp_path / "bookmarks.json")
+    db = DataBase(path, storage="log")
+    db.insert_bookmark("dev", "https://a.com", "a")
+    db.insert_bookmark("dev", "https://b.com", "b")
+    db.insert_bookmark("news", "https://c.com", "c")
+
+    # nothing was compacted yet, the reopened database is rebuilt from the log
+    assert os.path.getsize(path) == 0
+    reopened = DataBase(path, storage="log")
+    assert list(reopened.list_raw_bookmarks("dev")) == [
+        ("https://a.com", "a"),
+        ("https://b.com", "b"),
+    ]
+    assert reopened.is_folder("news")
+
+
+def test_log_storage_compaction(tmp_path):
+    path = str(tmp_path / "bookmarks.json")
+    storage = LogStorage(path, compact_every=3)
+    storage.write({"dev": {"1": {"url": "https://a.com"}}})
+    log_lines = open(path + ".wal", "rb").read()
+    assert os.path.getsize(path) == 0
+
+    # create, insert, insert: the third record triggers the compaction
+    storage.write({"dev": {"1": {"url": "https://a.com"}, "2": {"url": "b"}}})
+    assert os.path.getsize(path + ".wal") == 0
+    expected = {"dev": {"1": {"url": "https://a.com"}, "2": {"url": "b"}}}
+    assert orjson.loads(open(path, "rb").read()) == expected
+    assert tables(LogStorage(path)) == expected
+
+    # a crash between writing the snapshot and truncating the log replays
+    # records already folded in, which leaves the state unchanged
+    with open(path + ".wal", "ab") as log:
+        log.write(log_lines)
+    assert tables(LogStorage(path)) == expected
+
+
+def test_log_storage_ignores_and_drops_a_torn_tail(tmp_path):
+    path = str(tmp_path / "bookmarks.json")
+    storage = LogStorage(path)
+    storage.write({"dev": {"1": {"url": "https://a.com"}}})
+    with open(path + ".wal", "ab") as log:
+        log.write(b'[{"op": "insert", "table": "dev"')
+
+    reader = LogStorage(path)
+    assert tables(reader) == {"dev": {"1": {"url": "https://a.com"}}}
+
+    reader.write({"dev": {"1": {"url": "https://a.com"}, "2": {"url": "b"}}})
+    expected = {"dev": {"1": {"url": "https://a.com"}, "2": {"url": "b"}}}
+    assert tables(LogStorage(path)) == expected
+    assert open(path + ".wal", "rb").read().endswith(b"\n")
+
+
+def test_bulk_writes_once_on_exit(tmp_path):
+    path = str(tmp_path / "bookmarks.json")
+    db = DataBase(path)
+    db.insert_bookmark("dev", "https://a.com", "a")
+    before = os.stat(path).st_mtime_ns, open(path, "rb").read()
+
+    with db.bulk():
+        db.insert_bookmark("dev", "https://b.com", "b")
+        db.insert_bookmark("news", "https://c.com", "c")
+        # buffered, the file is untouched until the block exits
+        assert (os.stat(path).st_mtime_ns, open(path, "rb").read()) == before
+        assert db.is_folder("news")
+
+    assert list(DataBase(path).list_raw_bookmarks("dev")) == [
+        ("https://a.com", "a"),
+        ("https://b.com", "b"),
+    ]
+
+
+def test_bulk_drops_everything_when_it_raises(tmp_path):
+    path = str(tmp_path / "bookmarks.json")
+    db = DataBase(path)
+    db.insert_bookmark("dev", "https://a.com", "a")
+
+    with pytest.raises(RuntimeError):
+        with db.bulk():
+            db.insert_bookmark("dev", "https://b.com", "b")
+            raise RuntimeError
+
+    assert not db.bookmark_exists_in_table("dev", "https://b.com")
+    assert list(DataBase(path).list_raw_bookmarks("dev")) == [("https://a.com", "a")]
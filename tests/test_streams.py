@@ -0,0 +1,97 @@
+import bz2
+import gzip
+import lzma
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from mark.cli import cli
+from mark.db import open_database
+
+CODECS = {
+    ".gz": gzip.compress,
+    ".bz2": bz2.compress,
+    ".xz": lzma.compress,
+}
+MAGIC = {".gz": b"\x1f\x8b", ".bz2": b"BZh", ".xz": b"\xfd7zXZ\x00"}
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / "bookmarks.json")
+    db = open_database(path)
+    with db.bulk():
+        db.insert_bookmark("dev", "https://a.com/?q=1&r=2", "a & b")
+        db.insert_bookmark("dev", "https://b.com", "bé")
+        db.insert_bookmark("news", "https://c.com", "c")
+    return path
+
+
+def rows(db_file):
+    db = open_database(db_file)
+    return {folder: sorted(db.list_raw_bookmarks(folder)) for folder in ["dev", "news"]}
+
+
+def mark(*args, input=None):
+    result = CliRunner().invoke(cli, list(args), input=input, catch_exceptions=False)
+    assert result.exit_code == 0, result.output
+    return result
+
+
+@pytest.mark.parametrize("suffix", CODECS)
+def test_round_trip_by_suffix(db_file, tmp_path, suffix):
+    backup = str(tmp_path / f"backup{suffix}")
+    mark("export", db_file, "-o", backup)
+    # the format goes before the compression suffix
+    exported = str(tmp_path / f"backup.html{suffix}")
+    with open(exported, "rb") as file:
+        assert file.read().startswith(MAGIC[suffix])
+
+    imported = str(tmp_path / "imported.json")
+    mark("import", exported, "-o", imported)
+    assert rows(imported) == rows(db_file)
+
+
+@pytest.mark.parametrize("suffix", CODECS)
+def test_compressed_input_is_sniffed(db_file, tmp_path, suffix):
+    exported = str(tmp_path / f"backup.html{suffix}")
+    mark("export", db_file, "-o", exported)
+    # a compressed file without its suffix
+    renamed = str(tmp_path / "backup.html")
+    os.rename(exported, renamed)
+
+    imported = str(tmp_path / "imported.json")
+    mark("import", renamed, "-o", imported)
+    assert rows(imported) == rows(db_file)
+
+    streamed = str(tmp_path / "streamed.json")
+    mark("import", renamed, "--stream", "-o", streamed)
+    assert rows(streamed) == rows(db_file)
+
+
+@pytest.mark.parametrize("suffix", [None, *CODECS])
+def test_round_trip_through_standard_streams(db_file, tmp_path, suffix):
+    page = mark("export", db_file, "-o", "-").stdout_bytes
+    assert page.startswith(b"<!DOCTYPE NETSCAPE-Bookmark-file-1>")
+
+    if suffix is not None:
+        page = CODECS[suffix](page)
+    imported = str(tmp_path / "imported.json")
+    mark("import", "-", "-o", imported, input=page)
+    assert rows(imported) == rows(db_file)
+
+
+def test_zstandard_round_trip(db_file, tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    exported = str(tmp_path / "backup.html.zst")
+    mark("export", db_file, "-o", exported)
+    imported = str(tmp_path / "imported.json")
+    mark("import", exported, "-o", imported)
+    assert rows(imported) == rows(db_file)
+
+    page = zstandard.ZstdCompressor().compress(
+        mark("export", db_file, "-o", "-").stdout_bytes
+    )
+    mark("import", "-", "-o", str(tmp_path / "piped.json"), input=page)
+    assert rows(str(tmp_path / "piped.json")) == rows(db_file)
@@ -0,0 +1,267 @@
+import asyncio
+import codecs
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+import pytest
+
+from mark.db import open_database
+from mark.titles import (
+    CHUNK_SIZE,
+    MAX_HEAD_SIZE,
+    SNIFF_SIZE,
+    RateLimiter,
+    TitleExtractor,
+    backfill_titles,
+    extract_title,
+    fetch_page,
+    fetch_page_sync,
+    infer_titles,
+)
+
+HEAD = b"<html><head><title>%s</title></head>"
+
+
+class Site:
+    """what the local server saw: request paths, start times, concurrency"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.paths = []
+        self.starts = []
+        self.active = 0
+        self.max_active = 0
+        self.release = threading.Event()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send_page(self, status: int, body: bytes, length: int = None):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body) if length is None else length))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def do_GET(self):
+        site = self.server.site
+        with site.lock:
+            site.paths.append(self.path)
+            site.starts.append(time.monotonic())
+            site.active += 1
+            site.max_active = max(site.max_active, site.active)
+        try:
+            self.respond(site)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with site.lock:
+                site.active -= 1
+
+    def respond(self, site: Site):
+        name = self.path.split("?")[0].strip("/")
+        if name == "missing":
+            self.send_page(404, HEAD % b"not found")
+        elif name == "slow":
+            # longer than the client timeout
+            site.release.wait(2)
+            self.send_page(200, HEAD % b"too late")
+        elif name == "busy":
+            time.sleep(0.1)
+            self.send_page(200, HEAD % self.path.encode("ascii"))
+        elif name == "endless":
+            # the title comes first, the rest of the page only much later
+            self.send_page(200, HEAD % b"endless", length=1 << 30)
+            site.release.wait(5)
+        else:
+            self.send_page(200, HEAD % name.encode("ascii"))
+
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(("localhost", 0), Handler)
+    server.daemon_threads = True
+    server.site = Site()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.site.url = f"http://localhost:{server.server_address[1]}"
+    yield server.site
+    server.site.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(url, **options):
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return await fetch_page(session, url, **options)
+
+    return asyncio.run(run())
+
+
+def test_titles_are_inferred(site):
+    urls = [f"{site.url}/first", f"{site.url}/second"]
+    assert asyncio.run(infer_titles(urls, rate=0)) == {
+        urls[0]: "first",
+        urls[1]: "second",
+    }
+
+
+def test_connections_per_host_are_capped(site):
+    urls = [f"{site.url}/busy?{i}" for i in range(12)]
+    titles = asyncio.run(infer_titles(urls, concurrency=8, per_host=2, rate=0))
+    assert titles == {url: url.replace(site.url, "") for url in urls}
+    assert site.max_active == 2
+
+
+def test_requests_are_spaced_by_the_rate(site):
+    urls = [f"{site.url}/page?{i}" for i in range(5)]
+    asyncio.run(infer_titles(urls, concurrency=5, rate=10))
+    assert len(site.starts) == 5
+    # one request every 100ms, the first one at once
+    assert max(site.starts) - min(site.starts) >= 0.35
+
+
+def test_rate_limiter_spaces_acquisitions():
+    async def run():
+        limiter = RateLimiter(20)
+        start = time.monotonic()
+        for _ in range(5):
+            await limiter.acquire()
+        return time.monotonic() - start
+
+    assert 0.15 <= asyncio.run(run()) < 1
+
+
+def test_failed_pages_have_no_title(site):
+    info = fetch(f"{site.url}/missing")
+    assert (info.title, info.status) == (None, 404)
+
+    info = fetch(f"{site.url}/slow", timeout=0.3)
+    assert (info.title, info.status) == (None, 0)
+
+    info = fetch_page_sync(f"{site.url}/missing")
+    assert (info.title, info.status) == (None, 404)
+
+
+def test_non_http_urls_are_skipped(site):
+    urls = ["ftp://localhost/file", "file:///etc/hostname", "javascript:void(0)"]
+    assert asyncio.run(infer_titles(urls, rate=0)) == dict.fromkeys(urls)
+    assert fetch_page_sync(urls[1]).title is None
+    assert site.paths == []
+
+
+def test_download_stops_at_the_title(site):
+    start = time.monotonic()
+    info = fetch(f"{site.url}/endless", timeout=4)
+    assert (info.title, info.status) == ("endless", 200)
+    assert fetch_page_sync(f"{site.url}/endless", timeout=4).title == "endless"
+    # neither waited for the rest of the page
+    assert time.monotonic() - start < 2
+
+
+def test_backfill_titles(site, tmp_path):
+    db = open_database(str(tmp_path / "bookmarks.json"))
+    db.insert_bookmark("dev", f"{site.url}/docs", None)
+    db.insert_bookmark("dev", f"{site.url}/missing", None)
+    db.insert_bookmark("dev", f"{site.url}/named", "mine")
+
+    assert backfill_titles(db, rate=0) == (1, 2)
+    assert dict(db.list_raw_bookmarks("dev")) == {
+        f"{site.url}/docs": "docs",
+        f"{site.url}/missing": f"{site.url}/missing",
+        f"{site.url}/named": "mine",
+    }
+
+
+def extract(page: bytes, encoding: str = None, chunk_size: int = 7):
+    """title of `page` fed in small chunks, so tags and characters are split"""
+    chunks = (page[i:i + chunk_size] for i in range(0, len(page), chunk_size))
+    return extract_title(chunks, encoding)
+
+
+def test_charset_of_the_content_type():
+    page = "<html><head><title>café crème</title>".encode("latin-1")
+    assert extract(page, "ISO-8859-1") == "café crème"
+    # an unknown charset is ignored
+    assert extract("<title>café</title>".encode("utf-8"), "no-such") == "café"
+
+
+def test_charset_of_the_meta_tag():
+    page = '<head><meta charset="windows-1251"><title>Привет</title>'
+    assert extract(page.encode("cp1251")) == "Привет"
+    page = (
+        '<head><meta http-equiv="Content-Type" content="text/html; charset=koi8-r">'
+        "<title>Привет</title>"
+    )
+    assert extract(page.encode("koi8_r")) == "Привет"
+    # the header wins over the meta tag
+    assert extract(page.encode("utf-8"), "utf-8") == "Привет"
+
+
+def test_meta_charset_is_only_sniffed_at_the_start():
+    padding = "<!-- %s -->" % ("x" * SNIFF_SIZE)
+    page = f'<head>{padding}<meta charset="latin-1"><title>café</title>'
+    # too late for the meta tag, decoded as utf-8
+    assert extract(page.encode("latin-1")) == "caf\ufffd"
+
+
+def test_byte_order_mark():
+    page = "<head><title>héllo</title>"
+    assert extract(codecs.BOM_UTF8 + page.encode("utf-8"), "latin-1") == "héllo"
+    assert extract(page.encode("utf-16")) == "héllo"
+    assert extract(codecs.BOM_UTF16_BE + page.encode("utf-16-be")) == "héllo"
+
+
+def test_title_is_cleaned_up():
+    page = b"<head><title>\n  a   spread\n  title </title></head>"
+    assert extract(page) == "a spread title"
+    assert extract(b"<title>fish &amp; chips</title>") == "fish & chips"
+
+
+def test_og_title_fallback():
+    page = (
+        b'<head><meta property="og:title" content="open  graph">'
+        b'<meta name="twitter:title" content="twitter"><title> </title></head>'
+    )
+    assert extract(page) == "open graph"
+    page = b'<head><meta name="twitter:title" content="twitter"></head>'
+    assert extract(page) == "twitter"
+    # a title of its own wins
+    page = b'<head><meta property="og:title" content="og"><title>own</title>'
+    assert extract(page) == "own"
+
+
+def test_page_without_title():
+    assert extract(b"<html><head></head><body><h1>hi</h1></body></html>") is None
+    assert extract(b"") is None
+    assert extract(b"not html at all") is None
+
+
+def test_parsing_stops_at_the_title():
+    extractor = TitleExtractor("utf-8")
+    assert not extractor.feed_bytes(b"<head><title>fir")
+    assert extractor.feed_bytes(b"st</title><title>second</title>")
+    assert extractor.feed_bytes(b"<title>third</title>")
+    assert extractor.result() == "first"
+
+
+def test_reading_stops_at_max_head_size():
+    read = []
+
+    def chunks():
+        # a head too large to hold a title worth waiting for
+        while True:
+            read.append(CHUNK_SIZE)
+            yield b"<!-- " + b"x" * (CHUNK_SIZE - 9) + b" -->"
+
+    assert extract_title(chunks(), "utf-8") is None
+    assert sum(read) == MAX_HEAD_SIZE
+
+    late = b"<head>" + b" " * MAX_HEAD_SIZE + b"<title>late</title>"
+    assert extract(late, "utf-8", chunk_size=CHUNK_SIZE) is None
@@ -0,0 +1,113 @@
+import pytest
+
+from mark import urlcache
+from mark.urlcache import PageInfo, URLCache, cache_key
+from mark.utils import sync_infer_url_title
+
+HOUR = 3600
+
+
+class Clock:
+    """stands for the time module, every reading is a second later"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(urlcache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = URLCache(str(tmp_path / "urls.sqlite"), ttl=10 * HOUR, negative_ttl=HOUR)
+    yield cache
+    cache.close()
+
+
+def page(title, fetched_at, status=200):
+    return PageInfo(title, "https://a.com/", status, fetched_at)
+
+
+def test_titles_expire_after_the_ttl(cache, clock):
+    cache.put_many({"https://a.com": page("a", clock.now - 9 * HOUR)})
+    assert cache.get("https://a.com").title == "a"
+
+    clock.now += 2 * HOUR
+    assert cache.get("https://a.com") is None
+
+
+def test_failures_expire_sooner(cache, clock):
+    cache.put_many(
+        {
+            "https://a.com": page("a", clock.now - 2 * HOUR),
+            "https://b.com": page(None, clock.now - 2 * HOUR, status=404),
+            "https://c.com": page(None, clock.now - HOUR / 2, status=0),
+        }
+    )
+    assert set(cache.get_many(["https://a.com", "https://b.com", "https://c.com"])) == {
+        "https://a.com",
+        "https://c.com",
+    }
+    assert cache.get("https://c.com").failed
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = URLCache(str(tmp_path / "urls.sqlite"), max_entries=3)
+    for name in "abc":
+        cache.put(f"https://{name}.com", name, None, 200)
+    # reading a keeps it, b is now the least recently used
+    assert cache.get("https://a.com").title == "a"
+
+    cache.put("https://d.com", "d", None, 200)
+    found = cache.get_many(f"https://{name}.com" for name in "abcd")
+    assert sorted(found) == ["https://a.com", "https://c.com", "https://d.com"]
+    cache.close()
+
+
+def test_urls_are_canonicalised():
+    assert cache_key("https://EXAMPLE.com/a?y=2&x=1#top") == cache_key(
+        " https://example.com/a?x=1&y=2 "
+    )
+    assert cache_key("https://example.com/a%20b") == cache_key(
+        "https://example.com/a b"
+    )
+    # paths are case sensitive, schemes tell pages apart
+    assert cache_key("https://example.com/A") != cache_key("https://example.com/a")
+    assert cache_key("http://example.com/") != cache_key("https://example.com/")
+
+
+def test_lookups_share_the_canonical_entry(cache):
+    cache.put("https://Example.com/page#intro", "page", None, 200)
+    found = cache.get_many(["https://example.com/page", "https://EXAMPLE.com/page"])
+    assert {url: info.title for url, info in found.items()} == {
+        "https://example.com/page": "page",
+        "https://EXAMPLE.com/page": "page",
+    }
+
+
+def test_cached_title_is_not_fetched_again(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    fetched = []
+
+    def fetch_page_sync(url):
+        fetched.append(url)
+        return PageInfo("fetched", url, 200, urlcache.time.time())
+
+    monkeypatch.setattr("mark.titles.fetch_page_sync", fetch_page_sync)
+    assert sync_infer_url_title("https://a.com/post#comments") == "fetched"
+    assert sync_infer_url_title("https://A.com/post") == "fetched"
+    assert fetched == ["https://a.com/post#comments"]
+
+    cache = URLCache()
+    cache.put("https://b.com", "cached", "https://b.com", 200)
+    cache.close()
+    assert sync_infer_url_title("https://b.com") == "cached"
+    assert fetched == ["https://a.com/post#comments"]